@@ -123,7 +123,7 @@ def ql_elf_check_archtype(self):
         return elfdata
 
     with open(path, "rb") as f:
-        elfdata = f.read()[:20]
+        elfdata = f.read(20)
 
     ident = getident()
     ostype = None
@@ -166,7 +166,7 @@ def ql_macho_check_archtype(path):
         return machodata  
     
     with open(path, "rb") as f:
-        machodata = f.read()[:32]
+        machodata = f.read(32)
         
     ident = getident()
 
@@ -193,7 +193,7 @@ def ql_x86_setup_gdt_segment(ql, GDT_ADDR, GDT_LIMIT, seg_reg, index, SEGMENT_AD
             elif ql.arch == QL_X8664:
                 GDT_ADDR = GDT_ADDR + QL_X8664_GDT_ADDR_PADDING
         if GDTTYPE == "CS":        
-            ql.dprint("[+] FreeBSD %s GDT_ADDR is 0x%x" % (GDTTYPE, GDT_ADDR))
+            ql.dprint("[+] FreeBSD %s GDT_ADDR is 0x%x", GDTTYPE, GDT_ADDR)
             ql.uc.mem_map(GDT_ADDR, GDT_LIMIT)
     
     if ql.ostype == QL_MACOS and GDTTYPE == "CS":
@@ -203,7 +203,7 @@ def ql_x86_setup_gdt_segment(ql, GDT_ADDR, GDT_LIMIT, seg_reg, index, SEGMENT_AD
             elif ql.arch == QL_X8664:
                 GDT_ADDR = GDT_ADDR + QL_X8664_GDT_ADDR_PADDING
 
-        ql.dprint("[+] GDT_ADDR is 0x%x" % (GDT_ADDR))
+        ql.dprint("[+] GDT_ADDR is 0x%x", GDT_ADDR)
         ql.uc.mem_map(GDT_ADDR, GDT_LIMIT)
     
     # create GDT entry, then write GDT entry into GDT table
@@ -216,7 +216,7 @@ def ql_x86_setup_gdt_segment(ql, GDT_ADDR, GDT_LIMIT, seg_reg, index, SEGMENT_AD
 
     # create segment index, point segment register to this selector
     selector = create_selector(index, RPORT)
-    ql.dprint("[+] %s : 0x%x" % (GDTTYPE, selector))
+    ql.dprint("[+] %s : 0x%x", GDTTYPE, selector)
     ql.uc.reg_write(seg_reg, selector)
 
 
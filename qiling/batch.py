@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+Run many binaries or shellcodes across a pool of worker processes
+
+A job is a dict:
+
+    binary     {"filename": path, "rootfs": path, "argv": [...], "stdin": path}
+    shellcode  {"shellcode": path, "arch": "x86", "os": "linux", "rootfs": path, "format": "bin"}
+
+plus optional "id", "output" (default "off") and "timeout" (microseconds, see
+Qiling.set_timeout). Every job runs in a worker process, workers are replaced after
+max_jobs jobs so state kept in Qiling class attributes cannot pile up, and a worker
+dying in the middle of a job (e.g. unicorn segfault) only fails that job.
+
+Results are dicts streamed back as soon as each job is done:
+
+    id, status ("ok", "error", "crash", "timeout"), exit_code, stdout, syscalls
+    (name -> count), time (seconds), exception, traceback
+
+"timeout" is either a job stopped by its own "timeout" or a worker killed after
+hard_timeout seconds.
+"""
+
+import json, os, time, traceback
+import multiprocessing
+from multiprocessing.connection import wait
+from collections import Counter, deque
+
+QL_BATCH_STDOUT_LIMIT = 0x100000
+
+
+def ql_batch_load_manifest(path):
+    """
+    jobs from a JSON list or a JSON lines file
+    """
+    with open(path) as f:
+        data = f.read()
+
+    if data.lstrip().startswith("["):
+        jobs = json.loads(data)
+    else:
+        jobs = [json.loads(line) for line in data.splitlines() if line.strip()]
+
+    for idx, job in enumerate(jobs):
+        job.setdefault("id", idx)
+    return jobs
+
+
+def ql_batch_shellcode_jobs(directory, arch, ostype, rootfs=None):
+    """
+    one shellcode job per file in directory, *.hex files are read as hex
+    """
+    jobs = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if os.path.isfile(path):
+            fmt = "hex" if name.endswith(".hex") else "bin"
+            jobs.append({"id": name, "shellcode": path, "arch": arch, "os": ostype, "rootfs": rootfs, "format": fmt})
+    return jobs
+
+
+def ql_batch_read_shellcode(path, fmt="bin"):
+    with open(path, "rb") as f:
+        data = f.read()
+    if fmt == "hex":
+        # same \x31\xc0 text as qltool shellcode --hex
+        data = bytes.fromhex(data.decode().replace("\\x", "").replace("x", ""))
+    return data
+
+
+def _ql_batch_timed_out(ql, elapsed):
+    """
+    ql.run() returns quietly when ql.timeout expires, tell that apart from an exit
+    """
+    if not ql.timeout:
+        return False
+    tm = ql.thread_management
+    if tm is not None and tm.main_thread is not None:
+        # multithread time is the scheduler's clock, not the host's
+        return tm.main_thread.is_timeout()
+    # unicorn timeouts are host time
+    return elapsed * 1000000 >= ql.timeout
+
+
+def ql_batch_run_job(job, stdout_limit=QL_BATCH_STDOUT_LIMIT):
+    """
+    run one job in the current process, never raises
+    """
+    from qiling import Qiling
+    from qiling.os.posix.filestruct import ql_buffer
+
+    result = {
+        "id": job.get("id", None),
+        "status": "ok",
+        "exit_code": None,
+        "stdout": "",
+        "syscalls": {},
+        "time": 0,
+        "exception": None,
+        "traceback": None,
+    }
+    syscalls = Counter()
+    stdout = ql_buffer(name="stdout")
+    begin = time.time()
+
+    try:
+        stdin = ql_buffer(name="stdin")
+        if job.get("stdin", None) is not None:
+            with open(job["stdin"], "rb") as f:
+                stdin.set(f.read())
+
+        output = job.get("output", "off")
+        if job.get("shellcode", None) is not None:
+            shellcoder = ql_batch_read_shellcode(job["shellcode"], job.get("format", "bin"))
+            ql = Qiling(shellcoder=shellcoder, archtype=job["arch"], ostype=job["os"], rootfs=job.get("rootfs", None), output=output, stdin=stdin, stdout=stdout)
+        else:
+            argv = [job["filename"]] + list(job.get("argv", []))
+            ql = Qiling(argv, job["rootfs"], output=output, stdin=stdin, stdout=stdout)
+
+        if job.get("timeout", None):
+            ql.set_timeout(job["timeout"])
+
+        if ql.syscall_table is not None:
+            def count_syscall(ql, syscall_num, params):
+                entry = ql.syscall_table.get(syscall_num)
+                syscalls[entry.name if entry is not None else syscall_num] += 1
+
+            ql.syscall_table.hook_pre(count_syscall)
+
+        run_begin = time.time()
+        ql.run()
+        result["exit_code"] = ql.exit_code
+        if _ql_batch_timed_out(ql, time.time() - run_begin):
+            result["status"] = "timeout"
+    except Exception as e:
+        result["status"] = "error"
+        # QlErrorBase puts itself in args, repr() of it never ends
+        result["exception"] = "%s: %s" % (type(e).__name__, e)
+        result["traceback"] = traceback.format_exc()
+
+    result["time"] = time.time() - begin
+    result["stdout"] = bytes(stdout.written[ : stdout_limit]).decode("utf-8", "backslashreplace")
+    result["syscalls"] = {str(name): count for name, count in syscalls.items()}
+    return result
+
+
+def _ql_batch_worker(conn, max_jobs, stdout_limit):
+    # jobs come in one at a time, None means quit
+    for _ in range(max_jobs):
+        job = conn.recv()
+        if job is None:
+            break
+        conn.send(ql_batch_run_job(job, stdout_limit))
+    conn.close()
+
+
+class BatchWorker:
+    def __init__(self, ctx, max_jobs, stdout_limit):
+        self.conn, child_conn = ctx.Pipe()
+        self.process = ctx.Process(target=_ql_batch_worker, args=(child_conn, max_jobs, stdout_limit), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs_left = max_jobs
+        self.job = None
+        self.started = 0
+
+    def submit(self, job):
+        self.job = job
+        self.started = time.time()
+        self.jobs_left -= 1
+        self.conn.send(job)
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (OSError, EOFError):
+            pass
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+
+class BatchRunner:
+    """
+    process pool running jobs with crash isolation and worker recycling
+    """
+    def __init__(self, workers=None, max_jobs=16, hard_timeout=None, stdout_limit=QL_BATCH_STDOUT_LIMIT):
+        self.workers = workers if workers else (os.cpu_count() or 1)
+        self.max_jobs = max_jobs
+        # seconds before a worker stuck in a job is killed
+        self.hard_timeout = hard_timeout
+        self.stdout_limit = stdout_limit
+        self.ctx = multiprocessing.get_context()
+
+    def __failed(self, job, status, exception, elapsed):
+        return {
+            "id": job.get("id", None),
+            "status": status,
+            "exit_code": None,
+            "stdout": "",
+            "syscalls": {},
+            "time": elapsed,
+            "exception": exception,
+            "traceback": None,
+        }
+
+    def run(self, jobs):
+        """
+        yields one result per job, in completion order
+        """
+        pending = deque(jobs)
+        idle = []
+        busy = {}
+
+        try:
+            while pending or busy:
+                while pending and len(idle) + len(busy) < self.workers:
+                    idle.append(BatchWorker(self.ctx, self.max_jobs, self.stdout_limit))
+
+                while pending and idle:
+                    worker = idle.pop()
+                    worker.submit(pending.popleft())
+                    busy[worker.conn] = worker
+
+                timeout = None
+                if self.hard_timeout is not None:
+                    now = time.time()
+                    timeout = max(0, min(w.started + self.hard_timeout for w in busy.values()) - now)
+
+                sentinels = {w.process.sentinel: w for w in busy.values()}
+                ready = wait(list(busy) + list(sentinels), timeout)
+
+                finished = set()
+                for obj in ready:
+                    worker = busy.get(obj, None) or sentinels.get(obj, None)
+                    if worker is None or worker in finished:
+                        continue
+
+                    try:
+                        result = worker.conn.recv() if worker.conn.poll() else None
+                    except (EOFError, OSError):
+                        result = None
+
+                    finished.add(worker)
+                    del busy[worker.conn]
+
+                    if result is not None:
+                        yield result
+                        if worker.jobs_left > 0:
+                            idle.append(worker)
+                        else:
+                            worker.process.join()
+                            worker.conn.close()
+                        continue
+
+                    # the worker died in the middle of the job
+                    worker.process.join()
+                    worker.conn.close()
+                    yield self.__failed(worker.job, "crash", "worker exited with code %s" % worker.process.exitcode, time.time() - worker.started)
+
+                if self.hard_timeout is not None:
+                    now = time.time()
+                    for worker in [w for w in busy.values() if now - w.started >= self.hard_timeout]:
+                        del busy[worker.conn]
+                        worker.kill()
+                        yield self.__failed(worker.job, "timeout", "killed after %s seconds" % self.hard_timeout, now - worker.started)
+        finally:
+            for worker in idle:
+                worker.stop()
+                worker.process.join()
+                worker.conn.close()
+            for worker in busy.values():
+                worker.kill()
+
+
+def ql_batch_run(jobs, workers=None, max_jobs=16, hard_timeout=None):
+    return BatchRunner(workers, max_jobs, hard_timeout).run(jobs)
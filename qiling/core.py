@@ -14,25 +14,15 @@ from qiling.os.utils import *
 from qiling.arch.utils import *
 from qiling.os.linux.thread import *
 from qiling.gdbserver.gdblistener import GDBSession
+from qiling.hook import *
+from qiling.os.memory import VMAManager, Memory
+from qiling.trace import TraceRecorder
+from qiling.snapshot import SnapshotManager
+from qiling.fuzz import ql_fuzz_loop
 
 __version__ = "0.9"
 
 
-def catch_KeyboardInterrupt(ql):
-    def decorator(func):
-        def wrapper(*args, **kw):
-            try:
-                return func(*args, **kw)
-            except BaseException as e:
-                # ql.nprint("Received a request from the user to stop!")
-                ql.stop(stop_event=THREAD_EVENT_UNEXECPT_EVENT)
-                ql.internal_exception = e
-
-        return wrapper
-
-    return decorator
-
-
 class Qiling:
     arch = ''
     archbit = ''
@@ -53,7 +43,6 @@ class Qiling:
     patch_lib = []
     patched_lib = []
     loadbase = 0
-    map_info = []
     timeout = 0
     until_addr = 0
     byte = 0
@@ -94,7 +83,9 @@ class Qiling:
             mmap_start=0,
             stack_address=0,
             stack_size=0,
-            interp_base=0
+            interp_base=0,
+            demand_paging=False,
+            lazy_dlls=False
     ):
 
         self.output = output
@@ -106,6 +97,7 @@ class Qiling:
         self.argv = argv
         self.env = env
         self.libcache = libcache
+        self.lazy_dlls = lazy_dlls
         self.log_console = log_console
         self.log_dir = log_dir
         self.log_split = log_split
@@ -115,10 +107,16 @@ class Qiling:
         self.stack_size = stack_size
         self.interp_base = interp_base
         self.dict_posix_syscall = dict()
+        self.syscall_table = None
+        self.hooks = HookManager(self)
         self.user_defined_api = {}
         self.global_thread_id = 0
         self.gdb = None
         self.gdbsession = None
+        self.trace_recorder = None
+        self.snapshot_manager = None
+        self.vma = VMAManager(self, demand_paging=demand_paging)
+        self.mem = Memory(self)
 
         if self.ostype and type(self.ostype) == str:
             self.ostype = self.ostype.lower()
@@ -233,33 +231,51 @@ class Qiling:
 
         self.__enable_bin_patch()
         runner = self.build_os_execution("runner")
-        runner(self)
-
-        if self.gdb is not None:
-            self.gdbsession.run()
+        try:
+            try:
+                runner(self)
+            finally:
+                if self.trace_recorder is not None:
+                    self.trace_recorder.close()
+                ql_log_flush()
+
+            if self.gdb is not None:
+                self.gdbsession.run()
+        finally:
+            self.__release_log_files()
+
+    def __release_log_files(self):
+        # log files are reopened if anything logs after the run
+        loggers = [getattr(self, "log_file_fd", None)]
+        tm = getattr(self, "thread_management", None)
+        if tm is not None:
+            threads = list(tm.run_queue) + list(tm.blocking_threads) + tm.ending_threads
+            loggers += [t.log_file_fd for t in threads]
+        for logger in loggers:
+            ql_release_logging_file(logger)
+
+    def __del__(self):
+        self.__release_log_files()
 
     def nprint(self, *args, **kw):
+        # arguments are formatted by logging, only when the message is written
+        if self.output == QL_OUT_OFF:
+            return
+
         if self.thread_management is not None and self.thread_management.cur_thread is not None:
             fd = self.thread_management.cur_thread.log_file_fd
         else:
             fd = self.log_file_fd
 
-        if self.output != QL_OUT_OFF:
-            fd.info(*args, **kw)
-
-        if fd is not None:
-            if isinstance(fd, logging.FileHandler):
-                fd.emit()
-            elif isinstance(fd, logging.StreamHandler):
-                fd.flush()
+        fd.info(*args, **kw)
 
     def dprint(self, *args, **kw):
         if self.output == QL_OUT_DEBUG:
             self.log_file_fd.debug(*args, **kw)
         elif self.output == QL_OUT_DUMP:
             msg = args[0]
-            msg += b'\n' if isinstance(msg, bytes) else '\n'
-            self.log_file_fd.debug(msg, **kw)
+            msg += b'\n' if isinstance(msg, (bytes, bytearray)) else '\n'
+            self.log_file_fd.debug(msg, *args[1:], **kw)
 
     def addr_to_str(self, addr, short=False, endian="big"):
         return ql_addr_to_str(self, addr, short, endian)
@@ -270,6 +286,8 @@ class Qiling:
     def set_syscall(self, syscall_cur, syscall_new):
         if self.ostype in (QL_LINUX, QL_MACOS, QL_FREEBSD):
             self.dict_posix_syscall[syscall_cur] = syscall_new
+            if self.syscall_table is not None:
+                self.syscall_table.set(syscall_cur, syscall_new)
         elif self.ostype == QL_WINDOWS:
             self.set_api(syscall_cur, syscall_new)
 
@@ -277,191 +295,69 @@ class Qiling:
         if self.ostype == QL_WINDOWS:
             self.user_defined_api[api_name] = api_func
 
+    def trace(self, path, insn=False, syscall=False, mem=False):
+        # record basic blocks (and optionally instructions, syscalls, memory accesses) to path
+        self.trace_recorder = TraceRecorder(self, path, insn, syscall, mem)
+        return self.trace_recorder
+
+    def snapshot(self, compare=False):
+        # capture cpu, memory and os state, restore it with ql.restore(snap). compare
+        # finds guest stores on restore instead of hooking them, see qiling.snapshot
+        if self.snapshot_manager is None:
+            self.snapshot_manager = SnapshotManager(self, compare)
+        self.snapshot_manager.compare = compare
+        return self.snapshot_manager.take()
+
+    def restore(self, snap):
+        self.snapshot_manager.restore(snap)
+
+    def fuzz_loop(self, start, end, input_setter, iterations=1, timeout=None, report=None):
+        # persistent mode: reset to a snapshot taken at start before every input
+        return ql_fuzz_loop(self, start, end, input_setter, iterations, timeout, report)
+
     def hook_code(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, addr, size, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_CODE, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_CODE, QL_HOOK_KIND_CODE, callback, user_data, begin, end)
 
     def hook_intr(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, intno, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, intno, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, intno)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_INTR, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_INTR, QL_HOOK_KIND_INTR, callback, user_data, begin, end)
 
     def hook_block(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, addr, size, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_BLOCK, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_BLOCK, QL_HOOK_KIND_CODE, callback, user_data, begin, end)
 
     def hook_mem_unmapped(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_UNMAPPED, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_UNMAPPED, QL_HOOK_KIND_MEM_INVALID, callback, user_data, begin, end)
 
     def hook_mem_read_invalid(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_READ_INVALID, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_READ_INVALID, QL_HOOK_KIND_MEM_INVALID, callback, user_data, begin, end)
 
     def hook_mem_write_invalid(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_WRITE_INVALID, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_WRITE_INVALID, QL_HOOK_KIND_MEM_INVALID, callback, user_data, begin, end)
 
     def hook_mem_fetch_invalid(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_FETCH_INVALID, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_FETCH_INVALID, QL_HOOK_KIND_MEM_INVALID, callback, user_data, begin, end)
 
     def hook_mem_invalid(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_VALID, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_VALID, QL_HOOK_KIND_MEM_INVALID, callback, user_data, begin, end)
 
     # a convenient API to set callback for a single address
     def hook_address(self, callback, address, user_data=None):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, _addr, _size, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, user_data)
-            else:
-                # callback does not require user_data
-                callback(self)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_CODE, _callback, (user_data, callback), address, address)
+        return self.hooks.add_address(callback, address, user_data)
 
     def hook_mem_read(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_READ, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_READ, QL_HOOK_KIND_MEM, callback, user_data, begin, end)
 
     def hook_mem_write(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_WRITE, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_WRITE, QL_HOOK_KIND_MEM, callback, user_data, begin, end)
 
     def hook_mem_fetch(self, callback, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback(uc, access, addr, size, value, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, addr, size, value, user_data)
-            else:
-                # callback does not require user_data
-                callback(self, addr, size, value)
-
-        # pack user_data & callback for wrapper _callback
-        self.uc.hook_add(UC_HOOK_MEM_FETCH, _callback, (user_data, callback), begin, end)
+        return self.hooks.add(UC_HOOK_MEM_FETCH, QL_HOOK_KIND_MEM, callback, user_data, begin, end)
 
     def hook_insn(self, callback, arg1, user_data=None, begin=1, end=0):
-        @catch_KeyboardInterrupt(self)
-        def _callback_x86_syscall(uc, pack_data):
-            # unpack what we packed for hook_add()
-            user_data, callback = pack_data
-            if user_data:
-                callback(self, user_data)
-            else:
-                # callback does not require user_data
-                callback(self)
-
-        if arg1 == UC_X86_INS_SYSCALL:
-            # pack user_data & callback for wrapper _callback
-            self.uc.hook_add(UC_HOOK_INSN, _callback_x86_syscall, (user_data, callback), begin, end, arg1)
-        else:
-            self.uc.hook_add(UC_HOOK_INSN, callback, user_data, begin, end, arg1)
+        return self.hooks.add_insn(callback, arg1, user_data, begin, end)
+
+    # remove a hook, using the handle returned by hook_*
+    def hook_del(self, hook):
+        self.hooks.remove(hook)
 
     def stack_push(self, data):
         self.archfunc.stack_push(data)
@@ -625,8 +521,9 @@ class Qiling:
             self.uc.mem_write(self.loadbase + addr, code)
 
     def enable_lib_patch(self):
+        lib_base = self.__get_lib_bases()
         for addr, code, filename in self.patch_lib:
-            self.uc.mem_write(self.__get_lib_base(filename) + addr, code)
+            self.uc.mem_write(lib_base.get(filename, -1) + addr, code)
 
     def set_timeout(self, microseconds):
         self.timeout = microseconds
@@ -634,61 +531,28 @@ class Qiling:
     def set_exit(self, until_addr):
         self.until_addr = until_addr
 
+    @property
+    def map_info(self):
+        return self.vma.map_info
+
+    @map_info.setter
+    def map_info(self, map_info):
+        self.vma.map_info = map_info
+
     def insert_map_info(self, mem_s, mem_e, mem_p, mem_info):
-        tmp_map_info = []
-        insert_flag = 0
-        map_info = self.map_info
-        if len(map_info) == 0:
-            tmp_map_info.append([mem_s, mem_e, mem_p, mem_info])
-        else:
-            for s, e, p, info in map_info:
-                if e <= mem_s:
-                    tmp_map_info.append([s, e, p, info])
-                    continue
-                if s >= mem_e:
-                    if insert_flag == 0:
-                        insert_flag = 1
-                        tmp_map_info.append([mem_s, mem_e, mem_p, mem_info])
-                    tmp_map_info.append([s, e, p, info])
-                    continue
-                if s < mem_s:
-                    tmp_map_info.append([s, mem_s, mem_p, info])
-
-                if s == mem_s:
-                    pass
-
-                if insert_flag == 0:
-                    insert_flag = 1
-                    tmp_map_info.append([mem_s, mem_e, mem_p, mem_info])
-                
-                if e > mem_e:
-                    tmp_map_info.append([mem_e, e, mem_p, info])
-                
-                if e == mem_e:
-                    pass
-            if insert_flag == 0:
-                tmp_map_info.append([mem_s, mem_e, mem_p, mem_info])
-        map_info = []
-        map_info.append(tmp_map_info[0])
-
-        for s, e, p, info in tmp_map_info[1 : ]:
-            if s == map_info[-1][1] and info == map_info[-1][2]:
-                map_info[-1][1] = e
-            else:
-                map_info.append([s, e, p, info])
-
-        self.map_info = map_info
+        self.vma.insert(mem_s, mem_e, mem_p, mem_info)
 
     def show_map_info(self):
         self.nprint("[+] Start      End        Perm.  Path")
         for s, e, p, info in self.map_info:
             self.nprint("[+] %08x - %08x - %s    %s" % (s, e, p, info))
 
-    def __get_lib_base(self, filename):
+    def __get_lib_bases(self):
+        # file name -> lowest mapping of it
+        lib_base = {}
         for s, e, p, info in self.map_info:
-            if os.path.split(info)[1] == filename:
-                return s
-        return -1
+            lib_base.setdefault(os.path.split(info)[1], s)
+        return lib_base
 
     def add_fs_mapper(self, fm, to):
         self.fs_mapper.append([fm, to])
@@ -698,6 +562,9 @@ class Qiling:
             td = self.thread_management.cur_thread
             td.stop()
             td.stop_event = stop_event
+        if self.ostype == QL_WINDOWS:
+            # keep the thread scheduler from resuming
+            self.RUN = False
         self.uc.emu_stop()
 
     def gdbserver(self, ip=None, port=None):
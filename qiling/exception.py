@@ -59,6 +59,9 @@ class QlErrorSyscallError(QlErrorBase):
 class QlErrorSyscallNotFound(QlErrorBase):
     pass
 
+class QlErrorSnapshot(QlErrorBase):
+    pass
+
 
 def QlPrintException(msg):
     exc_type, exc_value, exc_traceback = sys.exc_info()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+Persistent mode fuzzing: run start -> end over and over, resetting memory and os state
+with a snapshot instead of building a new Qiling for every input
+
+Windows iterations go through the thread manager like ql.run(), so threads created by
+the target are scheduled. Linux multithread mode is not supported: its scheduler only
+runs a process from the loader to the end, use a single threaded Qiling.
+"""
+
+import time
+
+from unicorn import *
+
+from qiling.arch.filetype import *
+from qiling.exception import *
+
+# how an iteration ended
+QL_FUZZ_END = 0
+QL_FUZZ_EXIT = 1
+QL_FUZZ_CRASH = 2
+QL_FUZZ_TIMEOUT = 3
+QL_FUZZ_ERROR = 4
+
+QL_FUZZ_STATUS = {
+    QL_FUZZ_END: "end",
+    QL_FUZZ_EXIT: "exit",
+    QL_FUZZ_CRASH: "crash",
+    QL_FUZZ_TIMEOUT: "timeout",
+    QL_FUZZ_ERROR: "error",
+}
+
+
+class FuzzResult:
+    __slots__ = ("iteration", "status", "exit_code", "pc", "error")
+
+    def __init__(self, iteration, status, exit_code=None, pc=0, error=None):
+        self.iteration = iteration
+        self.status = status
+        self.exit_code = exit_code
+        self.pc = pc
+        # UcError of a crash, exception raised by a hook for errors
+        self.error = error
+
+    def __repr__(self):
+        return "FuzzResult(%d, %s, exit_code=%r, pc=0x%x, error=%r)" % (
+            self.iteration, QL_FUZZ_STATUS[self.status], self.exit_code, self.pc, self.error)
+
+
+def ql_fuzz_run_to(ql, start):
+    # run the normal loader path (dynamic linker, lib patches) up to start
+    until_addr = ql.until_addr
+    ql.until_addr = start
+    try:
+        ql.run()
+    finally:
+        ql.until_addr = until_addr
+
+    if ql.pc != start:
+        raise QlErrorExecutionStop("[!] fuzz_loop start address 0x%x was not reached" % start)
+
+
+def ql_fuzz_iteration(ql, iteration, start, end, timeout):
+    ql.exit_code = None
+    begin = time.time()
+
+    try:
+        if ql.ostype == QL_WINDOWS:
+            ql.thread_manager.run(start, end, timeout)
+        else:
+            ql.uc.emu_start(start, end, timeout)
+    except UcError as e:
+        return FuzzResult(iteration, QL_FUZZ_CRASH, pc=ql.pc, error=e)
+
+    pc = ql.pc
+    if ql.internal_exception is not None:
+        error = ql.internal_exception
+        ql.internal_exception = None
+        return FuzzResult(iteration, QL_FUZZ_ERROR, pc=pc, error=error)
+
+    if pc == end:
+        return FuzzResult(iteration, QL_FUZZ_END, pc=pc)
+
+    if ql.exit_code is not None or (ql.ostype == QL_WINDOWS and not ql.RUN):
+        return FuzzResult(iteration, QL_FUZZ_EXIT, exit_code=ql.exit_code, pc=pc)
+
+    if timeout and (time.time() - begin) * 1000000 >= timeout:
+        return FuzzResult(iteration, QL_FUZZ_TIMEOUT, pc=pc)
+
+    # stopped by a hook
+    return FuzzResult(iteration, QL_FUZZ_EXIT, pc=pc)
+
+
+def ql_fuzz_loop(ql, start, end, input_setter, iterations=1, timeout=None, report=None):
+    """
+    input_setter(ql, iteration) places the input (memory, a ql_buffer stdin, a syscall
+    override...), returning False ends the loop early. report(ql, result) gets every
+    FuzzResult. Returns the number of iterations per status.
+    """
+    if ql.ostype != QL_WINDOWS and ql.multithread:
+        raise QlErrorNotImplemented("[!] fuzz_loop does not support multithread mode")
+
+    if timeout is None:
+        timeout = ql.timeout
+
+    if ql.pc != start:
+        ql_fuzz_run_to(ql, start)
+
+    snap = ql.snapshot()
+    summary = {status: 0 for status in QL_FUZZ_STATUS}
+
+    for iteration in range(iterations):
+        if iteration:
+            ql.restore(snap)
+
+        if input_setter(ql, iteration) is False:
+            break
+
+        result = ql_fuzz_iteration(ql, iteration, start, end, timeout)
+        summary[result.status] += 1
+        if report is not None:
+            report(ql, result)
+
+    ql.restore(snap)
+    return summary
@@ -20,6 +20,9 @@ GDB_SIGNAL_STOP = 17
 GDB_SIGNAL_TRAP = 5
 GDB_SIGNAL_BUS  = 10
 
+# the largest packet we take, gdb sizes its m/X transfers after it
+GDB_PACKET_SIZE = 0x20000
+
 def checksum(data):
     checksum = 0
     for c in data:
@@ -30,14 +33,30 @@ def checksum(data):
     return checksum & 0xff
 
 
+_xml_cache = {}
+
+def target_xml(arch, name):
+    """
+    contents of a target description file, None when there is no such file
+    """
+    key = (arch, name)
+    if key not in _xml_cache:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "xml", ql_arch_convert_str(arch), name)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            _xml_cache[key] = f.read()
+    return _xml_cache[key]
+
+
 class GDBSession(object):
     """docstring for GDBSession"""
     def __init__(self, ql, clientsocket, exit_point, mappings):
         super(GDBSession, self).__init__()
         self.ql             = ql
         self.clientsocket   = clientsocket
-        self.netin          = clientsocket.makefile('r')
-        self.netout         = clientsocket.makefile('w')
+        self.netbuf         = bytearray()
+        self.no_ack         = False
         self.last_pkt       = None
         self.en_vcont       = False
         self.pc_reg         = self.ql.reg_pc
@@ -53,44 +72,31 @@ class GDBSession(object):
 
 
     def bin_to_escstr(self, rawbin):
-        rawbin_escape = ""
-
-        def incomplete_hex_check(hexchar):
-            if len(hexchar) == 1:
-                hexchar = "0" + hexchar
-            return hexchar
-
-        for a in rawbin:
-
-            # The binary data representation uses 7d (ASCII ‘}’) as an escape character. 
-            # Any escaped byte is transmitted as the escape character followed by the original character XORed with 0x20. 
-            # For example, the byte 0x7d would be transmitted as the two bytes 0x7d 0x5d. The bytes 0x23 (ASCII ‘#’), 0x24 (ASCII ‘$’), and 0x7d (ASCII ‘}’) 
-            # must always be escaped. Responses sent by the stub must also escape 0x2a (ASCII ‘*’), 
-            # so that it is not interpreted as the start of a run-length encoded sequence (described next).
-
-            if a in (42,35,36,125):
-                a = a ^ 0x20
-                a = (str(hex(a)[2:]))
-                a = incomplete_hex_check(a)
-                a = str("7d%s" % a)
-            else:
-                a = (str(hex(a)[2:]))
-                a = incomplete_hex_check(a)
-
-            rawbin_escape += a
-
-        return unhexlify(rawbin_escape)
+        # The binary data representation uses 7d (ASCII ‘}’) as an escape character. 
+        # Any escaped byte is transmitted as the escape character followed by the original character XORed with 0x20. 
+        # For example, the byte 0x7d would be transmitted as the two bytes 0x7d 0x5d. The bytes 0x23 (ASCII ‘#’), 0x24 (ASCII ‘$’), and 0x7d (ASCII ‘}’) 
+        # must always be escaped. Responses sent by the stub must also escape 0x2a (ASCII ‘*’), 
+        # so that it is not interpreted as the start of a run-length encoded sequence (described next).
+        return re.sub(rb'[#$}*]', lambda m: b'}' + bytes([m.group(0)[0] ^ 0x20]), bytes(rawbin))
+
+    def escstr_to_bin(self, escstr):
+        return re.sub(rb'}(.)', lambda m: bytes([m.group(1)[0] ^ 0x20]), escstr, flags=re.S)
+
+    def xfer_reply(self, data, subcmd):
+        # qXfer reads come as annex:offset,length, 'm' tells there is more to read
+        offset, length = (int(x, 16) for x in subcmd.split(':')[-1].split(','))
+        chunk = data[offset : offset + length]
+        self.send(('m' if offset + length < len(data) else 'l') + chunk)
 
     def close(self):
-        self.netin.close()
-        self.netout.close()
         self.clientsocket.close()
 
     def run(self):
 
         while self.receive() == 'Good':
             pkt = self.last_pkt
-            self.send_raw('+')
+            if not self.no_ack:
+                self.send_raw('+')
 
             def handle_qmark(subcmd):
                 def gdbqmark_converter(arch):
@@ -125,7 +131,9 @@ class GDBSession(object):
 
             def handle_c(subcmd):
                 self.qldbg.resume_emu(self.ql.uc.reg_read(self.pc_reg))
-                if self.qldbg.bp_list in ([self.ql.elf_entry], [self.ql.entry_point]):
+                if self.qldbg.hit_watch is not None:
+                    self.send('T%.2x%s:%x;' % ((GDB_SIGNAL_TRAP, ) + self.qldbg.hit_watch))
+                elif self.qldbg.hit_bp is None:
                     self.send("W00")
                 else:
                     self.send(('S%.2x' % GDB_SIGNAL_TRAP))
@@ -233,24 +241,19 @@ class GDBSession(object):
                 addr = int(addr, 16)
                 size = int(size, 16)
 
-                try:
-                    tmp = ''
-                    for s in range(size):
-                        mem = self.ql.uc.mem_read(addr + s, 1)
-                        mem = "".join(
-                            [str("{:02x}".format(ord(c))) for c in mem.decode('latin1')])
-                        tmp += mem
-                    self.send(tmp)
-
-                except:
+                # gdb takes the readable part of a partly mapped range
+                mem = self.ql.mem.read_available(addr, size)
+                if size and not mem:
                     self.send('E14')
+                else:
+                    self.send(mem.hex())
 
 
             def handle_M(subcmd):
                 addr, data = subcmd.split(',')
                 size, data = data.split(':')
                 addr = int(addr, 16)
-                data = int(data, 16)
+                data = bytes.fromhex(data)
                 try:
                     self.ql.mem_write(addr, data)
                     self.send('OK')
@@ -258,6 +261,20 @@ class GDBSession(object):
                     self.send('E01')
 
 
+            def handle_X(subcmd):
+                # binary payload, split on the first separators only
+                addr, data = subcmd.split(',', 1)
+                size, data = data.split(':', 1)
+                addr = int(addr, 16)
+                data = self.escstr_to_bin(data.encode('latin-1'))
+                try:
+                    if data:
+                        self.ql.mem_write(addr, data)
+                    self.send('OK')
+                except:
+                    self.send('E01')
+
+
             def handle_p(subcmd):
                 reg_index = int(subcmd, 16)
                 reg_value = None
@@ -353,16 +370,17 @@ class GDBSession(object):
 
 
             def handle_Q(subcmd):
-                if subcmd.startswith('StartNoAckMode'):
+                if subcmd.startswith('StartNoAckMode'):
                     self.send('OK')
+                    self.no_ack = True
 
-                elif subcmd.startswith('DisableRandomization'):
+                elif subcmd.startswith('DisableRandomization'):
                     self.send('OK')
 
-                elif subcmd.startswith('ProgramSignals'):
+                elif subcmd.startswith('ProgramSignals'):
                     self.send('OK')
 
-                elif subcmd.startswith('NonStop'):
+                elif subcmd.startswith('NonStop'):
                     self.send('OK')
 
                 elif subcmd.startswith('PassSignals'):
@@ -374,22 +392,37 @@ class GDBSession(object):
             def handle_q(subcmd):
                 if subcmd.startswith('Supported:'):
                     if self.ql.multithread == False:
-                        self.send("PacketSize=3fff;QPassSignals+;QProgramSignals+;QStartupWithShell+;QEnvironmentHexEncoded+;QEnvironmentReset+;QEnvironmentUnset+;QSetWorkingDir+;QCatchSyscalls+;qXfer:libraries-svr4:read+;augmented-libraries-svr4-read+;qXfer:auxv:read+;qXfer:spu:read+;qXfer:spu:write+;qXfer:siginfo:read+;qXfer:siginfo:write+;qXfer:features:read+;QStartNoAckMode+;qXfer:osdata:read+;multiprocess+;fork-events+;vfork-events+;exec-events+;QNonStop+;QDisableRandomization+;qXfer:threads:read+;ConditionalTracepoints+;TraceStateVariables+;TracepointSource+;DisconnectedTracing+;StaticTracepoints+;InstallInTrace+;qXfer:statictrace:read+;qXfer:traceframe-info:read+;EnableDisableTracepoints+;QTBuffer:size+;tracenz+;ConditionalBreakpoints+;BreakpointCommands+;QAgent+;swbreak+;hwbreak+;qXfer:exec-file:read+;vContSupported+;QThreadEvents+;no-resumed+")
+                        self.send("PacketSize=%x;qXfer:memory-map:read+;QPassSignals+;QProgramSignals+;QStartupWithShell+;QEnvironmentHexEncoded+;QEnvironmentReset+;QEnvironmentUnset+;QSetWorkingDir+;QCatchSyscalls+;qXfer:libraries-svr4:read+;augmented-libraries-svr4-read+;qXfer:auxv:read+;qXfer:spu:read+;qXfer:spu:write+;qXfer:siginfo:read+;qXfer:siginfo:write+;qXfer:features:read+;QStartNoAckMode+;qXfer:osdata:read+;multiprocess+;fork-events+;vfork-events+;exec-events+;QNonStop+;QDisableRandomization+;qXfer:threads:read+;ConditionalTracepoints+;TraceStateVariables+;TracepointSource+;DisconnectedTracing+;StaticTracepoints+;InstallInTrace+;qXfer:statictrace:read+;qXfer:traceframe-info:read+;EnableDisableTracepoints+;QTBuffer:size+;tracenz+;ConditionalBreakpoints+;BreakpointCommands+;QAgent+;swbreak+;hwbreak+;qXfer:exec-file:read+;vContSupported+;QThreadEvents+;no-resumed+" % GDB_PACKET_SIZE)
 
                 elif subcmd.startswith('Xfer:features:read'):
                     xfercmd_file    = subcmd.split(':')[3]
-                    xfercmd_abspath = os.path.dirname(os.path.abspath(__file__))
-                    xml_folder      = ql_arch_convert_str(self.ql.arch)
-                    xfercmd_file    = os.path.join(xfercmd_abspath,"xml",xml_folder, xfercmd_file)                        
-
-                    if os.path.exists(xfercmd_file):
-                        f = open(xfercmd_file, 'r')
-                        file_contents = f.read()
-                        self.send("l%s" % file_contents)
+                    file_contents   = target_xml(self.ql.arch, xfercmd_file)
+
+                    if file_contents is not None:
+                        self.xfer_reply(file_contents, subcmd)
                     else:
                         self.ql.nprint("gdb> xml file not found: %s" % (xfercmd_file))
                         exit(1)
 
+                elif subcmd.startswith('Xfer:memory-map:read::'):
+                    # gdb refuses anything outside the map, so it is what unicorn has
+                    # mapped (map_info leaves out e.g. the stack below the initial sp)
+                    # and what demand paging will map on first touch
+                    regions = [(s, e + 1) for s, e, _ in self.ql.uc.mem_regions()]
+                    regions += [(s, e) for s, e, _ in self.ql.vma.reserved]
+                    merged = []
+                    for s, e in sorted(regions):
+                        if merged and s <= merged[-1][1]:
+                            merged[-1][1] = max(merged[-1][1], e)
+                        else:
+                            merged.append([s, e])
+
+                    xml_memory_map = "<memory-map>"
+                    for s, e in merged:
+                        xml_memory_map += ("<memory type=\"ram\" start=\"0x%x\" length=\"0x%x\"/>" % (s, e - s))
+                    xml_memory_map += "</memory-map>"
+                    self.xfer_reply(xml_memory_map, subcmd)
+
                 elif subcmd.startswith('Xfer:threads:read::0,'):
                     file_contents = ("<threads>\r\n<thread id=\"2048\" core=\"3\" name=\"" + str(self.ql.filename[0].split('/')[-1]) + "\"/>\r\n</threads>")
                     self.send("l" + file_contents)
@@ -578,16 +611,11 @@ class GDBSession(object):
                     if os.path.exists(self.lib_abspath) and not (self.lib_path).startswith("/proc"):
 
                         with open(self.lib_abspath, "rb") as f:
-                            preadheader = f.read()
-
-                        if offset != 0:
-                            shift_count = offset + count
-                            read_offset = preadheader[offset:shift_count]
-                        else:
-                            read_offset = preadheader[offset:count]
-
-                        preadheader_len = len(preadheader)
+                            f.seek(offset)
+                            read_offset = f.read(count)
+                            preadheader_len = os.fstat(f.fileno()).st_size
 
+                        read_len = len(read_offset)
                         read_offset = self.bin_to_escstr(read_offset)
 
                         if count == 1 and (preadheader_len >= offset):
@@ -597,7 +625,7 @@ class GDBSession(object):
                                 self.send('F1;\x00')
 
                         elif count > 1:
-                            self.send(b'F' + (str(hex(count)[2:]).encode()) + b';' + (read_offset))
+                            self.send(b'F' + (str(hex(read_len)[2:]).encode()) + b';' + (read_offset))
 
                         else:
                             self.send("F0;")
@@ -633,16 +661,11 @@ class GDBSession(object):
 
 
             def handle_s(subcmd):
-                current_address = self.qldbg.current_address
-                if current_address is None:
-                    entry_point = self.qldbg.entry_point
-                    if entry_point is not None:
-                        self.qldbg.soft_bp = True
-                        self.qldbg.resume_emu(entry_point)
+                self.qldbg.step(self.ql.uc.reg_read(self.pc_reg))
+                if self.qldbg.hit_watch is not None:
+                    self.send('T%.2x%s:%x;' % ((GDB_SIGNAL_TRAP, ) + self.qldbg.hit_watch))
                 else:
-                    self.qldbg.soft_bp = True
-                    self.qldbg.resume_emu()
-                self.send('S%.2x' % GDB_SIGNAL_TRAP)
+                    self.send('S%.2x' % GDB_SIGNAL_TRAP)
 
 
             def handle_Z(subcmd):
@@ -656,6 +679,13 @@ class GDBSession(object):
                         self.send('OK')
                     except:
                         self.send('E22')
+                elif ztype in ('2', '3', '4'):
+                    ztype, address, length = data.split(',')
+                    try:
+                        self.qldbg.watch_insert(ztype, int(address, 16), int(length, 16))
+                        self.send('OK')
+                    except:
+                        self.send('E22')
                 else:
                     self.send('E22')
 
@@ -668,7 +698,10 @@ class GDBSession(object):
                     type = data[0]
                     addr = int(data[1], 16)
                     length = data[2]
-                    self.qldbg.bp_remove(type, addr, length)
+                    if type in ('2', '3', '4'):
+                        self.qldbg.watch_remove(type, addr, int(length, 16))
+                    else:
+                        self.qldbg.bp_remove(type, addr, length)
                     self.send('OK')
                 except:
                     self.send('E22')
@@ -688,6 +721,7 @@ class GDBSession(object):
                 'H': handle_H,
                 'm': handle_m,
                 'M': handle_M,
+                'X': handle_X,
                 'p': handle_p,
                 'P': handle_P,
                 'q': handle_q,
@@ -714,33 +748,35 @@ class GDBSession(object):
 
     def receive(self):
         '''Receive a packet from a GDB client'''
-        csum = 0
-        state = 'Finding SOP'
-        packet = ''
+        netbuf = self.netbuf
         try:
             while True:
-                c = self.netin.read(1)
-                # self.ql.dprint(c)
-                if c == '\x03':
+                start = netbuf.find(b'$')
+                # CTRL+C only counts between packets, X payloads may hold a 0x03
+                interrupt = netbuf.find(b'\x03', 0, start if start >= 0 else len(netbuf))
+                if interrupt >= 0:
+                    del netbuf[ : interrupt + 1]
                     return 'Error: CTRL+C'
 
-                if len(c) != 1:
-                    return 'Error: EOF'
-
-                if state == 'Finding SOP':
-                    if c == '$':
-                        state = 'Finding EOP'
-                elif state == 'Finding EOP':
-                    if c == '#':
-                        if csum != int(self.netin.read(2), 16):
+                if start >= 0:
+                    end = netbuf.find(b'#', start)
+                    if end >= 0 and len(netbuf) >= end + 3:
+                        packet = bytes(netbuf[start + 1 : end])
+                        csum = int(netbuf[end + 1 : end + 3], 16)
+                        del netbuf[ : end + 3]
+                        if csum != checksum(packet):
                             raise Exception('invalid checksum')
-                        self.last_pkt = packet
+                        # latin-1 keeps binary payloads byte for byte
+                        self.last_pkt = packet.decode('latin-1')
                         return 'Good'
-                    else:
-                        packet += c
-                        csum = (csum + ord(c)) & 0xff
                 else:
-                    raise Exception('should not be here')
+                    # acks, nothing to keep
+                    netbuf.clear()
+
+                data = self.clientsocket.recv(GDB_PACKET_SIZE)
+                if not data:
+                    return 'Error: EOF'
+                netbuf += data
         except:
             self.close()
             raise
@@ -749,14 +785,10 @@ class GDBSession(object):
     def send(self, msg):
         """Send a packet to the GDB client"""
         if type(msg) == str:
-            self.send_raw('$%s#%.2x' % (msg, checksum(msg)))
-        else:
-            self.clientsocket.send(b'$%s#%.2x' % (msg, checksum(msg)))
-            self.netout.flush()
+            msg = msg.encode()
 
+        self.clientsocket.sendall(b'$%s#%.2x' % (msg, checksum(msg)))
         self.ql.dprint("gdb> send: $%s#%.2x" % (msg, checksum(msg)))
 
     def send_raw(self, r):
-        self.netout.write(r)
-        self.netout.flush()
-
+        self.clientsocket.sendall(r.encode())
@@ -4,23 +4,45 @@
 # Built on top of Unicorn emulator (www.unicorn-engine.org)
 from qiling.gdbserver.reg_table import *
 
+# Z packet type -> stop reply name of watchpoints
+QL_WATCH_KINDS = {
+    '2': 'watch',
+    '3': 'rwatch',
+    '4': 'awatch'
+    }
+
+# widest memory access, accesses starting this far before a watched range can hit it
+QL_WATCH_ACCESS_MAX = 0x10
+
 
 class Qldbg(object):
+    """
+    breakpoints are single address hooks, added and removed with Z0/z0, so code
+    without a breakpoint runs without calling back into Python. watchpoints are
+    memory hooks scoped to the watched range
+    """
     def __init__(self):
         self.current_address = 0x0
-        self.current_address_size = 0x0
-        self.last_bp = 0x0
         self.ql = None
         self.entry_point = None
         self.exit_point = None
-        self.soft_bp = False
-        self.has_soft_bp = False
 
-        self.bp_list = []
+        # address -> hook handle
+        self.breakpoints = {}
         self.mapping = []
         self.entry_context = {}
         self.breakpoint_count = 0x0
         self.skip_bp_count = 0x0
+        # breakpoint the emulation is resumed from, not reported again
+        self.skip_bp = None
+        # breakpoint the last run stopped at, None when it ran to its end
+        self.hit_bp = None
+        # (type, address, length) -> hook handles
+        self.watchpoints = {}
+        # (kind, address) of the watchpoint the last run stopped at
+        self.hit_watch = None
+        # memory a watched write changed, put back before the write is replayed
+        self.watch_restore = None
 
 
     def initialize(self, ql, exit_point=None, mappings=None):
@@ -28,57 +50,111 @@ class Qldbg(object):
         self.current_address = self.entry_point = self.ql.entry_point
         self.exit_point = exit_point
         self.mapping = mappings
-        self.ql.hook_code(self.dbg_hook)
 
 
-    def dbg_hook(self, ql, address, size):
-        """
-        Modified this function for qiling.gdbserver by kabeor from https://github.com/iGio90/uDdbg
-        """
-        try:
-            self.mapping.append([hex(address), size])
-            self.current_address = address
+    def bp_hook(self, ql):
+        address = ql.pc
+        if address == self.skip_bp:
+            self.skip_bp = None
+            return
 
-            hit_soft_bp = False
-
-            if self.soft_bp:
-                self.soft_bp = False
-                hit_soft_bp = True
-
-            if address != self.last_bp and address in self.bp_list or self.has_soft_bp:
-                if self.skip_bp_count > 0:
-                    self.skip_bp_count -= 1
-                else:
-                    self.breakpoint_count += 1
-                    ql.stop()
-
-                    self.last_bp = address
-                    self.ql.nprint("gdb> breakpoint: 0x%x" % address)
-            elif address == self.last_bp:
-                self.last_bp = 0
-            self.has_soft_bp = hit_soft_bp
-            if self.current_address + size == self.exit_point:
-                self.ql.dprint("gdb> emulation entrypoint at 0x%x" % (self.entry_point))
-                self.ql.dprint("gdb> emulation exitpoint at 0x%x" % (self.exit_point))
-        except KeyboardInterrupt as ex:
-            self.ql.nprint("gdb> paused at 0x%x, instruction size = %u" % (address, size))
-            ql.stop()
+        if self.skip_bp_count > 0:
+            self.skip_bp_count -= 1
+            return
+
+        self.breakpoint_count += 1
+        self.hit_bp = address
+        ql.stop()
+        self.ql.nprint("gdb> breakpoint: 0x%x" % address)
 
 
     def bp_insert(self, addr):
-        if addr not in self.bp_list:
-            self.bp_list.append(addr)
+        if addr not in self.breakpoints:
+            self.breakpoints[addr] = self.ql.hook_address(self.bp_hook, addr)
             self.ql.nprint('gdb> breakpoint added at: 0x%x' % addr)
 
 
     def bp_remove(self, type, addr, len):
-        self.bp_list.remove(addr)
+        self.ql.hook_del(self.breakpoints.pop(addr))
         self.ql.nprint('gdb> breakpoint remove: 0x%x' % addr)
 
 
-    def resume_emu(self, address=None, skip_bp=0):
+    def watch_insert(self, type, addr, length):
+        if (type, addr, length) in self.watchpoints:
+            return
+
+        kind = QL_WATCH_KINDS[type]
+        begin = max(addr - QL_WATCH_ACCESS_MAX + 1, 0)
+        end = addr + length - 1
+
+        def watch_hook(ql, address, size, value, write):
+            if address + size <= addr or address > end:
+                return
+            if write:
+                self.watch_restore = (address, bytes(ql.mem.read(address, size)))
+            self.hit_watch = (kind, max(address, addr))
+            ql.stop()
+            self.ql.nprint("gdb> %s: 0x%x" % (kind, address))
+
+        hooks = []
+        if type in ('2', '4'):
+            hooks.append(self.ql.hook_mem_write(lambda ql, address, size, value: watch_hook(ql, address, size, value, True), begin=begin, end=end))
+        if type in ('3', '4'):
+            hooks.append(self.ql.hook_mem_read(lambda ql, address, size, value: watch_hook(ql, address, size, value, False), begin=begin, end=end))
+        self.watchpoints[(type, addr, length)] = hooks
+        self.ql.nprint('gdb> %s added at: 0x%x' % (kind, addr))
+
+
+    def watch_remove(self, type, addr, length):
+        for hook in self.watchpoints.pop((type, addr, length)):
+            self.ql.hook_del(hook)
+        self.ql.nprint('gdb> %s remove: 0x%x' % (QL_WATCH_KINDS[type], addr))
+
+
+    def watch_finish(self):
+        """
+        unicorn stops a watched access halfway, with the pc still on the instruction:
+        undo the write and run the instruction once more with the watchpoints off
+        """
+        if self.watch_restore is not None:
+            address, data = self.watch_restore
+            self.watch_restore = None
+            self.ql.mem.write(address, data)
+
+        hooks = [hook for hooks in self.watchpoints.values() for hook in hooks]
+        for hook in hooks:
+            hook.disable()
+        pc = self.ql.pc
+        self.skip_bp = pc if pc in self.breakpoints else None
+        try:
+            self.ql.uc.emu_start(pc, self.exit_point, count=1)
+        finally:
+            for hook in hooks:
+                hook.enable()
+
+
+    def save_entry_context(self):
+        if len(self.entry_context) == 0:
+            self.entry_context = {
+                'memory': {},
+                'regs': {}
+            }
+            for maps in self.mapping:
+                map_address = int(maps[0], 16)
+                map_len = maps[1]
+                self.entry_context['memory'][map_address] = bytes(self.ql.uc.mem_read(map_address, map_len))
+
+            for r in arch_reg[self.ql.arch]:
+                try:
+                    self.entry_context['regs'][r] = self.ql.uc.reg_read(r)
+                except Exception as ex:
+                    pass
+
+
+    def resume_emu(self, address=None, skip_bp=0, count=0):
         """
-        Modified this function for qiling.gdbserver by kabeor from https://github.com/iGio90/uDdbg
+        run from address (the current address by default) until a breakpoint, the
+        exit point, or count instructions when count is given
         """
         if address is not None:
             self.current_address = address
@@ -86,22 +162,18 @@ class Qldbg(object):
         self.skip_bp_count = skip_bp
         if self.exit_point is not None:
             self.ql.nprint('gdb> resume at: 0x%x' % self.current_address)
+            self.save_entry_context()
 
-            if len(self.entry_context) == 0:
-                self.entry_context = {
-                    'memory': {},
-                    'regs': {}
-                }
-                map_list = self.mapping
-                for maps in map_list:
-                    map_address = int(maps[0], 16)
-                    map_len = maps[1]
-                    self.entry_context['memory'][map_address] = bytes(self.ql.uc.mem_read(map_address, map_len))
-
-                for r in arch_reg[self.ql.arch]:
-                    try:
-                        self.entry_context['regs'][r] = self.ql.uc.reg_read(r)
-                    except Exception as ex:
-                        pass
             start_addr = self.current_address
-            self.ql.uc.emu_start(start_addr, self.exit_point)
+            self.skip_bp = start_addr if start_addr in self.breakpoints else None
+            self.hit_bp = None
+            self.hit_watch = None
+            self.ql.uc.emu_start(start_addr, self.exit_point, count=count)
+            if self.hit_watch is not None:
+                self.watch_finish()
+            self.skip_bp = None
+            self.current_address = self.ql.pc
+
+
+    def step(self, address=None):
+        self.resume_emu(address, count=1)
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+Hook multiplexer used by Qiling.hook_*
+
+Instead of one Unicorn hook (and one Python round-trip) per user callback, every
+hook type gets a single Unicorn hook per disjoint address range, and callbacks are
+dispatched through an interval index. Callbacks covering the whole address space
+share one Unicorn hook, disabled callbacks are taken out of the index entirely.
+"""
+
+from bisect import bisect_right
+
+from unicorn import *
+from unicorn.x86_const import UC_X86_INS_SYSCALL
+
+from qiling.os.linux.thread import THREAD_EVENT_UNEXECPT_EVENT
+
+QL_HOOK_ADDR_MIN = 0
+QL_HOOK_ADDR_MAX = 0xffffffffffffffff
+
+# hook kinds, they decide how callbacks are invoked
+QL_HOOK_KIND_CODE = 1
+QL_HOOK_KIND_INTR = 2
+QL_HOOK_KIND_MEM = 3
+QL_HOOK_KIND_MEM_INVALID = 4
+
+# pseudo hook type for single address hooks
+QL_HOOK_ADDRESS = -1
+
+
+def catch_KeyboardInterrupt(ql):
+    def decorator(func):
+        def wrapper(*args, **kw):
+            try:
+                return func(*args, **kw)
+            except BaseException as e:
+                # ql.nprint("Received a request from the user to stop!")
+                ql.stop(stop_event=THREAD_EVENT_UNEXECPT_EVENT)
+                ql.internal_exception = e
+
+        return wrapper
+
+    return decorator
+
+
+class Hook:
+    """
+    handle returned by Qiling.hook_*, pass it to Qiling.hook_del to remove the hook
+    """
+    def __init__(self, manager, hook_type, callback, user_data, begin, end):
+        self.manager = manager
+        self.hook_type = hook_type
+        self.callback = callback
+        self.user_data = user_data
+        # begin > end means the whole address space, like in unicorn
+        if begin > end:
+            begin, end = QL_HOOK_ADDR_MIN, QL_HOOK_ADDR_MAX
+        self.begin = begin
+        self.end = end
+        self.enabled = True
+        # unicorn handle, only used by instruction hooks
+        self.uc_handle = None
+
+    def enable(self):
+        if not self.enabled:
+            self.enabled = True
+            self.manager.refresh(self)
+
+    def disable(self):
+        if self.enabled:
+            self.enabled = False
+            self.manager.refresh(self)
+
+    def remove(self):
+        self.manager.remove(self)
+
+
+class HookSlot:
+    """
+    all callbacks of one hook type, plus the unicorn hooks serving them
+    """
+    def __init__(self, hook_type, kind):
+        self.hook_type = hook_type
+        self.kind = kind
+        self.hooks = []
+        # (begin, end) -> unicorn hook handle
+        self.uc_handles = {}
+        # interval index: sorted segment starts and the callbacks active in each segment
+        self.starts = []
+        self.segments = []
+        # set when every enabled callback covers the whole address space
+        self.flat = None
+
+    def build(self):
+        hooks = [h for h in self.hooks if h.enabled]
+
+        if all(h.begin == QL_HOOK_ADDR_MIN and h.end == QL_HOOK_ADDR_MAX for h in hooks):
+            self.flat = tuple(hooks)
+            self.starts = []
+            self.segments = []
+            return [(QL_HOOK_ADDR_MIN, QL_HOOK_ADDR_MAX)] if hooks else []
+
+        self.flat = None
+        bounds = set()
+        for h in hooks:
+            bounds.add(h.begin)
+            if h.end < QL_HOOK_ADDR_MAX:
+                bounds.add(h.end + 1)
+        self.starts = sorted(bounds)
+        self.segments = [tuple(h for h in hooks if h.begin <= start <= h.end) for start in self.starts]
+
+        # merge overlapping or adjacent ranges, each component gets one unicorn hook
+        ranges = []
+        for begin, end in sorted((h.begin, h.end) for h in hooks):
+            if ranges and begin <= ranges[-1][1] + 1:
+                if end > ranges[-1][1]:
+                    ranges[-1][1] = end
+            else:
+                ranges.append([begin, end])
+        return [tuple(r) for r in ranges]
+
+    def lookup(self, address):
+        if self.flat is not None:
+            return self.flat
+        idx = bisect_right(self.starts, address) - 1
+        if idx < 0:
+            return ()
+        return self.segments[idx]
+
+
+class HookManager:
+    def __init__(self, ql):
+        self.ql = ql
+        self.uc = None
+        self.slots = {}
+        # single address hooks: address -> [Hook], each address gets its own unicorn hook
+        self.address_hooks = {}
+        self.address_uc_handles = {}
+
+    def __check_uc(self):
+        # a new Uc (e.g. after execve) starts without any hook, like it always did
+        if self.uc is not self.ql.uc:
+            self.uc = self.ql.uc
+            self.slots = {}
+            self.address_hooks = {}
+            self.address_uc_handles = {}
+
+    def __dispatcher(self, kind):
+        ql = self.ql
+
+        if kind == QL_HOOK_KIND_CODE:
+            @catch_KeyboardInterrupt(ql)
+            def _callback(uc, addr, size, slot):
+                for h in slot.lookup(addr):
+                    if h.user_data:
+                        h.callback(ql, addr, size, h.user_data)
+                    else:
+                        # callback does not require user_data
+                        h.callback(ql, addr, size)
+
+        elif kind == QL_HOOK_KIND_INTR:
+            @catch_KeyboardInterrupt(ql)
+            def _callback(uc, intno, slot):
+                for h in slot.flat:
+                    if h.user_data:
+                        h.callback(ql, intno, h.user_data)
+                    else:
+                        h.callback(ql, intno)
+
+        elif kind == QL_HOOK_KIND_MEM:
+            @catch_KeyboardInterrupt(ql)
+            def _callback(uc, access, addr, size, value, slot):
+                for h in slot.lookup(addr):
+                    if h.user_data:
+                        h.callback(ql, addr, size, value, h.user_data)
+                    else:
+                        h.callback(ql, addr, size, value)
+
+        else:
+            # invalid memory access is handled if any of the callbacks says so
+            @catch_KeyboardInterrupt(ql)
+            def _callback(uc, access, addr, size, value, slot):
+                handled = False
+                for h in slot.lookup(addr):
+                    if h.user_data:
+                        ret = h.callback(ql, addr, size, value, h.user_data)
+                    else:
+                        ret = h.callback(ql, addr, size, value)
+                    if ret:
+                        handled = True
+                return handled
+
+        return _callback
+
+    def add(self, hook_type, kind, callback, user_data=None, begin=1, end=0):
+        self.__check_uc()
+        slot = self.slots.get(hook_type, None)
+        if slot is None:
+            slot = HookSlot(hook_type, kind)
+            slot.dispatcher = self.__dispatcher(kind)
+            self.slots[hook_type] = slot
+
+        if kind == QL_HOOK_KIND_INTR:
+            # interrupts have no address to filter on
+            begin, end = 1, 0
+
+        h = Hook(self, hook_type, callback, user_data, begin, end)
+        slot.hooks.append(h)
+        self.update(hook_type)
+        return h
+
+    def add_address(self, callback, address, user_data=None):
+        self.__check_uc()
+        h = Hook(self, QL_HOOK_ADDRESS, callback, user_data, address, address)
+        self.address_hooks.setdefault(address, []).append(h)
+        self.__update_address(address)
+        return h
+
+    def add_insn(self, callback, insn, user_data=None, begin=1, end=0):
+        self.__check_uc()
+        ql = self.ql
+        h = Hook(self, UC_HOOK_INSN, callback, user_data, begin, end)
+
+        if insn == UC_X86_INS_SYSCALL:
+            @catch_KeyboardInterrupt(ql)
+            def _callback_x86_syscall(uc, h):
+                if h.enabled:
+                    if h.user_data:
+                        h.callback(ql, h.user_data)
+                    else:
+                        # callback does not require user_data
+                        h.callback(ql)
+
+            h.uc_handle = self.uc.hook_add(UC_HOOK_INSN, _callback_x86_syscall, h, begin, end, insn)
+        else:
+            h.uc_handle = self.uc.hook_add(UC_HOOK_INSN, callback, user_data, begin, end, insn)
+        return h
+
+    def remove(self, h):
+        if h.hook_type == UC_HOOK_INSN:
+            if h.uc_handle is not None and self.uc is self.ql.uc:
+                self.uc.hook_del(h.uc_handle)
+            h.uc_handle = None
+            return
+
+        if h.hook_type == QL_HOOK_ADDRESS:
+            hooks = self.address_hooks.get(h.begin, [])
+            if h in hooks:
+                hooks.remove(h)
+                self.__update_address(h.begin)
+            return
+
+        slot = self.slots.get(h.hook_type, None)
+        if slot is not None and h in slot.hooks:
+            slot.hooks.remove(h)
+            self.update(h.hook_type)
+
+    def refresh(self, h):
+        if self.uc is not self.ql.uc:
+            return
+
+        if h.hook_type == QL_HOOK_ADDRESS:
+            self.__update_address(h.begin)
+        elif h.hook_type != UC_HOOK_INSN:
+            # instruction hooks check h.enabled themselves
+            self.update(h.hook_type)
+
+    def update(self, hook_type):
+        slot = self.slots.get(hook_type, None)
+        if slot is None:
+            return
+
+        ranges = slot.build()
+
+        for r in list(slot.uc_handles):
+            if r not in ranges:
+                self.uc.hook_del(slot.uc_handles.pop(r))
+
+        for begin, end in ranges:
+            if (begin, end) not in slot.uc_handles:
+                if begin == QL_HOOK_ADDR_MIN and end == QL_HOOK_ADDR_MAX:
+                    # the whole address space, as unicorn spells it
+                    uc_begin, uc_end = 1, 0
+                else:
+                    uc_begin, uc_end = begin, end
+                slot.uc_handles[(begin, end)] = self.uc.hook_add(slot.hook_type, slot.dispatcher, slot, uc_begin, uc_end)
+
+    def __update_address(self, address):
+        ql = self.ql
+        hooks = tuple(h for h in self.address_hooks.get(address, []) if h.enabled)
+        uc_handle = self.address_uc_handles.get(address, None)
+
+        if not hooks:
+            if uc_handle is not None:
+                self.uc.hook_del(uc_handle[0])
+                del self.address_uc_handles[address]
+            if not self.address_hooks.get(address, None):
+                self.address_hooks.pop(address, None)
+            return
+
+        if uc_handle is not None:
+            # the unicorn hook reads the callback list from here
+            uc_handle[1][:] = hooks
+            return
+
+        active = list(hooks)
+
+        @catch_KeyboardInterrupt(ql)
+        def _callback(uc, _addr, _size, active):
+            for h in tuple(active):
+                if h.user_data:
+                    h.callback(ql, h.user_data)
+                else:
+                    # callback does not require user_data
+                    h.callback(ql)
+
+        self.address_uc_handles[address] = (self.uc.hook_add(UC_HOOK_CODE, _callback, active, address, address), active)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+libcache files: the mapped image of a dll and its exports, for one load base
+
+    header      magic, version, load base, image size, export count, image offset
+    exports     per export: rva, ordinal, name length, name (empty when exported
+                by ordinal only)
+    image       page aligned, handed to unicorn straight from the mapping
+
+files are named after the load base and a hash of the dll, so a changed dll never
+matches an old file, and written to a temporary file first and renamed into place,
+so concurrent workers only ever see complete files
+"""
+
+import hashlib, os, struct, tempfile
+
+from qiling.loader.imagecache import ql_image_cache
+
+QL_DLL_CACHE_MAGIC = b"QLDLLIMG"
+QL_DLL_CACHE_VERSION = 1
+QL_DLL_CACHE_HEADER = struct.Struct("<8sIQQIQ")
+QL_DLL_CACHE_EXPORT = struct.Struct("<IIH")
+QL_DLL_CACHE_ALIGN = 0x1000
+
+
+def ql_dll_cache_path(path, base):
+    # the image is cached per dev/ino/size/mtime, so its digest only has to be taken once
+    image = ql_image_cache.get(path)
+    if "sha1" not in image.headers:
+        image.headers["sha1"] = hashlib.sha1(image.view).hexdigest()
+    return "%s.%x.%s.cache" % (path, base, image.headers["sha1"][ : 16])
+
+
+def ql_dll_cache_load(path, base):
+    """
+    (image, exports) from the cache file of path at base, None when there is no valid one
+
+    image is a view of the cache file mapping, exports a list of (name, ordinal, rva)
+    """
+    fcache = ql_dll_cache_path(path, base)
+    if not os.path.exists(fcache):
+        return None
+
+    image = ql_image_cache.get(fcache)
+    data = image.data
+    if image.size < QL_DLL_CACHE_HEADER.size:
+        return None
+
+    magic, version, cache_base, size, count, offset = QL_DLL_CACHE_HEADER.unpack_from(data, 0)
+    if magic != QL_DLL_CACHE_MAGIC or version != QL_DLL_CACHE_VERSION or cache_base != base or offset + size > image.size:
+        return None
+
+    exports = []
+    pos = QL_DLL_CACHE_HEADER.size
+    for _ in range(count):
+        rva, ordinal, name_len = QL_DLL_CACHE_EXPORT.unpack_from(data, pos)
+        pos += QL_DLL_CACHE_EXPORT.size
+        name = bytes(data[pos : pos + name_len]) if name_len else None
+        pos += name_len
+        exports.append((name, ordinal, rva))
+
+    return image.getdata(offset, size), exports
+
+
+def ql_dll_cache_store(path, base, data, exports):
+    index = bytearray()
+    for name, ordinal, rva in exports:
+        name = name or b''
+        index += QL_DLL_CACHE_EXPORT.pack(rva, ordinal, len(name))
+        index += name
+
+    offset = QL_DLL_CACHE_HEADER.size + len(index)
+    offset = (offset + QL_DLL_CACHE_ALIGN - 1) & ~(QL_DLL_CACHE_ALIGN - 1)
+    header = QL_DLL_CACHE_HEADER.pack(QL_DLL_CACHE_MAGIC, QL_DLL_CACHE_VERSION, base, len(data), len(exports), offset)
+
+    fcache = ql_dll_cache_path(path, base)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(fcache), dir=os.path.dirname(fcache))
+    os.chmod(tmp, 0o644)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(header)
+            f.write(index)
+            f.write(b'\x00' * (offset - len(header) - len(index)))
+            f.write(data)
+        os.replace(tmp, fcache)
+    except:
+        os.remove(tmp)
+        raise
+    return fcache
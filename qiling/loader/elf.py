@@ -5,9 +5,12 @@
 import sys
 import os
 import string
+import struct
+from collections import namedtuple
 
 from qiling.arch.filetype import *
 from qiling.exception import *
+from qiling.loader.imagecache import ql_image_cache
 
 PT_LOAD = 1
 PT_DYNAMIC = 2
@@ -44,297 +47,94 @@ AT_EXECFN = 31
 FILE_DES = []
 #MMAP_START = 0
 
+ElfHeader = namedtuple("ElfHeader", "e_ident e_type e_machine e_version e_entry e_phoff e_shoff e_flags e_ehsize e_phentsize e_phnum e_shentsize e_shnum e_shstrndx")
+ElfPhdr = namedtuple("ElfPhdr", "p_type p_flags p_offset p_vaddr p_paddr p_filesz p_memsz p_align")
+ElfShdr = namedtuple("ElfShdr", "sh_name sh_type sh_flags sh_addr sh_offset sh_size sh_link sh_info sh_addralign sh_entsize")
+
+# Elf32_Ehdr / Elf64_Ehdr
+ELF32_EHDR = "16sHHIIIIIHHHHHH"
+ELF64_EHDR = "16sHHIQQQIHHHHHH"
+
+# Elf32_Phdr has p_flags after p_memsz, Elf64_Phdr right after p_type
+ELF32_PHDR = "IIIIIIII"
+ELF64_PHDR = "IIQQQQQQ"
+
+# Elf32_Shdr / Elf64_Shdr
+ELF32_SHDR = "IIIIIIIIII"
+ELF64_SHDR = "IIQQQQIIQQ"
+
 class ELFParse:
+    """
+    the file comes from the shared image cache instead of being read, so only the
+    pages of the segments being loaded are ever read in, and headers are unpacked
+    once per image
+    """
     def __init__(self, path, ql):
         self.path = os.path.abspath(path)
         self.ql = ql
 
-        with open(path, "rb") as f:
-            elfdata = f.read()
-
-        self.elfdata = elfdata.ljust(52, b'\x00')        
-
+        self.image = ql_image_cache.get(path)
+        self.elfdata = self.image.data
+        self.elfview = self.image.view
         self.ident = self.getident()
 
-        if self.ident[ : 4] != b'\x7fELF':
+        if self.ident[ : 4] != b'\x7fELF' or self.image.size < 64:
             raise QlErrorELFFormat("[!] ERROR: NOT a ELF")
 
-        self.elfhead = self.parse_header(ql)
+        self.endian = '>' if ql.archendian == QL_ENDIAN_EB else '<'
+
+        # unpacked headers are shared by every parser of the same image
+        self.headers = self.image.headers.setdefault(("elf", ql.archbit, self.endian), {})
+        if "elfhead" not in self.headers:
+            self.headers["elfhead"] = self.parse_header(ql)
+        self.elfhead = self.headers["elfhead"]
+
+    def close(self):
+        # the mapping belongs to the image cache
+        self.image = self.elfdata = self.elfview = None
 
     def getident(self):
-        return self.elfdata[0 : 19]
+        return bytes(self.elfdata[0 : 19])
 
     def getelfdata(self, offest, size):
-        return self.elfdata[offest : offest + size]
-
-    def parse_header32(self, ql):
-        # typedef struct elf32_hdr{
-        # unsigned char	e_ident[EI_NIDENT];
-        # Elf32_Half	e_type;
-        # Elf32_Half	e_machine;
-        # Elf32_Word	e_version;
-        # Elf32_Addr	e_entry;  /* Entry point */
-        # Elf32_Off	e_phoff;
-        # Elf32_Off	e_shoff;
-        # Elf32_Word	e_flags;
-        # Elf32_Half	e_ehsize;
-        # Elf32_Half	e_phentsize;
-        # Elf32_Half	e_phnum;
-        # Elf32_Half	e_shentsize;
-        # Elf32_Half	e_shnum;
-        # Elf32_Half	e_shstrndx;
-        # } Elf32_Ehdr;
-
-        # /* 32-bit ELF base types. */
-        # typedef uint32_t Elf32_Addr;
-        # typedef uint16_t Elf32_Half;
-        # typedef uint32_t Elf32_Off;
-        # typedef int32_t  Elf32_Sword;
-        # typedef uint32_t Elf32_Word;
-
-        data = self.elfdata
-        index = 0
-        head = {}
-        head['e_ident']         = data[index : index + 16];                     index += 16
-        head['e_type']          = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_machine']       = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_version']       = self.ql.unpack32(data[index : index + 4]);    index += 4
-        head['e_entry']         = self.ql.unpack32(data[index : index + 4]);    index += 4
-        head['e_phoff']         = self.ql.unpack32(data[index : index + 4]);    index += 4
-        head['e_shoff']         = self.ql.unpack32(data[index : index + 4]);    index += 4
-        head['e_flags']         = self.ql.unpack32(data[index : index + 4]);    index += 4
-        head['e_ehsize']        = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_phentsize']     = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_phnum']         = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_shentsize']     = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_shnum']         = self.ql.unpack16(data[index : index + 2]);    index += 2
-        head['e_shstrndx']      = self.ql.unpack16(data[index : index + 2]);    index += 2
-        return head
-
-    def parse_header64(self, ql):
-        # typedef struct elf64_hdr {
-        # unsigned char	e_ident[16];		/* ELF "magic number" */
-        # Elf64_Half e_type;
-        # Elf64_Half e_machine;
-        # Elf64_Word e_version;
-        # Elf64_Addr e_entry;		/* Entry point virtual address */
-        # Elf64_Off e_phoff;		/* Program header table file offset */
-        # Elf64_Off e_shoff;		/* Section header table file offset */
-        # Elf64_Word e_flags;
-        # Elf64_Half e_ehsize;
-        # Elf64_Half e_phentsize;
-        # Elf64_Half e_phnum;
-        # Elf64_Half e_shentsize;
-        # Elf64_Half e_shnum;
-        # Elf64_Half e_shstrndx;
-        # } Elf64_Ehdr;
-
-        # /* 64-bit ELF base types. */
-        # typedef uint64_t Elf64_Addr;
-        # typedef uint16_t Elf64_Half;
-        # typedef int16_t	 Elf64_SHalf;
-        # typedef uint64_t Elf64_Off;
-        # typedef int32_t	 Elf64_Sword;
-        # typedef uint32_t Elf64_Word;
-        # typedef uint64_t Elf64_Xword;
-        # typedef int64_t  Elf64_Sxword;
-
-        data = self.elfdata
-        index = 0
-        head = {}
-        head['e_ident']         = data[index : index + 16];                 index += 16
-        head['e_type']          = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_machine']       = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_version']       = ql.unpack32(data[index : index + 4]);     index += 4
-        head['e_entry']         = ql.unpack64(data[index : index + 8]);     index += 8
-        head['e_phoff']         = ql.unpack64(data[index : index + 8]);     index += 8
-        head['e_shoff']         = ql.unpack64(data[index : index + 8]);     index += 8
-        head['e_flags']         = ql.unpack32(data[index : index + 4]);     index += 4
-        head['e_ehsize']        = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_phentsize']     = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_phnum']         = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_shentsize']     = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_shnum']         = ql.unpack16(data[index : index + 2]);     index += 2
-        head['e_shstrndx']      = ql.unpack16(data[index : index + 2]);     index += 2
-        return head
-    
+        # zero-copy, pass to ql.mem.write or bytes() it
+        return self.image.getdata(offest, size)
+
     def parse_header(self, ql):
         if ql.archbit == 64:
-            return self.parse_header64(ql)
+            fmt = ELF64_EHDR
         elif ql.archbit == 32:
-            return self.parse_header32(ql)
-
-    def parse_section_header32(self, ql):
-        # typedef struct elf32_shdr {
-        # Elf32_Word	sh_name;
-        # Elf32_Word	sh_type;
-        # Elf32_Word	sh_flags;
-        # Elf32_Addr	sh_addr;
-        # Elf32_Off	sh_offset;
-        # Elf32_Word	sh_size;
-        # Elf32_Word	sh_link;
-        # Elf32_Word	sh_info;
-        # Elf32_Word	sh_addralign;
-        # Elf32_Word	sh_entsize;
-        # } Elf32_Shdr;
-
-        # /* 32-bit ELF base types. */
-        # typedef uint32_t Elf32_Addr;
-        # typedef uint16_t Elf32_Half;
-        # typedef uint32_t Elf32_Off;
-        # typedef int32_t  Elf32_Sword;
-        # typedef uint32_t Elf32_Word;
-
-        Ssize = self.elfhead['e_shentsize']
-        Snum = self.elfhead['e_shnum']
-        Sdata = self.elfdata[self.elfhead['e_shoff'] : self.elfhead['e_shoff'] + Snum * Ssize]
-        
-        for i in range(Snum):
-            S = {}
-            S['sh_name']        = ql.unpack32(Sdata[i * Ssize : i * Ssize + 4])
-            S['sh_type']        = ql.unpack32(Sdata[i * Ssize + 4 : i * Ssize + 8])
-            S['sh_flags']       = ql.unpack32(Sdata[i * Ssize + 8 : i * Ssize + 12])
-            S['sh_addr']        = ql.unpack32(Sdata[i * Ssize + 12 : i * Ssize + 16])
-            S['sh_offset']      = ql.unpack32(Sdata[i * Ssize + 16 : i * Ssize + 20])
-            S['sh_size']        = ql.unpack32(Sdata[i * Ssize + 20 : i * Ssize + 24])
-            S['sh_link']        = ql.unpack32(Sdata[i * Ssize + 24 : i * Ssize + 28])
-            S['sh_info']        = ql.unpack32(Sdata[i * Ssize + 28 : i * Ssize + 32])
-            S['sh_addralign']   = ql.unpack32(Sdata[i * Ssize + 32 : i * Ssize + 36])
-            S['sh_entsize']     = ql.unpack32(Sdata[i * Ssize + 36 : i * Ssize + 40])
-            S['data']           = self.elfdata[S['sh_offset'] : S['sh_offset'] + S['sh_size']]
-            yield S
-        return
-
-    def parse_section_header64(self, ql):
-        # typedef struct elf64_shdr {
-        # Elf64_Word sh_name;		/* Section name, index in string tbl */
-        # Elf64_Word sh_type;		/* Type of section */
-        # Elf64_Xword sh_flags;		/* Miscellaneous section attributes */
-        # Elf64_Addr sh_addr;		/* Section virtual addr at execution */
-        # Elf64_Off sh_offset;		/* Section file offset */
-        # Elf64_Xword sh_size;		/* Size of section in bytes */
-        # Elf64_Word sh_link;		/* Index of another section */
-        # Elf64_Word sh_info;		/* Additional section information */
-        # Elf64_Xword sh_addralign;	/* Section alignment */
-        # Elf64_Xword sh_entsize;	/* Entry size if section holds table */
-        # } Elf64_Shdr;
-
-        # /* 64-bit ELF base types. */
-        # typedef uint64_t Elf64_Addr;
-        # typedef uint16_t Elf64_Half;
-        # typedef int16_t	 Elf64_SHalf;
-        # typedef uint64_t Elf64_Off;
-        # typedef int32_t	 Elf64_Sword;
-        # typedef uint32_t Elf64_Word;
-        # typedef uint64_t Elf64_Xword;
-        # typedef int64_t  Elf64_Sxword;
-
-        Ssize = self.elfhead['e_shentsize']
-        Snum = self.elfhead['e_shnum']
-        Sdata = self.elfdata[self.elfhead['e_shoff'] : self.elfhead['e_shoff'] + Snum * Ssize]
-
-        for i in range(Snum):
-            S = {}
-            S['sh_name']        = ql.unpack32(Sdata[i * Ssize : i * Ssize + 4])
-            S['sh_type']        = ql.unpack32(Sdata[i * Ssize + 4 : i * Ssize + 8])
-            S['sh_flags']       = ql.unpack64(Sdata[i * Ssize + 8 : i * Ssize + 16])
-            S['sh_addr']        = ql.unpack64(Sdata[i * Ssize + 16 : i * Ssize + 24])
-            S['sh_offset']      = ql.unpack64(Sdata[i * Ssize + 24 : i * Ssize + 32])
-            S['sh_size']        = ql.unpack64(Sdata[i * Ssize + 32 : i * Ssize + 40])
-            S['sh_link']        = ql.unpack32(Sdata[i * Ssize + 40 : i * Ssize + 44])
-            S['sh_info']        = ql.unpack32(Sdata[i * Ssize + 44 : i * Ssize + 48])
-            S['sh_addralign']   = ql.unpack64(Sdata[i * Ssize + 48 : i * Ssize + 56])
-            S['sh_entsize']     = ql.unpack64(Sdata[i * Ssize + 56 : i * Ssize + 64])
-            S['data']           = self.elfdata[S['sh_offset'] : S['sh_offset'] + S['sh_size']]
-            yield S
-        return
+            fmt = ELF32_EHDR
+        return ElfHeader._make(struct.unpack_from(self.endian + fmt, self.elfdata, 0))
 
     def parse_section_header(self, ql):
-        if ql.archbit == 64:
-            return self.parse_section_header64(ql)
-        elif ql.archbit == 32:
-            return self.parse_section_header32(ql)
-
-    def parse_program_header32(self, ql):
-        # typedef struct elf32_phdr{
-        # Elf32_Word	p_type;
-        # Elf32_Off	p_offset;
-        # Elf32_Addr	p_vaddr;
-        # Elf32_Addr	p_paddr;
-        # Elf32_Word	p_filesz;
-        # Elf32_Word	p_memsz;
-        # Elf32_Word	p_flags;
-        # Elf32_Word	p_align;
-        # } Elf32_Phdr;
-
-        # /* 32-bit ELF base types. */
-        # typedef uint32_t Elf32_Addr;
-        # typedef uint16_t Elf32_Half;
-        # typedef uint32_t Elf32_Off;
-        # typedef int32_t  Elf32_Sword;
-        # typedef uint32_t Elf32_Word;
-
-        Psize = int(self.elfhead['e_phentsize'])
-        Pnum = int(self.elfhead['e_phnum'])
-        Pdata = self.elfdata[self.elfhead['e_phoff'] : self.elfhead['e_phoff'] + Pnum * Psize]
-
-        for i in range(Pnum):
-            P = {}
-            P['p_type']     = ql.unpack32(Pdata[i * Psize : i * Psize + 4 ])
-            P['p_offset']   = ql.unpack32(Pdata[i * Psize + 4 : i * Psize + 8 ])
-            P['p_vaddr']    = ql.unpack32(Pdata[i * Psize + 8 : i * Psize + 12 ])
-            P['p_paddr']    = ql.unpack32(Pdata[i * Psize + 12 : i * Psize + 16 ])
-            P['p_filesz']   = ql.unpack32(Pdata[i * Psize + 16 : i * Psize + 20 ])
-            P['p_memsz']    = ql.unpack32(Pdata[i * Psize + 20 : i * Psize + 24 ])
-            P['p_flags']    = ql.unpack32(Pdata[i * Psize + 24 : i * Psize + 28 ])
-            P['p_align']    = ql.unpack32(Pdata[i * Psize + 28 : i * Psize + 32])
-            yield P
-        return
-
-    def parse_program_header64(self, ql):
-        # typedef struct elf64_phdr {
-        # Elf64_Word p_type;
-        # Elf64_Word p_flags;
-        # Elf64_Off p_offset;		/* Segment file offset */
-        # Elf64_Addr p_vaddr;		/* Segment virtual address */
-        # Elf64_Addr p_paddr;		/* Segment physical address */
-        # Elf64_Xword p_filesz;		/* Segment size in file */
-        # Elf64_Xword p_memsz;		/* Segment size in memory */
-        # Elf64_Xword p_align;		/* Segment alignment, file & memory */
-        # } Elf64_Phdr;
-
-        # /* 64-bit ELF base types. */
-        # typedef uint64_t Elf64_Addr;
-        # typedef uint16_t Elf64_Half;
-        # typedef int16_t	 Elf64_SHalf;
-        # typedef uint64_t Elf64_Off;
-        # typedef int32_t	 Elf64_Sword;
-        # typedef uint32_t Elf64_Word;
-        # typedef uint64_t Elf64_Xword;
-        # typedef int64_t  Elf64_Sxword;
-
-        Psize = self.elfhead['e_phentsize']
-        Pnum = self.elfhead['e_phnum']
-        Pdata = self.elfdata[self.elfhead['e_phoff'] : self.elfhead['e_phoff'] + Pnum * Psize]
-
-        for i in range(Pnum):
-            P = {}
-            P['p_type']     = ql.unpack32(Pdata[i * Psize : i * Psize + 4 ])
-            P['p_flags']    = ql.unpack32(Pdata[i * Psize + 4 : i * Psize + 8 ])
-            P['p_offset']   = ql.unpack64(Pdata[i * Psize + 8 : i * Psize + 16 ])
-            P['p_vaddr']    = ql.unpack64(Pdata[i * Psize + 16 : i * Psize + 24 ])
-            P['p_paddr']    = ql.unpack64(Pdata[i * Psize + 24 : i * Psize + 32 ])
-            P['p_filesz']   = ql.unpack64(Pdata[i * Psize + 32 : i * Psize + 40 ])
-            P['p_memsz']    = ql.unpack64(Pdata[i * Psize + 40 : i * Psize + 48 ])
-            P['p_align']    = ql.unpack64(Pdata[i * Psize + 48 : i * Psize + 56])
-            yield P
-        return
+        if "shdrs" not in self.headers:
+            if ql.archbit == 64:
+                fmt = ELF64_SHDR
+            elif ql.archbit == 32:
+                fmt = ELF32_SHDR
+
+            fmt = struct.Struct(self.endian + fmt)
+            head = self.elfhead
+            self.headers["shdrs"] = tuple(ElfShdr._make(fmt.unpack_from(self.elfdata, head.e_shoff + i * head.e_shentsize)) for i in range(head.e_shnum))
+        return self.headers["shdrs"]
 
     def parse_program_header(self, ql):
-        if ql.archbit == 64:
-            return self.parse_program_header64(ql)
-        elif ql.archbit == 32:
-            return self.parse_program_header32(ql)
+        if "phdrs" not in self.headers:
+            head = self.elfhead
+            offsets = [head.e_phoff + i * head.e_phentsize for i in range(head.e_phnum)]
+
+            if ql.archbit == 64:
+                fmt = struct.Struct(self.endian + ELF64_PHDR)
+                phdrs = [ElfPhdr._make(fmt.unpack_from(self.elfdata, off)) for off in offsets]
+            elif ql.archbit == 32:
+                fmt = struct.Struct(self.endian + ELF32_PHDR)
+                phdrs = []
+                for off in offsets:
+                    p_type, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_flags, p_align = fmt.unpack_from(self.elfdata, off)
+                    phdrs.append(ElfPhdr(p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz, p_memsz, p_align))
+            self.headers["phdrs"] = tuple(phdrs)
+        return self.headers["phdrs"]
 
 class ELFLoader(ELFParse):
     def __init__(self, path, ql):
@@ -391,41 +191,41 @@ class ELFLoader(ELFParse):
             else:
                 loadbase = 0x56555000
 
-        elfhead = super().parse_header(ql)
+        elfhead = self.elfhead
 
         # Determine the range of memory space opened up
         mem_start = -1
         mem_end = -1
         interp_path = ''
-        for i in super().parse_program_header(ql):
-            if i['p_type'] == PT_LOAD:
-                if mem_start > i['p_vaddr'] or mem_start == -1:
-                    mem_start = i['p_vaddr']
-                if mem_end < i['p_vaddr'] + i['p_memsz'] or mem_end == -1:
-                    mem_end = i['p_vaddr'] + i['p_memsz']
-            if i['p_type'] == PT_INTERP:
-                interp_path = self.NullStr(super().getelfdata(i['p_offset'], i['p_filesz']))
+        for i in self.parse_program_header(ql):
+            if i.p_type == PT_LOAD:
+                if mem_start > i.p_vaddr or mem_start == -1:
+                    mem_start = i.p_vaddr
+                if mem_end < i.p_vaddr + i.p_memsz or mem_end == -1:
+                    mem_end = i.p_vaddr + i.p_memsz
+            if i.p_type == PT_INTERP:
+                interp_path = self.NullStr(bytes(self.getelfdata(i.p_offset, i.p_filesz)))
 
         mem_start = int(mem_start // 0x1000) * 0x1000
         mem_end = int(mem_end // 0x1000 + 1) * 0x1000
 
-        if elfhead['e_type'] == ET_EXEC:
+        if elfhead.e_type == ET_EXEC:
             loadbase = 0
-        elif elfhead['e_type'] != ET_DYN:
-            ql.nprint("[+] Some error in head e_type: %u!" %elfhead['e_type'])
+        elif elfhead.e_type != ET_DYN:
+            ql.nprint("[+] Some error in head e_type: %u!", elfhead.e_type)
             return -1
 
         ql.uc.mem_map(loadbase + mem_start, mem_end - mem_start)
         ql.insert_map_info(loadbase + mem_start, loadbase + mem_end, 'r-x', self.path)
 
-        for i in super().parse_program_header(ql):
-            if i['p_type'] == PT_LOAD:
-                ql.uc.mem_write(loadbase + i['p_vaddr'], super().getelfdata(i['p_offset'], i['p_filesz']))
-                ql.dprint("[+] load 0x%x - 0x%x" % (loadbase + i['p_vaddr'], loadbase + i['p_vaddr'] + i['p_filesz']))
+        for i in self.parse_program_header(ql):
+            if i.p_type == PT_LOAD:
+                ql.mem.write(loadbase + i.p_vaddr, self.getelfdata(i.p_offset, i.p_filesz))
+                ql.dprint("[+] load 0x%x - 0x%x", loadbase + i.p_vaddr, loadbase + i.p_vaddr + i.p_filesz)
 
-        entry_point = elfhead['e_entry'] + loadbase
+        entry_point = elfhead.e_entry + loadbase
         
-        ql.dprint("[+] mem_start: 0x%x mem_end: 0x%x" % (mem_start, mem_end))
+        ql.dprint("[+] mem_start: 0x%x mem_end: 0x%x", mem_start, mem_end)
 
         ql.brk_address = mem_end + loadbase
 
@@ -435,16 +235,16 @@ class ELFLoader(ELFParse):
             interp_path = str(interp_path, 'utf-8', errors="ignore")
            
             interp = ELFParse(ql.rootfs + interp_path, ql)
-            interphead = interp.parse_header(ql)
-            ql.dprint("[+] interp is : %s" % (ql.rootfs + interp_path))
+            interphead = interp.elfhead
+            ql.dprint("[+] interp is : %s", ql.rootfs + interp_path)
 
             interp_mem_size = -1
             for i in interp.parse_program_header(ql):
-                if i['p_type'] == PT_LOAD:
-                    if interp_mem_size < i['p_vaddr'] + i['p_memsz'] or interp_mem_size == -1:
-                        interp_mem_size = i['p_vaddr'] + i['p_memsz']
+                if i.p_type == PT_LOAD:
+                    if interp_mem_size < i.p_vaddr + i.p_memsz or interp_mem_size == -1:
+                        interp_mem_size = i.p_vaddr + i.p_memsz
             interp_mem_size = (interp_mem_size // 0x1000 + 1) * 0x1000
-            ql.dprint("[+] interp_mem_size is : 0x%x" % int(interp_mem_size))
+            ql.dprint("[+] interp_mem_size is : 0x%x", int(interp_mem_size))
 
             if ql.interp_base == 0:
                 if ql.archbit == 64:
@@ -456,14 +256,15 @@ class ELFLoader(ELFParse):
                 else:
                     ql.interp_base = 0xff7d5000
 
-            ql.dprint("[+] interp_base is : 0x%x" % (ql.interp_base))
+            ql.dprint("[+] interp_base is : 0x%x", ql.interp_base)
             ql.uc.mem_map(ql.interp_base, int(interp_mem_size))
             ql.insert_map_info(ql.interp_base, ql.interp_base + int(interp_mem_size), 'r-x',os.path.abspath(interp_path))
 
             for i in interp.parse_program_header(ql):
-                if i['p_type'] == PT_LOAD:
-                    ql.uc.mem_write(ql.interp_base + i['p_vaddr'], interp.getelfdata(i['p_offset'], i['p_filesz']))
-            entry_point = interphead['e_entry'] + ql.interp_base
+                if i.p_type == PT_LOAD:
+                    ql.mem.write(ql.interp_base + i.p_vaddr, interp.getelfdata(i.p_offset, i.p_filesz))
+            entry_point = interphead.e_entry + ql.interp_base
+            interp.close()
 
         # Set MMAP addr
         if ql.mmap_start == 0:
@@ -476,7 +277,7 @@ class ELFLoader(ELFParse):
             else:
                 ql.mmap_start = 0xf7fd6000 - 0x400000
 
-        ql.dprint("[+] mmap_start is : 0x%x" % (ql.mmap_start))
+        ql.dprint("[+] mmap_start is : 0x%x", ql.mmap_start)
 
         # Set elf table
         elf_table = b''
@@ -528,15 +329,15 @@ class ELFLoader(ELFParse):
         # new_stack = new_stack - 4
         # rand_addr = new_stack - 4
 
-        ql.elf_phdr     = (loadbase + elfhead['e_phoff'])
-        ql.elf_phent    = (elfhead['e_phentsize'])
-        ql.elf_phnum    = (elfhead['e_phnum'])
+        ql.elf_phdr     = (loadbase + elfhead.e_phoff)
+        ql.elf_phent    = (elfhead.e_phentsize)
+        ql.elf_phnum    = (elfhead.e_phnum)
         ql.elf_pagesz   = 0x1000
         if ql.archendian == QL_ENDIAN_EB:
             ql.elf_pagesz   = 0x0010
         ql.elf_guid     = 1000
         ql.elf_flags    = 0
-        ql.elf_entry    = (loadbase + elfhead['e_entry'])
+        ql.elf_entry    = (loadbase + elfhead.e_entry)
         ql.randstraddr  = randstraddr = addr[0]
         ql.cpustraddr   = cpustraddr = addr[1]
         if ql.archbit == 64:
@@ -576,7 +377,7 @@ class ELFLoader(ELFParse):
         #     ql.nprint("0x%08x : 0x%08x " % (new_stack + i * 0x4, ql.unpack64(buf)) + ' '.join(['%02x' % i for i in buf]) + '  ' + ''.join([chr(i) if i in string.printable[ : -5].encode('ascii') else '.' for i in buf]))
 
         ql.entry_point = entry_point
-        ql.elf_entry = loadbase + elfhead['e_entry']
+        ql.elf_entry = loadbase + elfhead.e_entry
         ql.new_stack = new_stack
         ql.loadbase = loadbase
         ql.insert_map_info(new_stack, ql.stack_address+ql.stack_size, 'rw-', '[stack]')
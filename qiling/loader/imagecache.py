@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+process-wide cache of file images (interpreters, shared libraries)
+
+files are keyed by (device, inode, size, mtime) so a file changed on disk is
+simply a new entry and a file replaced under the same path is another one, and
+held as copy-on-write mappings that are never written to: every Qiling instance
+in the process shares one mapping, and since clean pages of a private file
+mapping come straight from the page cache, worker processes mapping the same
+rootfs share the physical pages too
+
+parsers keep whatever they unpacked from an image in image.headers
+"""
+
+import mmap, os, stat, threading
+from collections import OrderedDict
+
+QL_IMAGE_CACHE_SIZE = 0x10000000
+
+
+class Image:
+    __slots__ = ("key", "path", "size", "data", "view", "headers")
+
+    def __init__(self, key, path, size, data):
+        self.key = key
+        self.path = path
+        self.size = size
+        self.data = data
+        self.view = memoryview(data)
+        self.headers = {}
+
+    def getdata(self, offset, size):
+        # zero-copy, pass to ql.mem.write or bytes() it
+        return self.view[offset : offset + size]
+
+
+class ImageCache:
+    """
+    LRU by total bytes of the cached files
+    """
+    def __init__(self, max_bytes=QL_IMAGE_CACHE_SIZE):
+        self.max_bytes = max_bytes
+        self.images = OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def __key(self, st):
+        return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, path):
+        """
+        the Image for path, None for anything but a regular file
+        """
+        with open(path, "rb") as f:
+            return self.get_fd(f.fileno(), path)
+
+    def get_fd(self, fd, path=None):
+        """
+        the Image behind an open file, mapped from the fd itself so it works for
+        unlinked or replaced files too. path is only informational
+        """
+        st = os.fstat(fd)
+        if not stat.S_ISREG(st.st_mode):
+            return None
+
+        key = self.__key(st)
+        with self.lock:
+            image = self.images.get(key, None)
+            if image is not None:
+                self.images.move_to_end(key)
+                self.hits += 1
+                return image
+
+        # map outside the lock, a racing thread just maps it twice. mmap keeps a
+        # dup of fd, closing it later does not matter
+        if st.st_size:
+            data = mmap.mmap(fd, 0, access = mmap.ACCESS_COPY)
+        else:
+            data = b''
+        image = Image(key, path, st.st_size, data)
+
+        with self.lock:
+            self.misses += 1
+            old = self.images.get(key, None)
+            if old is not None:
+                return old
+
+            # older versions of the file are of no use anymore
+            for stale in [k for k in self.images if k[ : 2] == key[ : 2]]:
+                self.__drop(stale)
+
+            self.images[key] = image
+            self.total += image.size
+            while self.total > self.max_bytes and len(self.images) > 1:
+                self.__drop(next(iter(self.images)))
+        return image
+
+    def __drop(self, key):
+        # not closed, parsers may still hold the image, the mapping goes with the
+        # last reference
+        self.total -= self.images.pop(key).size
+
+    def clear(self):
+        with self.lock:
+            for key in list(self.images):
+                self.__drop(key)
+
+
+ql_image_cache = ImageCache()
@@ -8,13 +8,14 @@ import sys
 import os
 import string
 import pefile
-import pickle
 
 from unicorn.x86_const import *
 from qiling.os.windows.utils import *
 from qiling.os.memory import align
 from qiling.os.windows.structs import *
 from qiling.exception import *
+from qiling.loader.imagecache import ql_image_cache
+from qiling.loader.dllcache import ql_dll_cache_load, ql_dll_cache_store
 
 
 class Process:
@@ -25,8 +26,12 @@ class Process:
         self.import_address_table = {}
         self.ldr_list = []
         self.cmdline = b"D:\\" + bytes(self.ql.path.replace("/", "\\"), "utf-8") + b"\x00"
+        # lazy_dlls: address range taken but image not mapped yet, dll_name -> (path, size)
+        self.reserved_dlls = {}
+        # import stubs of reserved dlls, stub address -> (dll_name, name or ordinal, IAT slot)
+        self.import_stubs = {}
 
-    def load_dll(self, dll_name):
+    def dll_path(self, dll_name):
         dll_name = dll_name.lower().decode()
 
         if self.ql.arch == QL_X86:
@@ -43,83 +48,168 @@ class Process:
         if not os.path.exists(path):
             raise QlErrorFileNotFound("[!] Cannot find dll in %s" % path)
 
+        return dll_name, path
+
+    def load_dll(self, dll_name):
+        dll_name, path = self.dll_path(dll_name)
+
         # If the dll is already loaded
         if dll_name in self.dlls:
+            if dll_name in self.reserved_dlls:
+                self.map_reserved_dll(dll_name)
             return self.dlls[dll_name]
         else:
             self.dlls[dll_name] = self.ql.DLL_LAST_ADDR
 
-        self.ql.nprint("[+] Loading %s to 0x%x" % (path, self.ql.DLL_LAST_ADDR))
+        dll_base = self.ql.DLL_LAST_ADDR
+        self.ql.nprint("[+] Loading %s to 0x%x" % (path, dll_base))
 
-        # cache depends on address base
-        fcache = path + ".%x.cache" % self.ql.DLL_LAST_ADDR
+        data, cmdlines = self.parse_dll(dll_name, path, dll_base)
 
-        # Add dll to IAT
-        try:
-            self.import_address_table[dll_name] = {}
-        except KeyError as ke:
-            pass
-
-        if self.ql.libcache and os.path.exists(fcache):
-            (data, cmdlines, self.import_symbols, self.import_address_table) = \
-                pickle.load(open(fcache, "rb"))
-            for entry in cmdlines:
-                self.set_cmdline(entry['name'], entry['address'], data)
-        else:
-            dll = pefile.PE(path, fast_load=True)
-            dll.parse_data_directories()
-            data = bytearray(dll.get_memory_mapped_image())
-            cmdlines = []
-
-            for entry in dll.DIRECTORY_ENTRY_EXPORT.symbols:
-                self.import_symbols[self.ql.DLL_LAST_ADDR + entry.address] = {'name': entry.name,
-                                                                              'ordinal': entry.ordinal}
-                self.import_address_table[dll_name][entry.name] = self.ql.DLL_LAST_ADDR + entry.address
-                self.import_address_table[dll_name][entry.ordinal] = self.ql.DLL_LAST_ADDR + entry.address
-                cmdline_entry = self.set_cmdline(entry.name, entry.address, data)
-                if cmdline_entry:
-                    cmdlines.append(cmdline_entry)
+        dll_len = align(len(data), 0x1000)
+        self.ql.DLL_SIZE += dll_len
+        self.ql.uc.mem_map(dll_base, dll_len)
+        self.ql.mem.write(dll_base, data)
+        self.ql.DLL_LAST_ADDR += dll_len
+        for name, address in cmdlines:
+            self.set_cmdline(name, address, dll_base)
 
-            if self.ql.libcache:
-                # cache this dll file
-                pickle.dump((data, cmdlines,
-                             self.import_symbols,
-                             self.import_address_table),
-                            open(fcache, "wb"))
-                self.ql.nprint("[+] Cached %s" % path)
+        # win api implementations are dispatched when execution enters a dll image
+        self.ql.hook_block(self.ql.winapi_hook, begin=dll_base, end=dll_base + dll_len - 1)
+
+        # add dll to ldr data
+        self.add_ldr_data_table_entry(dll_name)
+
+        self.ql.nprint("[+] Done with loading %s" % path)
+        return dll_base
+
+    def reserve_dll(self, dll_name):
+        """
+        load_dll for lazy_dlls: only takes the address range of the image, which is
+        mapped and has its exports parsed when first executed or read, or when one of
+        its import stubs is called
+        """
+        dll_name, path = self.dll_path(dll_name)
+
+        if dll_name in self.dlls:
+            return self.dlls[dll_name]
+
+        # SizeOfImage straight from the optional header, same offset in PE32 and PE32+
+        data = ql_image_cache.get(path).data
+        e_lfanew, = struct.unpack_from("<I", data, 0x3c)
+        size_of_image, = struct.unpack_from("<I", data, e_lfanew + 24 + 56)
 
         dll_base = self.ql.DLL_LAST_ADDR
-        dll_len = align(len(bytes(data)), 0x1000)
+        dll_len = align(size_of_image, 0x1000)
+        self.dlls[dll_name] = dll_base
+        self.reserved_dlls[dll_name] = (path, dll_len)
         self.ql.DLL_SIZE += dll_len
-        self.ql.uc.mem_map(dll_base, dll_len)
-        self.ql.uc.mem_write(dll_base, bytes(data))
         self.ql.DLL_LAST_ADDR += dll_len
+        self.ql.nprint("[+] Reserved 0x%x - 0x%x for %s" % (dll_base, dll_base + dll_len, path))
 
-        # add dll to ldr data
+        self.ql.hook_mem_unmapped(self.__hook_reserved_dll, user_data=dll_name, begin=dll_base, end=dll_base + dll_len - 1)
+        # hooked once here, a dll reserved again by a snapshot restore is mapped without
+        # hooking it twice
+        self.ql.hook_block(self.ql.winapi_hook, begin=dll_base, end=dll_base + dll_len - 1)
         self.add_ldr_data_table_entry(dll_name)
+        return dll_base
+
+    def map_reserved_dll(self, dll_name):
+        path, dll_len = self.reserved_dlls.pop(dll_name)
+        dll_base = self.dlls[dll_name]
+        self.ql.nprint("[+] Loading %s to 0x%x" % (path, dll_base))
+
+        data, cmdlines = self.parse_dll(dll_name, path, dll_base)
+        self.ql.uc.mem_map(dll_base, dll_len)
+        self.ql.mem.write(dll_base, memoryview(data)[ : dll_len])
+        for name, address in cmdlines:
+            self.set_cmdline(name, address, dll_base)
 
         self.ql.nprint("[+] Done with loading %s" % path)
         return dll_base
 
-    def set_cmdline(self, name, address, memory):
+    def __hook_reserved_dll(self, ql, address, size, value, dll_name):
+        if dll_name not in self.reserved_dlls:
+            return False
+        self.map_reserved_dll(dll_name)
+        return True
+
+    def set_import_stubs(self, dll_name, imports):
+        """
+        points the IAT slots of imports at one stub each, the first call through a stub
+        maps the dll, fixes the slot and goes on at the export
+        """
+        if not imports:
+            return
+
+        stubs = self.ql.heap.mem_alloc(len(imports))
+        self.ql.uc.mem_write(stubs, b'\xcc' * len(imports))
+        for stub, (symbol, iat_address) in enumerate(imports, stubs):
+            self.import_stubs[stub] = (dll_name, symbol, iat_address)
+            self.ql.uc.mem_write(iat_address, self.pack_pointer(stub))
+        self.ql.hook_block(self.__hook_import_stub, begin=stubs, end=stubs + len(imports) - 1)
+
+    def __hook_import_stub(self, ql, address, size):
+        dll_name, symbol, iat_address = self.import_stubs[address]
+        if dll_name in self.reserved_dlls:
+            self.map_reserved_dll(dll_name)
+
+        target = self.import_address_table[dll_name][symbol]
+        ql.uc.mem_write(iat_address, self.pack_pointer(target))
+        ql.pc = target
+
+    def pack_pointer(self, value):
         if self.ql.arch == QL_X86:
-            addr = self.ql.heap.mem_alloc(len(self.cmdline))
-            packed_addr = self.ql.pack32(addr)
+            return self.ql.pack32(value)
+        else:
+            return self.ql.pack64(value)
+
+    def parse_dll(self, dll_name, path, dll_base):
+        """
+        image and exports of a dll loaded at dll_base, returns the image and the
+        (name, rva) of the exported command line pointers
+        """
+        cached = ql_dll_cache_load(path, dll_base) if self.ql.libcache else None
+        if cached is not None:
+            data, exports = cached
         else:
-            addr = self.ql.heap.mem_alloc(2 * len(self.cmdline))
-            packed_addr = self.ql.pack64(addr)
+            dll = pefile.PE(path, fast_load=True)
+            # exports are all we use, the other directories are left alone
+            dll.parse_data_directories(directories=[pefile.DIRECTORY_ENTRY["IMAGE_DIRECTORY_ENTRY_EXPORT"]])
+            data = dll.get_memory_mapped_image()
+            exports = []
+            if hasattr(dll, "DIRECTORY_ENTRY_EXPORT"):
+                exports = [(entry.name, entry.ordinal, entry.address) for entry in dll.DIRECTORY_ENTRY_EXPORT.symbols]
+
+            if self.ql.libcache:
+                # cache this dll file
+                ql_dll_cache_store(path, dll_base, data, exports)
+                self.ql.nprint("[+] Cached %s" % path)
 
-        cmdline_entry = None
+        # Add dll to IAT
+        self.import_address_table[dll_name] = {}
+        cmdlines = []
+        for name, ordinal, address in exports:
+            self.import_symbols[dll_base + address] = {'name': name, 'ordinal': ordinal}
+            self.import_address_table[dll_name][name] = dll_base + address
+            self.import_address_table[dll_name][ordinal] = dll_base + address
+            if name in (b"_acmdln", b"_wcmdln"):
+                cmdlines.append((name, address))
+
+        return data, cmdlines
+
+    def set_cmdline(self, name, address, dll_base):
+        # points the exported _acmdln / _wcmdln of a mapped dll at a copy of the command line
         if name == b"_acmdln":
-            cmdline_entry = {"name": name, "address": address}
-            memory[address:address + self.ql.pointersize] = packed_addr
-            self.ql.uc.mem_write(addr, self.cmdline)
+            cmdline = self.cmdline
         elif name == b"_wcmdln":
-            cmdline_entry = {"name": name, "address": address}
-            memory[address:address + self.ql.pointersize] = packed_addr
-            self.ql.uc.mem_write(addr, str(self.cmdline).encode("utf-16le"))
+            cmdline = str(self.cmdline).encode("utf-16le")
+        else:
+            return
 
-        return cmdline_entry
+        addr = self.ql.heap.mem_alloc(len(cmdline))
+        self.ql.uc.mem_write(addr, cmdline)
+        self.ql.uc.mem_write(dll_base + address, self.pack_pointer(addr))
 
     def init_tib(self):
         if self.ql.arch == QL_X86:
@@ -265,7 +355,10 @@ class Shellcode(Process):
 
         # load dlls
         for each in self.init_dlls:
-            super().load_dll(each)
+            if self.ql.lazy_dlls:
+                super().reserve_dll(each)
+            else:
+                super().load_dll(each)
 
 
 class PE(Process):
@@ -350,6 +443,13 @@ class PE(Process):
         # parse directory entry import
         for entry in self.pe.DIRECTORY_ENTRY_IMPORT:
             dll_name = str(entry.dll.lower(), 'utf-8', 'ignore')
+            if self.ql.lazy_dlls:
+                lazy_name, _ = super().dll_path(entry.dll)
+                if lazy_name not in self.dlls or lazy_name in self.reserved_dlls:
+                    super().reserve_dll(entry.dll)
+                    super().set_import_stubs(lazy_name, [(imp.name if imp.name else imp.ordinal, imp.address) for imp in entry.imports])
+                    continue
+
             super().load_dll(entry.dll)
             for imp in entry.imports:
                 # fix IAT
@@ -47,5 +47,5 @@ def ql_syscall_sysarch(ql, op, parms, null2, null3, null4, null5):
 
     #op_buf = ql.pack32(op)
     #ql.uc.mem_write(parms, op_buf)
-    ql.nprint("sysarch(0x%x,0x%x) = %i" % (op, parms, regreturn))
+    ql.nprint("sysarch(0x%x,0x%x) = %i", op, parms, regreturn)
     ql_definesyscall_return(ql, regreturn)
\ No newline at end of file
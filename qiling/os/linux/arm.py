@@ -9,6 +9,7 @@ from unicorn.arm_const import *
 from qiling.loader.elf import *
 from qiling.os.linux.arm_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.linux.syscall import *
 from qiling.os.utils import *
 
@@ -29,48 +30,31 @@ def ql_arm_check_thumb(reg_cpsr):
         mode = UC_MODE_THUMB
         return mode
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_arm_linux_syscall, globals(), ql_syscall_reg_reader(
+        UC_ARM_REG_R0, UC_ARM_REG_R1, UC_ARM_REG_R2, UC_ARM_REG_R3, UC_ARM_REG_R4, UC_ARM_REG_R5))
+
+
 def hook_syscall(ql, intno):
     syscall_num = ql.uc.reg_read(UC_ARM_REG_R7)
-    param0 = ql.uc.reg_read(UC_ARM_REG_R0)
-    param1 = ql.uc.reg_read(UC_ARM_REG_R1)
-    param2 = ql.uc.reg_read(UC_ARM_REG_R2)
-    param3 = ql.uc.reg_read(UC_ARM_REG_R3)
-    param4 = ql.uc.reg_read(UC_ARM_REG_R4)
-    param5 = ql.uc.reg_read(UC_ARM_REG_R5)
-    reg_cpsr = ql.uc.reg_read(UC_ARM_REG_CPSR)
-    pc = ql.uc.reg_read(UC_ARM_REG_PC)
-
-    ql_arm_check_thumb(reg_cpsr)
-
-    while 1:
-        LINUX_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC != None:
-            LINUX_SYSCALL_FUNC_NAME = LINUX_SYSCALL_FUNC.__name__
-            break
-        
-        LINUX_SYSCALL_FUNC_NAME = dict_arm_linux_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC_NAME != None:
-            LINUX_SYSCALL_FUNC = eval(LINUX_SYSCALL_FUNC_NAME)
-            break
-        
-        LINUX_SYSCALL_FUNC = None
-        LINUX_SYSCALL_FUNC_NAME = None
-        break
+
+    LINUX_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if LINUX_SYSCALL_FUNC != None:
         try:
-            LINUX_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(LINUX_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise
         except Exception as e:
-            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s" % (LINUX_SYSCALL_FUNC_NAME, e))
+            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s", LINUX_SYSCALL_FUNC.name, e)
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
                 td.stop()
                 td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
             raise
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_ARM_REG_PC)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
@@ -193,17 +177,18 @@ def ql_syscall_arm_settls(ql, address, null0, null1, null2, null3, null4):
 
     ql.uc.mem_write(QL_KERNEL_GET_TLS_ADDR + 12, ql.pack32(address))
     ql.uc.reg_write(UC_ARM_REG_R0, address)
-    ql.nprint("settls(0x%x)" % address)
+    ql.nprint("settls(0x%x)", address)
 
 
 def loader_file(ql):
     uc = Uc(UC_ARCH_ARM, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = QL_ARM_LINUX_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0):  
         ql.stack_size = QL_ARM_LINUX_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     loader = ELFLoader(ql.path, ql)
     if loader.load_with_ld(ql, ql.stack_address + ql.stack_size, argv = ql.argv,  env = ql.env):
         raise QlErrorFileType("Unsupported FileType")
@@ -213,11 +198,12 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_ARM, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address  = (ql.stack_address + 0x200000 - 0x1000)
     ql.uc.mem_write(ql.stack_address, ql.shellcoder) 
 
@@ -269,11 +255,11 @@ def runner(ql):
 
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             try:
                 buf = ql.uc.mem_read(ql.pc, 8)
-                ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+                ql.nprint("[+] %r", [hex(_) for _ in buf])
                 ql.nprint("\n")
                 ql_hook_code_disasm(ql, ql.pc, 64)
             except:
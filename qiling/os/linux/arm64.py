@@ -9,6 +9,7 @@ from unicorn.arm64_const import *
 from qiling.loader.elf import *
 from qiling.os.linux.arm64_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.linux.syscall import *
 from qiling.os.utils import *
 from qiling.arch.filetype import *
@@ -17,43 +18,31 @@ QL_ARM64_LINUX_PREDEFINE_STACKADDRESS = 0x7ffffffde000
 QL_ARM64_LINUX_PREDEFINE_STACKSIZE = 0x21000
 QL_ARM64_EMU_END = 0xffffffffffffffff
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_arm64_linux_syscall, globals(), ql_syscall_reg_reader(
+        UC_ARM64_REG_X0, UC_ARM64_REG_X1, UC_ARM64_REG_X2, UC_ARM64_REG_X3, UC_ARM64_REG_X4, UC_ARM64_REG_X5))
+
+
 def hook_syscall(ql, intno):
     syscall_num  = ql.uc.reg_read(UC_ARM64_REG_X8)
-    param0 = ql.uc.reg_read(UC_ARM64_REG_X0)
-    param1 = ql.uc.reg_read(UC_ARM64_REG_X1)
-    param2 = ql.uc.reg_read(UC_ARM64_REG_X2)
-    param3 = ql.uc.reg_read(UC_ARM64_REG_X3)
-    param4 = ql.uc.reg_read(UC_ARM64_REG_X4)
-    param5 = ql.uc.reg_read(UC_ARM64_REG_X5)
-    pc = ql.uc.reg_read(UC_ARM64_REG_PC)
-
-    while 1:
-        LINUX_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC != None:
-            LINUX_SYSCALL_FUNC_NAME = LINUX_SYSCALL_FUNC.__name__
-            break
-        LINUX_SYSCALL_FUNC_NAME = dict_arm64_linux_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC_NAME != None:
-            LINUX_SYSCALL_FUNC = eval(LINUX_SYSCALL_FUNC_NAME)
-            break
-        LINUX_SYSCALL_FUNC = None
-        LINUX_SYSCALL_FUNC_NAME = None
-        break
+
+    LINUX_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if LINUX_SYSCALL_FUNC != None:
         try:
-            LINUX_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(LINUX_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise
         except Exception as e:
-            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s" % (LINUX_SYSCALL_FUNC_NAME, e))
+            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s", LINUX_SYSCALL_FUNC.name, e)
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
                 td.stop()
                 td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
             raise
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_ARM64_REG_PC)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
@@ -71,11 +60,12 @@ def ql_arm64_enable_vfp(uc):
 def loader_file(ql):
     uc = Uc(UC_ARCH_ARM64, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = QL_ARM64_LINUX_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0):  
         ql.stack_size = QL_ARM64_LINUX_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     loader = ELFLoader(ql.path, ql)
     if loader.load_with_ld(ql, ql.stack_address + ql.stack_size, argv = ql.argv,  env = ql.env):
         raise QlErrorFileType("Unsupported FileType")
@@ -85,12 +75,13 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_ARM64, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
 
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address =  ql.stack_address  + 0x200000 - 0x1000    
     ql.uc.mem_write(ql.stack_address, ql.shellcoder) 
 
@@ -139,11 +130,11 @@ def runner(ql):
     
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             try:
                 buf = ql.uc.mem_read(ql.pc, 8)
-                ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+                ql.nprint("[+] %r", [hex(_) for _ in buf])
                 ql.nprint("\n")
                 ql_hook_code_disasm(ql, ql.pc, 64)
             except:
@@ -9,6 +9,7 @@ from unicorn.mips_const import *
 from qiling.loader.elf import *
 from qiling.os.linux.mips32_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.linux.syscall import *
 from qiling.os.utils import *
 from qiling.arch.filetype import *
@@ -21,48 +22,42 @@ QL_SHELLCODE_LEN = 0x1000
 QL_SHELLCODE_INIT = 0
 QL_MIPS32_EMU_END = 0x8fffffff
 
+def read_syscall_params(ql, argc):
+    params = [ql.uc.reg_read(reg) for reg in (UC_MIPS_REG_A0, UC_MIPS_REG_A1, UC_MIPS_REG_A2, UC_MIPS_REG_A3)[ : argc]]
+    # param4 and param5 are passed on the stack, handlers get their addresses
+    if argc > 4:
+        sp = ql.uc.reg_read(UC_MIPS_REG_SP)
+        params += [sp + 0x10, sp + 0x14][ : argc - 4]
+    return params
+
+
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_mips32_linux_syscall, globals(), read_syscall_params)
+
+
 def hook_syscall(ql, intno):
     syscall_num = ql.uc.reg_read(UC_MIPS_REG_V0)
-    param0 = ql.uc.reg_read(UC_MIPS_REG_A0)
-    param1 = ql.uc.reg_read(UC_MIPS_REG_A1)
-    param2 = ql.uc.reg_read(UC_MIPS_REG_A2)
-    param3 = ql.uc.reg_read(UC_MIPS_REG_A3)
-    param4 = ql.uc.reg_read(UC_MIPS_REG_SP)
-    param4 = param4 + 0x10
-    param5 = ql.uc.reg_read(UC_MIPS_REG_SP)
-    param5 = param5 + 0x14
-    pc = ql.uc.reg_read(UC_MIPS_REG_PC)
 
     if intno != 0x11:
         raise QlErrorExecutionStop("[!] got interrupt 0x%x ???" %intno)
 
-    while 1:
-        LINUX_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC != None:
-            LINUX_SYSCALL_FUNC_NAME = LINUX_SYSCALL_FUNC.__name__
-            break
-        LINUX_SYSCALL_FUNC_NAME = dict_mips32_linux_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC_NAME != None:
-            LINUX_SYSCALL_FUNC = eval(LINUX_SYSCALL_FUNC_NAME)
-            break
-        LINUX_SYSCALL_FUNC = None
-        LINUX_SYSCALL_FUNC_NAME = None
-        break
+    LINUX_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if LINUX_SYSCALL_FUNC != None:
         try:
-            LINUX_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(LINUX_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise
         except Exception as e:
-            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s" % (LINUX_SYSCALL_FUNC_NAME, e))
+            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s", LINUX_SYSCALL_FUNC.name, e)
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
                 td.stop()
                 td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
             raise 
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_MIPS_REG_PC)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
@@ -162,7 +157,7 @@ lab1:
     '''
 
     if ql.shellcode_init == 0:
-        ql.dprint ("[+] QL_SHELLCODE_ADDR(0x%x) and shellcode_init is %i" % (QL_SHELLCODE_ADDR, ql.shellcode_init))
+        ql.dprint("[+] QL_SHELLCODE_ADDR(0x%x) and shellcode_init is %i", QL_SHELLCODE_ADDR, ql.shellcode_init)
         uc.mem_map(QL_SHELLCODE_ADDR, QL_SHELLCODE_LEN)
         ql.shellcode_init = 1
 
@@ -205,9 +200,9 @@ def ql_syscall_mips32_thread_setthreadarea(ql, th, arg):
     uc.reg_write(UC_MIPS_REG_CP0_CONFIG3, CONFIG3_ULR)
     uc.reg_write(UC_MIPS_REG_CP0_USERLOCAL, address)
 
-    ql.dprint ("[+] multithread set_thread_area(0x%x)" % address)
+    ql.dprint("[+] multithread set_thread_area(0x%x)", address)
     # somehow for multithread these code are still not mature
-    ql.dprint ("[+] shellcode_init is %i" % (ql.shellcode_init))
+    ql.dprint("[+] shellcode_init is %i", ql.shellcode_init)
     if ql.shellcode_init == 0:
         if ql.archendian == QL_ENDIAN_EB:
             hook_shellcode(uc, pc + 4, bytes.fromhex('0000102500003825'), ql)
@@ -217,7 +212,7 @@ def ql_syscall_mips32_thread_setthreadarea(ql, th, arg):
 
 def ql_syscall_mips32_set_thread_area(ql, sta_area, null0, null1, null2, null3, null4):
     uc = ql.uc     
-    ql.nprint ("set_thread_area(0x%x)" % sta_area)
+    ql.nprint("set_thread_area(0x%x)", sta_area)
 
     if ql.thread_management != None and ql.multithread == True:
         ql.thread_management.cur_thread.special_settings_arg = sta_area
@@ -239,11 +234,12 @@ def loader_file(ql):
     else:
         uc = Uc(UC_ARCH_MIPS, UC_MODE_MIPS32 + UC_MODE_LITTLE_ENDIAN)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = QL_MIPS32_LINUX_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0): 
         ql.stack_size = QL_MIPS32_LINUX_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     loader = ELFLoader(ql.path, ql)
     if loader.load_with_ld(ql, ql.stack_address + ql.stack_size, argv = ql.argv, env = ql.env):
         raise QlErrorFileType("Unsupported FileType")
@@ -260,11 +256,12 @@ def loader_shellcode(ql):
     else:
         uc = Uc(UC_ARCH_MIPS, UC_MODE_MIPS32 + UC_MODE_LITTLE_ENDIAN)    
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address =  ql.stack_address  + 0x200000 - 0x1000
     ql.uc.mem_write(ql.stack_address, ql.shellcoder) 
 
@@ -314,11 +311,11 @@ def runner(ql):
 
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             try:
                 buf = ql.uc.mem_read(ql.pc, 8)
-                ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+                ql.nprint("[+] %r", [hex(_) for _ in buf])
                 ql.nprint("\n")
                 ql_hook_code_disasm(ql, ql.pc, 64)
             except:
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+import heapq, selectors, time
+
+
+class Reactor:
+    """
+    parks blocked threads on host fd readiness or on a deadline of the scheduler
+    clock. the scheduler polls it between rounds and waits in it when every thread
+    is blocked, so a thread stuck in accept() no longer holds up the others
+
+    a parked thread is woken by marking it running and calling its callback, which
+    completes the syscall it is blocked in (usually through Thread.set_syscall_return)
+    or parks it again. the callback gets the thread and the selector events that
+    fired, 0 for a deadline
+    """
+    def __init__(self):
+        # opened on the first fd wait, closed again by close()
+        self.selector = None
+        # fd -> {thread: (events, callback)}
+        self.waiters = {}
+        # thread -> fds it waits on
+        self.fds = {}
+        # (deadline, seq, thread, callback), entries of cancelled waits stay until popped
+        self.timers = []
+        # thread -> seq of its live timer
+        self.deadlines = {}
+        self.seq = 0
+
+    def wait_fd(self, t, fd, events, callback = None):
+        waiters = self.waiters.setdefault(fd, {})
+        waiters[t] = (events, callback)
+        self.fds.setdefault(t, []).append(fd)
+        self.__register(fd)
+
+    def wait_until(self, t, deadline, callback = None):
+        self.seq += 1
+        self.deadlines[t] = self.seq
+        heapq.heappush(self.timers, (deadline, self.seq, t, callback))
+
+    def cancel(self, t):
+        self.deadlines.pop(t, None)
+        for fd in self.fds.pop(t, []):
+            waiters = self.waiters.get(fd, None)
+            if waiters is not None:
+                waiters.pop(t, None)
+                self.__register(fd)
+
+    def drop_fd(self, fd):
+        """
+        stop watching fd, e.g. when it is closed. the threads that waited on it are
+        returned with all their waits cancelled and are left for the caller to wake
+        """
+        threads = list(self.waiters.get(fd, {}))
+        for t in threads:
+            self.cancel(t)
+        return threads
+
+    def next_deadline(self):
+        while self.timers and self.deadlines.get(self.timers[0][2], None) != self.timers[0][1]:
+            heapq.heappop(self.timers)
+        if self.timers:
+            return self.timers[0][0]
+        return None
+
+    def expire(self, now):
+        """
+        wake the threads whose deadline is not after now
+        """
+        while self.next_deadline() is not None and self.timers[0][0] <= now:
+            _, _, t, callback = heapq.heappop(self.timers)
+            self.__wake(t, callback, 0)
+
+    def poll(self, timeout = 0):
+        """
+        wake the threads whose fds are ready, waiting up to timeout seconds for
+        one to be. sleeps the timeout when no fd is waited on, returns whether any
+        thread woke
+        """
+        if not self.waiters:
+            if timeout > 0:
+                time.sleep(timeout)
+            return False
+
+        woken = False
+        for key, mask in self.__selector().select(timeout):
+            for t, (events, callback) in list(self.waiters.get(key.fd, {}).items()):
+                if events & mask and t in self.fds:
+                    self.__wake(t, callback, events & mask)
+                    woken = True
+        return woken
+
+    def save(self):
+        return (
+            dict((fd, dict(waiters)) for fd, waiters in self.waiters.items()),
+            dict((t, list(fds)) for t, fds in self.fds.items()),
+            list(self.timers),
+            dict(self.deadlines),
+            self.seq)
+
+    def load(self, state):
+        self.close()
+        waiters, fds, timers, deadlines, self.seq = state
+        self.waiters = dict((fd, dict(w)) for fd, w in waiters.items())
+        self.fds = dict((t, list(f)) for t, f in fds.items())
+        self.timers = list(timers)
+        self.deadlines = dict(deadlines)
+        for fd in list(self.waiters):
+            try:
+                self.__register(fd)
+            except (OSError, ValueError):
+                # gone since, let the syscalls run into the error
+                for t, (events, callback) in list(self.waiters.pop(fd).items()):
+                    if t in self.fds:
+                        self.__wake(t, callback, events)
+
+    def close(self):
+        """
+        releases the selector, a later wait opens a new one
+        """
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+    def __selector(self):
+        if self.selector is None:
+            self.selector = selectors.DefaultSelector()
+        return self.selector
+
+    def __wake(self, t, callback, events):
+        self.cancel(t)
+        t.running()
+        if callback != None:
+            callback(t, events)
+
+    def __register(self, fd):
+        # the selector waits on the union of the events the threads want
+        events = 0
+        for e, _ in self.waiters[fd].values():
+            events |= e
+
+        selector = self.__selector()
+        registered = fd in selector.get_map()
+        if events == 0:
+            del self.waiters[fd]
+            if registered:
+                selector.unregister(fd)
+        elif registered:
+            selector.modify(fd, events)
+        else:
+            selector.register(fd, events)
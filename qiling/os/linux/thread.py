@@ -3,7 +3,9 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
-from ..utils import ql_setup_logging_file, ql_setup_logging_stream, ql_setup_logger
+from ..utils import ql_setup_logging_file, ql_setup_logging_stream, ql_setup_logger, ql_definesyscall_return
+from .reactor import Reactor
+from collections import deque
 import os, time
 
 THREAD_EVENT_INIT_VAL = 0
@@ -19,6 +21,15 @@ THREAD_STATUS_BLOCKING = 1
 THREAD_STATUS_TERMINATED = 2
 THREAD_STATUS_TIMEOUT = 3
 
+FUTEX_BITSET_MATCH_ANY = 0xffffffff
+
+# instructions a thread runs before the next runnable one gets the cpu
+THREAD_TIME_SLICE = 1000
+# rate of the scheduler clock, guest timeouts are measured in charged instructions
+THREAD_INSN_PER_USEC = 100
+# scheduler clock advance, in us, of an idle pass with no deadline to move to
+THREAD_IDLE_TIME = 1000
+
 #GLOBAL_THREAD_ID = 0
 
 class Thread:
@@ -28,7 +39,12 @@ class Thread:
             ql.global_thread_id = os.getpid() + 1000
 
         self.total_time = total_time
+        # host time in us, checked against total_time between slices
         self.runing_time = 0
+        # instructions charged to the thread, not the ones it ran: the whole slice
+        # per run even when a syscall stops it early, and nothing for a run without
+        # a slice (count 0, the only thread)
+        self.charged_insns = 0
         self.context = context
         self.ql = ql
         self.special_settings_arg = special_settings_arg
@@ -95,18 +111,16 @@ class Thread:
         self.robust_list_head_ptr = None
         self.robust_list_head_len = None
 
+        # futex the thread waits on, see ThreadManagement.futex_wait
+        self.futex_uaddr = None
+        self.futex_bitset = FUTEX_BITSET_MATCH_ANY
+
         if self.set_child_tid_address != None:
             self.ql.uc.mem_write(self.set_child_tid_address, ql.pack32(self.thread_id))
 
         ql.global_thread_id += 1
     
-    def run(self, timeout = 0):
-        # Set the time of the current run
-        if timeout == 0 and self.total_time != 0:
-            time_slice = self.total_time - self.runing_time
-        else:
-            time_slice = timeout
-        
+    def run(self, count = 0):
         # Initialize, stop event
         self.return_val = 0
         self.stop_event = THREAD_EVENT_INIT_VAL
@@ -116,13 +130,17 @@ class Thread:
         if self.special_settings_fuc != None and self.special_settings_arg != None:
             self.special_settings_fuc(self.ql, self, self.special_settings_arg)
         
-        # Run and log the run event
-        s_time = int(time.time() * 1000000)
+        # Run at most count instructions, the whole slice is charged even when a
+        # syscall stops it early, so the accounting does not depend on the host.
+        # no timeout in unicorn, it would cut a slice at a host dependent point,
+        # total_time is checked once the slice is over
+        s_time = time.perf_counter()
         self.start_address = self.ql.pc
-        self.ql.uc.emu_start(self.start_address, self.until_addr, time_slice)
-        e_time = int(time.time() * 1000000)
+        self.ql.uc.emu_start(self.start_address, self.until_addr, 0, count)
+        e_time = time.perf_counter()
         
-        self.runing_time += (e_time - s_time)
+        self.runing_time += int((e_time - s_time) * 1000000)
+        self.charged_insns += count
         
         if self.total_time != 0 and self.runing_time >= self.total_time:
             self.status = THREAD_STATUS_TIMEOUT
@@ -131,7 +149,7 @@ class Thread:
             self.stop()
             self.stop_event = THREAD_EVENT_EXIT_EVENT
         
-        return (e_time - s_time)
+        return count
     
     def suspend(self):
         self.context = self.ql.uc.context_save()
@@ -163,8 +181,15 @@ class Thread:
         self.clear_child_tid_address = addr
     
     def _on_stop(self):
+        tm = self.ql.thread_management
+        if tm != None:
+            tm.futex_cancel(self)
+            tm.reactor.cancel(self)
         if self.clear_child_tid_address != None:
             self.ql.uc.mem_write(self.clear_child_tid_address, self.ql.pack32(0))
+            # the kernel wakes a joiner waiting on the tid
+            if tm != None:
+                tm.futex_wake(self.clear_child_tid_address, 1)
 
     def stop(self):
         self._on_stop()
@@ -207,7 +232,18 @@ class Thread:
         self.blocking_condition_fuc = bc_fuc
         self.blocking_condition_arg = bc_arg
     
+    def set_syscall_return(self, regreturn):
+        # return value of the syscall a blocked thread is waiting in
+        old_context = self.ql.uc.context_save()
+        self.ql.uc.context_restore(self.context)
+        ql_definesyscall_return(self.ql, regreturn)
+        self.context = self.ql.uc.context_save()
+        self.ql.uc.context_restore(old_context)
+
     def is_continue_blocking(self):
+        if self.blocking_condition_fuc == None:
+            # parked on an event, woken by whoever delivers it
+            return True
         if self.blocking_condition_arg == None:
             return self.blocking_condition_fuc(self.ql, self)
         else:
@@ -246,73 +282,112 @@ class Thread:
         
 
 class ThreadManagement:
-    def __init__(self, ql, time_slice = 1000):
+    """
+    round robin over a run queue, each thread gets time_slice instructions per turn.
+    with ql.timeout set the only thread runs in slices too, so the timeout is
+    checked between them. the clock (runing_time, in us) advances by the
+    instructions charged (charged_insns, slices handed out) and, when
+    every thread is blocked, up to the next deadline of the reactor, so schedules
+    and guest timeouts do not depend on how fast the host is. only waits on host
+    fds take host time into account
+    """
+    def __init__(self, ql, time_slice = THREAD_TIME_SLICE):
         self.cur_thread = None
-        self.running_thread_list = []
-        self.ending_thread_list = []
-        self.blocking_thread_list = []
+        # runnable threads, in the order they get the cpu
+        self.run_queue = deque()
+        # blocked threads, a dict used as an insertion ordered set
+        self.blocking_threads = {}
+        self.ending_threads = []
         self.main_thread = None
         self.ql = ql
         self.time_slice = time_slice
         self.total_time = ql.timeout
+        self.charged_insns = 0
+        self.idle_time = 0
         self.runing_time = 0
+        # uaddr -> threads waiting on it, in the order they came
+        self.futex_queues = {}
+        self.reactor = Reactor()
 
     def run(self):
-        if len(self.running_thread_list) == 0:
+        if len(self.run_queue) == 0:
             self.ql.dprint('[!] No executable thread!')
             return
         
-        if self.main_thread not in self.running_thread_list:
+        if self.main_thread not in self.run_queue:
             self.ql.dprint('[!] No main thread!')
             return
         
+        try:
+            self.__schedule()
+        finally:
+            # host fds are not watched past the run, a later run opens a new selector
+            self.reactor.close()
+
+    def __schedule(self):
         while True:
-            running_thread_num = len(self.running_thread_list)
-            blocking_thread_num = len(self.blocking_thread_list)
-            if running_thread_num == 1 and blocking_thread_num == 0:
-                time_slice = 0
+            running_thread_num = len(self.run_queue)
+            if running_thread_num == 1 and len(self.blocking_threads) == 0 and self.total_time == 0:
+                count = 0
             else:
-                time_slice = self.time_slice
+                count = self.time_slice
             
             if running_thread_num != 0:
+                # threads created or woken during the round queue up behind it
                 for i in range(running_thread_num):
-                    self.cur_thread = self.running_thread_list[i]
-                    self.ql.dprint("[+] Currently running pid is: %d; tid is: %d " % (os.getpid() ,self.cur_thread.get_thread_id()))
+                    t = self.run_queue.popleft()
+                    self.cur_thread = t
+                    self.ql.dprint("[+] Currently running pid is: %d; tid is: %d " % (os.getpid() ,t.get_thread_id()))
                     
-                    self.runing_time += self.running_thread_list[i].run(time_slice)
-
-                    if self.running_thread_list[i].is_running():
-                        if self.running_thread_list[i].stop_event == THREAD_EVENT_CREATE_THREAD:
-                            new_pc = self.ql.archfunc.get_pc()
-                            self.cur_thread.stop_return_val.set_start_address(new_pc)
-                            self.add_running_thread(self.cur_thread.stop_return_val)
-                            self.cur_thread.stop_return_val = None
-                    elif self.running_thread_list[i].is_blocking():
-                        pass
+                    self.tick(t.run(count))
+
+                    if t.is_running():
+                        new_thread = None
+                        if t.stop_event == THREAD_EVENT_CREATE_THREAD:
+                            new_thread = t.stop_return_val
+                            new_thread.set_start_address(self.ql.archfunc.get_pc())
+                            t.stop_return_val = None
+                        self.cur_thread = None
+                        t.suspend()
+                        self.run_queue.append(t)
+                        if new_thread != None:
+                            self.add_running_thread(new_thread)
+                    elif t.is_blocking():
+                        self.cur_thread = None
+                        t.suspend()
+                        self.add_blocking_thread(t)
                     else:
-                        if self.cur_thread == self.main_thread:
-                            self.exit_world()
-                            return
-                        
-                        if self.running_thread_list[i].stop_event == THREAD_EVENT_EXIT_GROUP_EVENT:
-                            self.exit_world()
-                            return
-                        elif self.running_thread_list[i].stop_event == THREAD_EVENT_UNEXECPT_EVENT:
+                        if t == self.main_thread or t.stop_event in (THREAD_EVENT_EXIT_GROUP_EVENT, THREAD_EVENT_UNEXECPT_EVENT):
+                            self.run_queue.appendleft(t)
                             self.exit_world()
                             return
                         self.cur_thread = None
-
-                        continue
-
-                    self.cur_thread = None
-                    self.running_thread_list[i].suspend()
+                        self.add_ending_thread(t)
             else:
-                self.runing_time += time_slice
-                time.sleep(time_slice / 1000000)
+                self.idle()
 
-            self.clean_running_thread()
+            self.reactor.poll()
+            self.reactor.expire(self.runing_time)
             self.clean_blocking_thread()
     
+    def idle(self):
+        # every thread is blocked, wait for an fd or move the clock to the next deadline
+        deadline = self.reactor.next_deadline()
+        if deadline is None:
+            wait = THREAD_IDLE_TIME
+        else:
+            wait = max(deadline - self.runing_time, 0)
+
+        s_time = time.perf_counter()
+        if self.reactor.poll(wait / 1000000):
+            wait = min(wait, int((time.perf_counter() - s_time) * 1000000))
+        self.idle_time += wait
+        self.tick(0)
+    
+    def tick(self, count):
+        self.charged_insns += count
+        self.runing_time = self.idle_time + self.charged_insns // THREAD_INSN_PER_USEC
+    
     def set_main_thread(self, mt):
         self.main_thread = mt
         self.add_running_thread(mt)
@@ -321,54 +396,158 @@ class ThreadManagement:
         self.time_slice = t
     
     def add_running_thread(self, t):
-        if t not in self.running_thread_list:
-            self.running_thread_list.append(t)
+        self.run_queue.append(t)
     
     def add_blocking_thread(self, t):
-        if t not in self.blocking_thread_list:
-            self.blocking_thread_list.append(t)
+        self.blocking_threads[t] = None
     
     def add_ending_thread(self, t):
-        if t not in self.ending_thread_list:
-            self.ending_thread_list.append(t)
-    
-    def clean_running_thread(self):
-        tmp_list = self.running_thread_list
-        self.running_thread_list = []
-        for t in tmp_list:
-            if t.is_running():
-                self.add_running_thread(t)
-            elif t.is_blocking():
-                self.add_blocking_thread(t)
-            else:
-                self.add_ending_thread(t)
+        self.ending_threads.append(t)
     
     def clean_blocking_thread(self):
-        tmp_list = self.blocking_thread_list
-        self.blocking_thread_list = []
-        for t in tmp_list:
-            if t.is_continue_blocking():
-                self.add_blocking_thread(t)
+        for t in list(self.blocking_threads):
+            if t.is_running():
+                # woken up by an event, e.g. a futex wake
+                pass
+            elif t.is_continue_blocking():
+                continue
             else:
-                self.add_running_thread(t)
                 t.running()
-    
+            del self.blocking_threads[t]
+            self.add_running_thread(t)
+    
+    def wait_fd(self, t, fd, events, callback = None):
+        """
+        block t until the host fd is ready for events (selectors.EVENT_READ or
+        EVENT_WRITE), callback(t, events) then completes its syscall
+        """
+        t.blocking()
+        t.set_blocking_condition(None)
+        self.reactor.wait_fd(t, fd, events, callback)
+
+    def drop_fd(self, fd, regreturn):
+        """
+        the host fd is going away (close, shutdown), the threads waiting on it
+        return regreturn from their syscall
+        """
+        for t in self.reactor.drop_fd(fd):
+            t.running()
+            t.set_syscall_return(regreturn)
+
+    def wait_until(self, t, deadline, callback = None):
+        """
+        block t until runing_time reaches deadline, callback(t, 0) then completes
+        its syscall. a thread can wait on fds and a deadline at once, the first
+        one to come wakes it
+        """
+        t.blocking()
+        t.set_blocking_condition(None)
+        self.reactor.wait_until(t, deadline, callback)
+
+    def futex_wait(self, t, uaddr, bitset = FUTEX_BITSET_MATCH_ANY):
+        t.futex_uaddr = uaddr
+        t.futex_bitset = bitset
+        self.futex_queues.setdefault(uaddr, deque()).append(t)
+        t.blocking()
+        t.set_blocking_condition(None)
+
+    def futex_cancel(self, t):
+        # take a waiter off its queue without waking it, e.g. on a timeout
+        if t.futex_uaddr is None:
+            return
+        queue = self.futex_queues.get(t.futex_uaddr, None)
+        if queue is not None and t in queue:
+            queue.remove(t)
+            if not queue:
+                del self.futex_queues[t.futex_uaddr]
+        t.futex_uaddr = None
+
+    def futex_wake(self, uaddr, count, bitset = FUTEX_BITSET_MATCH_ANY):
+        """
+        wake up to count waiters on uaddr whose bitset matches, returns how many woke
+        """
+        queue = self.futex_queues.get(uaddr, None)
+        if queue is None:
+            return 0
+
+        woken = 0
+        for t in list(queue):
+            if woken >= count:
+                break
+            if t.futex_bitset & bitset:
+                queue.remove(t)
+                t.futex_uaddr = None
+                self.reactor.cancel(t)
+                t.running()
+                woken += 1
+        if not queue:
+            del self.futex_queues[uaddr]
+        return woken
+
+    def futex_requeue(self, uaddr, uaddr2, nr_wake, nr_requeue):
+        """
+        wake nr_wake waiters on uaddr and move up to nr_requeue of the rest to
+        uaddr2, returns (woken, requeued)
+        """
+        woken = self.futex_wake(uaddr, nr_wake)
+        queue = self.futex_queues.get(uaddr, None)
+        requeued = 0
+        if queue is not None and uaddr2 != uaddr:
+            queue2 = self.futex_queues.setdefault(uaddr2, deque())
+            while queue and requeued < nr_requeue:
+                t = queue.popleft()
+                t.futex_uaddr = uaddr2
+                queue2.append(t)
+                requeued += 1
+            if not queue:
+                del self.futex_queues[uaddr]
+        return woken, requeued
+
+    def save(self):
+        # threads keep their state in plain attributes, contexts are replaced and never changed in place
+        threads = set(self.run_queue) | set(self.blocking_threads) | set(self.ending_threads)
+        threads |= set(t for t in (self.main_thread, self.cur_thread) if t != None)
+        threads |= set(t for queue in self.futex_queues.values() for t in queue)
+        return {
+            "threads": [(t, dict(t.__dict__)) for t in threads],
+            "run_queue": list(self.run_queue),
+            "blocking_threads": list(self.blocking_threads),
+            "ending_threads": list(self.ending_threads),
+            "main_thread": self.main_thread,
+            "cur_thread": self.cur_thread,
+            "futex_queues": dict((uaddr, list(queue)) for uaddr, queue in self.futex_queues.items()),
+            "clock": (self.charged_insns, self.idle_time, self.runing_time),
+            "reactor": self.reactor.save(),
+        }
+
+    def load(self, state):
+        for t, attrs in state["threads"]:
+            t.__dict__.clear()
+            t.__dict__.update(attrs)
+        self.run_queue = deque(state["run_queue"])
+        self.blocking_threads = dict.fromkeys(state["blocking_threads"])
+        self.ending_threads = list(state["ending_threads"])
+        self.main_thread = state["main_thread"]
+        self.cur_thread = state["cur_thread"]
+        self.futex_queues = dict((uaddr, deque(queue)) for uaddr, queue in state["futex_queues"].items())
+        self.charged_insns, self.idle_time, self.runing_time = state["clock"]
+        self.reactor.load(state["reactor"])
+
     def exit_world(self):
         if self.ql.child_processes == True:
             os._exit(0)
 
-        for t in self.running_thread_list:
+        for t in list(self.run_queue) + list(self.blocking_threads):
             t.save()
             t.stop()
             self.add_ending_thread(t)
-        for t in self.blocking_thread_list:
-            t.save()
-            t.stop()
-            self.add_blocking_thread(t)
-        self.running_thread_list = []
-        self.blocking_thread_list = []
+        self.run_queue.clear()
+        self.blocking_threads.clear()
     
     def clean_world(self):
-        self.running_thread_list = []
-        self.blocking_thread_list = []
-        self.ending_thread_list = []
+        self.reactor.close()
+        self.reactor = Reactor()
+        self.run_queue = deque()
+        self.blocking_threads = {}
+        self.ending_threads = []
+        self.futex_queues = {}
@@ -10,6 +10,7 @@ from qiling.loader.elf import *
 from qiling.arch.x86 import *
 from qiling.os.linux.x86_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.linux.syscall import *
 from qiling.os.utils import *
 from qiling.os.linux.thread import *
@@ -19,43 +20,31 @@ QL_X86_LINUX_PREDEFINE_STACKADDRESS = 0xfffdd000
 QL_X86_LINUX_PREDEFINE_STACKSIZE = 0x21000
 QL_X86_EMU_END = 0x8fffffff
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_x86_linux_syscall, globals(), ql_syscall_reg_reader(
+        UC_X86_REG_EBX, UC_X86_REG_ECX, UC_X86_REG_EDX, UC_X86_REG_ESI, UC_X86_REG_EDI, UC_X86_REG_EBP))
+
+
 def hook_syscall(ql, intno):
     syscall_num  = ql.uc.reg_read(UC_X86_REG_EAX)
-    param0 = ql.uc.reg_read(UC_X86_REG_EBX)
-    param1 = ql.uc.reg_read(UC_X86_REG_ECX)
-    param2 = ql.uc.reg_read(UC_X86_REG_EDX)
-    param3 = ql.uc.reg_read(UC_X86_REG_ESI)
-    param4 = ql.uc.reg_read(UC_X86_REG_EDI)
-    param5 = ql.uc.reg_read(UC_X86_REG_EBP)
-    pc = ql.uc.reg_read(UC_X86_REG_EIP)
-
-    while 1:
-        LINUX_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC != None:
-            LINUX_SYSCALL_FUNC_NAME = LINUX_SYSCALL_FUNC.__name__
-            break
-        LINUX_SYSCALL_FUNC_NAME = dict_x86_linux_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC_NAME != None:
-            LINUX_SYSCALL_FUNC = eval(LINUX_SYSCALL_FUNC_NAME)
-            break
-        LINUX_SYSCALL_FUNC = None
-        LINUX_SYSCALL_FUNC_NAME = None
-        break
+
+    LINUX_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if LINUX_SYSCALL_FUNC != None:
         try:
-            LINUX_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(LINUX_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise
         except Exception as e:
-            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s" % (LINUX_SYSCALL_FUNC_NAME, e))
+            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s", LINUX_SYSCALL_FUNC.name, e)
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
                 td.stop()
                 td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
             raise
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_X86_REG_EIP)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
@@ -73,7 +62,7 @@ def ql_x86_thread_set_tls(ql, th, arg):
     
 
 def ql_x86_syscall_set_thread_area(ql, u_info_addr, null0, null1, null2, null3, null4):
-    ql.nprint("set_thread_area(u_info_addr= 0x%x)" % u_info_addr)
+    ql.nprint("set_thread_area(u_info_addr= 0x%x)", u_info_addr)
     u_info = ql.uc.mem_read(u_info_addr, 4 * 3)
 
     if ql.thread_management != None and ql.multithread == True:
@@ -81,7 +70,7 @@ def ql_x86_syscall_set_thread_area(ql, u_info_addr, null0, null1, null2, null3,
 
     base = ql.unpack32(u_info[4 : 8])
     limit = ql.unpack32(u_info[8 : 12])
-    ql.nprint("[+] set_thread_area base : 0x%x limit is : 0x%x" % (base, limit))
+    ql.nprint("[+] set_thread_area base : 0x%x limit is : 0x%x", base, limit)
     ql_x86_setup_syscall_set_thread_area(ql, base, limit)
     ql.uc.mem_write(u_info_addr, ql.pack32(12))
     regreturn = 0
@@ -91,11 +80,12 @@ def ql_x86_syscall_set_thread_area(ql, u_info_addr, null0, null1, null2, null3,
 def loader_file(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_32)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = QL_X86_LINUX_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0):        
         ql.stack_size = QL_X86_LINUX_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     loader = ELFLoader(ql.path, ql)
     if loader.load_with_ld(ql, ql.stack_address + ql.stack_size, argv = ql.argv,  env = ql.env):
         raise QlErrorFileType("Unsupported FileType")
@@ -112,11 +102,12 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_32)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address,  ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address =  ql.stack_address  + 0x100000
     ql.uc.mem_write(ql.stack_address, ql.shellcoder)
 
@@ -170,11 +161,11 @@ def runner(ql):
 
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             try:
                 buf = ql.uc.mem_read(ql.pc, 8)
-                ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+                ql.nprint("[+] %r", [hex(_) for _ in buf])
                 ql.nprint("\n")
                 ql_hook_code_disasm(ql, ql.pc, 64)
             except:
@@ -10,6 +10,7 @@ from qiling.loader.elf import *
 from qiling.arch.x86 import *
 from qiling.os.linux.x8664_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.linux.syscall import *
 from qiling.os.utils import *
 from qiling.arch.filetype import *
@@ -20,43 +21,31 @@ QL_X8664_LINUX_PREDEFINE_STACKSIZE = 0x21000
 
 QL_X8664_EMU_END = 0xffffffffffffffff
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_x8664_linux_syscall, globals(), ql_syscall_reg_reader(
+        UC_X86_REG_RDI, UC_X86_REG_RSI, UC_X86_REG_RDX, UC_X86_REG_R10, UC_X86_REG_R8, UC_X86_REG_R9))
+
+
 def hook_syscall(ql):
     syscall_num  = ql.uc.reg_read(UC_X86_REG_RAX)
-    param0 = ql.uc.reg_read(UC_X86_REG_RDI)
-    param1 = ql.uc.reg_read(UC_X86_REG_RSI)
-    param2 = ql.uc.reg_read(UC_X86_REG_RDX)
-    param3 = ql.uc.reg_read(UC_X86_REG_R10)
-    param4 = ql.uc.reg_read(UC_X86_REG_R8)
-    param5 = ql.uc.reg_read(UC_X86_REG_R9)
-    pc = ql.uc.reg_read(UC_X86_REG_RIP)
-
-    while 1:
-        LINUX_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC != None:
-            LINUX_SYSCALL_FUNC_NAME = LINUX_SYSCALL_FUNC.__name__
-            break
-        LINUX_SYSCALL_FUNC_NAME = dict_x8664_linux_syscall.get(syscall_num, None)
-        if LINUX_SYSCALL_FUNC_NAME != None:
-            LINUX_SYSCALL_FUNC = eval(LINUX_SYSCALL_FUNC_NAME)
-            break
-        LINUX_SYSCALL_FUNC = None
-        LINUX_SYSCALL_FUNC_NAME = None
-        break
+
+    LINUX_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if LINUX_SYSCALL_FUNC != None:
         try:
-            LINUX_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(LINUX_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise
         except Exception as e:
-            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s" % (LINUX_SYSCALL_FUNC_NAME, e))
+            ql.nprint("[!] SYSCALL ERROR: %s\n[-] %s", LINUX_SYSCALL_FUNC.name, e)
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
                 td.stop()
                 td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
             raise
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_X86_REG_RIP)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             if ql.multithread == True:
                 td = ql.thread_management.cur_thread
@@ -69,11 +58,12 @@ def hook_syscall(ql):
 def loader_file(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_64)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = QL_X8664_LINUX_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0):     
         ql.stack_size = QL_X8664_LINUX_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     loader = ELFLoader(ql.path, ql)
     if loader.load_with_ld(ql, ql.stack_address + ql.stack_size, argv = ql.argv,  env = ql.env):
         raise QlErrorFileType("Unsupported FileType")
@@ -91,11 +81,12 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_64)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address,  ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address = ql.stack_address  + 0x200000 - 0x1000
     ql.uc.mem_write(ql.stack_address, ql.shellcoder)
     
@@ -146,11 +137,11 @@ def runner(ql):
 
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             try:
                 buf = ql.uc.mem_read(ql.pc, 8)
-                ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+                ql.nprint("[+] %r", [hex(_) for _ in buf])
                 ql.nprint("\n")
                 ql_hook_code_disasm(ql, ql.pc, 64)
             except:
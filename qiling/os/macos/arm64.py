@@ -19,6 +19,7 @@ from qiling.os.macos.subsystems import *
 from qiling.os.macos.task import *
 from qiling.os.macos.mach_port import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.utils import *
 from qiling.arch.filetype import *
 
@@ -28,43 +29,30 @@ QL_ARM64_MACOS_PREDEFINE_MMAPADDRESS        = 0x7ffbf0100000
 QL_ARM64_MACOS_PREDEFINE_VMMAP_TRAP_ADDRESS = 0x4000000f4000
 QL_ARM64_EMU_END                            = 0xffffffffffffffff
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_arm64_macos_syscall, globals(), ql_syscall_reg_reader(
+        UC_ARM64_REG_X0, UC_ARM64_REG_X1, UC_ARM64_REG_X2, UC_ARM64_REG_X3, UC_ARM64_REG_X4, UC_ARM64_REG_X5))
+
+
 def hook_syscall(ql):
     syscall_num  = ql.uc.reg_read(UC_ARM64_REG_X8)
-    param0 = ql.uc.reg_read(UC_ARM64_REG_X0)
-    param1 = ql.uc.reg_read(UC_ARM64_REG_X1)
-    param2 = ql.uc.reg_read(UC_ARM64_REG_X2)
-    param3 = ql.uc.reg_read(UC_ARM64_REG_X3)
-    param4 = ql.uc.reg_read(UC_ARM64_REG_X4)
-    param5 = ql.uc.reg_read(UC_ARM64_REG_X5)
-    pc = ql.uc.reg_read(UC_ARM64_REG_PC)
-
-
-    while 1:
-        MACOS_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC != None:
-            MACOS_SYSCALL_FUNC_NAME = MACOS_SYSCALL_FUNC.__name__
-            break
-        MACOS_SYSCALL_FUNC_NAME = dict_arm64_macos_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC_NAME != None:
-            MACOS_SYSCALL_FUNC = eval(MACOS_SYSCALL_FUNC_NAME)
-            break
-        MACOS_SYSCALL_FUNC = None
-        MACOS_SYSCALL_FUNC_NAME = None
-        break
+
+    MACOS_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if MACOS_SYSCALL_FUNC != None:
         try:
-            MACOS_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(MACOS_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise            
         except Exception:
-            ql.nprint("[!] SYSCALL ERROR: ", MACOS_SYSCALL_FUNC_NAME)
+            ql.nprint("[!] SYSCALL ERROR: ", MACOS_SYSCALL_FUNC.name)
             #td = ql.thread_management.cur_thread
             #td.stop()
             #td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
-            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC_NAME))
+            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC.name))
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_ARM64_REG_PC)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             #td = ql.thread_management.cur_thread
             #td.stop()
@@ -81,6 +69,7 @@ def ql_arm64_enable_vfp(uc):
 def loader_file(ql):
     uc = Uc(UC_ARCH_ARM64, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     ql.macho_task = MachoTask()
     ql.macho_fs = FileSystem(ql)
     ql.macho_mach_port = MachPort(2187)
@@ -95,7 +84,7 @@ def loader_file(ql):
     if (ql.stack_size == 0): 
         ql.stack_size = QL_ARM64_MACOS_PREDEFINE_STACKSIZE
     
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     stack_esp = QL_ARM64_MACOS_PREDEFINE_STACKADDRESS + QL_ARM64_MACOS_PREDEFINE_STACKSIZE
     envs = env_dict_to_array(ql.env)
     apples = ql_real_to_vm_abspath(ql, ql.path)
@@ -108,13 +97,14 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_ARM64, UC_MODE_ARM)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
 
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
 
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address =  ql.stack_address  + 0x200000 - 0x1000    
     ql.uc.mem_write(ql.stack_address, ql.shellcoder)
     
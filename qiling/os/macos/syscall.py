@@ -125,7 +125,7 @@ def ql_syscall_access_macos(ql, path, flags, null0, null1, null2, null3):
 
 # 0x30 
 def ql_syscall_sigprocmask(ql, how, mask, omask, null0, null1, null2):
-    ql.nprint("syscall >> sigprocmask(how: 0x%X, mask: 0x%X, omask: 0x%X)" % (how, mask, omask))
+    ql.nprint("syscall >> sigprocmask(how: 0x%X, mask: 0x%X, omask: 0x%X)", how, mask, omask)
 
 # 0x4a 
 
@@ -147,7 +147,7 @@ def ql_syscall_fcntl64_macos(ql, fcntl_fd, fcntl_cmd, fcntl_arg, null1, null2, n
     else:
         regreturn = 0
 
-    ql.nprint("fcntl64(%d, %d, 0x%x) = %d" % (fcntl_fd, fcntl_cmd, fcntl_arg, regreturn))
+    ql.nprint("fcntl64(%d, %d, 0x%x) = %d", fcntl_fd, fcntl_cmd, fcntl_arg, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 # 0x99
@@ -177,14 +177,9 @@ def ql_syscall_getattrlist(ql, path, alist, attributeBuffer, bufferSize, options
     ql.nprint("syscall >> getattrlist(path: 0x{:X}, alist: 0x{:X}, attributeBuffer: 0x{:X}, bufferSize: {}, options: {})".format(
         path, alist, attributeBuffer, bufferSize, options
     ))
-    attrlist = {}
-    attrlist["bitmapcount"] = unpack("<H", ql.uc.mem_read(alist, 2))[0]
-    attrlist["reserved"] = unpack("<H", ql.uc.mem_read(alist + 2, 2))[0]
-    attrlist["commonattr"] = unpack("<L", ql.uc.mem_read(alist + 4, 4))[0]
-    attrlist["volattr"] = unpack("<L", ql.uc.mem_read(alist + 8, 4))[0]
-    attrlist["dirattr"] = unpack("<L", ql.uc.mem_read(alist + 12, 4))[0]
-    attrlist["fileattr"] = unpack("<L", ql.uc.mem_read(alist + 16, 4))[0]
-    attrlist["forkattr"] = unpack("<L", ql.uc.mem_read(alist + 20, 4))[0]
+    attrlist = dict(zip(
+        ("bitmapcount", "reserved", "commonattr", "volattr", "dirattr", "fileattr", "forkattr"),
+        ql.mem.read_struct(alist, "<HHLLLLL")))
     path_str = macho_read_string(ql, path, MAX_PATH_SIZE)
 
     ql.nprint("\nbitmapcount {}, reserved {}, commonattr {}, volattr {}, dirattr {}, fileattr {}, forkattr {}\n".format(
@@ -432,7 +427,7 @@ def ql_syscall_fstat64_macos(ql, fstat64_fd, fstat64_add, null0, null1, null2, n
     else:
         regreturn = -1
 
-    ql.nprint("fstat64(%d, 0x%x) = %d" % (fstat64_fd, fstat64_add, regreturn))
+    ql.nprint("fstat64(%d, 0x%x) = %d", fstat64_fd, fstat64_add, regreturn)
     if regreturn == 0:
         ql.dprint("[+] fstat64 write completed")
     else:
@@ -477,11 +472,11 @@ def ql_syscall_thread_open_nocancel(ql, filename, flags, mode, null0, null1, nul
         except:
             regreturn = -1
 
-    ql.nprint("open(%s, 0x%x, 0x%x) = %d" % (relative_path, flags, mode, regreturn))
+    ql.nprint("open(%s, 0x%x, 0x%x) = %d", relative_path, flags, mode, regreturn)
     if regreturn >= 0 and regreturn != 2:
-        ql.dprint("[+] File Found: %s" % relative_path)
+        ql.dprint("[+] File Found: %s", relative_path)
     else:
-        ql.dprint("[!] File Not Found %s" % relative_path)
+        ql.dprint("[!] File Not Found %s", relative_path)
     ql_definesyscall_return(ql, regreturn)
 
 # 0x1b6
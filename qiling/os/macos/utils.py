@@ -25,14 +25,4 @@ def set_eflags_cf(ql, target_cf):
 
 
 def macho_read_string(ql, address, max_length):
-    ret = ""
-    c = ql.uc.mem_read(address, 1)[0]
-    read_bytes = 1
-
-    while c != 0x0:
-        ret += chr(c)
-        c = ql.uc.mem_read(address + read_bytes, 1)[0]
-        read_bytes += 1
-        if read_bytes > max_length:
-            break
-    return ret
\ No newline at end of file
+    return ql.mem.read_cstr(address, "latin-1", limit=max_length)
\ No newline at end of file
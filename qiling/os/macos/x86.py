@@ -10,6 +10,7 @@ from qiling.loader.macho import *
 from qiling.arch.x86 import *
 from qiling.os.macos.x86_syscall import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.macos.syscall import *
 from qiling.os.macos.utils import *
 from qiling.os.utils import *
@@ -20,19 +21,19 @@ QL_X86_MACOS_PREDEFINE_STACKSIZE = 0x21000
 
 QL_X86_EMU_END = 0x8fffffff
 
+def read_syscall_params(ql, argc):
+    return [ql.stack_read(4 * (i + 1)) for i in range(argc)]
+
+
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_x86_macos_syscall, globals(), read_syscall_params)
+
+
 def hook_syscall(ql, intno):
     syscall_num  = ql.uc.reg_read(UC_X86_REG_EAX)
-    param0 = ql.uc.reg_read(UC_X86_REG_EAX)
-    param0 = ql.stack_read(4 * 1)
-    param1 = ql.stack_read(4 * 2)
-    param2 = ql.stack_read(4 * 3)
-    param3 = ql.stack_read(4 * 4)
-    param4 = ql.stack_read(4 * 5)
-    param5 = ql.stack_read(4 * 6)
-    pc = ql.uc.reg_read(UC_X86_REG_RIP)
 
     if intno not in (0x80, 0x81, 0x82):
-        ql.nprint("got interrupt 0x%x ???" %intno)
+        ql.nprint("got interrupt 0x%x ???", intno)
         return
 
     if intno == 0x81:
@@ -41,32 +42,22 @@ def hook_syscall(ql, intno):
     elif intno == 0x82:
         syscall_num = syscall_num + 0x8200
 
-    while 1:
-        MACOS_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC != None:
-            MACOS_SYSCALL_FUNC_NAME = MACOS_SYSCALL_FUNC.__name__
-            break
-        MACOS_SYSCALL_FUNC_NAME = dict_x86_macos_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC_NAME != None:
-            MACOS_SYSCALL_FUNC = eval(MACOS_SYSCALL_FUNC_NAME)
-            break
-        MACOS_SYSCALL_FUNC = None
-        MACOS_SYSCALL_FUNC_NAME = None
-        break
+    MACOS_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if MACOS_SYSCALL_FUNC != None:
         try:
-            MACOS_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(MACOS_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise            
         except Exception:
-            ql.nprint("[!] SYSCALL ERROR: ", MACOS_SYSCALL_FUNC_NAME)
+            ql.nprint("[!] SYSCALL ERROR: ", MACOS_SYSCALL_FUNC.name)
             #td = ql.thread_management.cur_thread
             #td.stop()
             #td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
-            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC_NAME))
+            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC.name))
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_X86_REG_RIP)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             #td = ql.thread_management.cur_thread
             #td.stop()
@@ -77,12 +68,13 @@ def hook_syscall(ql, intno):
 def loader_file(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_32)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     ql.mmap_start = 0xd0000000
     if (ql.stack_address == 0):
         ql.stack_address = QL_X86_MACOS_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0): 
         ql.stack_size = QL_X86_MACOS_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     stack_esp = QL_X86_MACOS_PREDEFINE_STACKADDRESS + QL_X86_MACOS_PREDEFINE_STACKSIZE
     envs = env_dict_to_array(ql.env)
     loader = MachoX86(ql, ql.path, stack_esp, [ql.path], envs, [ql.path], 1)
@@ -93,11 +85,12 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_32)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address,  ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address= ql.stack_address  + 0x200000 - 0x1000
     ql.uc.mem_write(ql.stack_address, ql.shellcoder)
     
@@ -119,7 +112,7 @@ def runner(ql):
             ql.uc.emu_start(ql.entry_point, ql.until_addr, ql.timeout)
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             buf = ql.uc.mem_read(ql.pc, 8)
             ql.nprint("[+] ", [hex(_) for _ in buf])
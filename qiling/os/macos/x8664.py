@@ -19,6 +19,7 @@ from qiling.os.macos.subsystems import *
 from qiling.os.macos.task import *
 from qiling.os.macos.mach_port import *
 from qiling.os.posix.syscall import *
+from qiling.os.posix.syscall_table import *
 from qiling.os.utils import *
 from qiling.arch.filetype import *
 
@@ -30,42 +31,30 @@ QL_X8664_MACOS_PREDEFINE_VMMAP_TRAP_ADDRESS = 0x4000000f4000
 
 QL_X8664_EMU_END = 0xffffffffffffffff
 
+def ql_setup_syscall_table(ql):
+    ql.syscall_table = SyscallTable(ql, dict_x8664_macos_syscall, globals(), ql_syscall_reg_reader(
+        UC_X86_REG_RDI, UC_X86_REG_RSI, UC_X86_REG_RDX, UC_X86_REG_R10, UC_X86_REG_R8, UC_X86_REG_R9))
+
+
 def hook_syscall(ql):
     syscall_num  = ql.uc.reg_read(UC_X86_REG_RAX)
-    param0 = ql.uc.reg_read(UC_X86_REG_RDI)
-    param1 = ql.uc.reg_read(UC_X86_REG_RSI)
-    param2 = ql.uc.reg_read(UC_X86_REG_RDX)
-    param3 = ql.uc.reg_read(UC_X86_REG_R10)
-    param4 = ql.uc.reg_read(UC_X86_REG_R8)
-    param5 = ql.uc.reg_read(UC_X86_REG_R9)
-    pc = ql.uc.reg_read(UC_X86_REG_RIP)
-
-    while 1:
-        MACOS_SYSCALL_FUNC = ql.dict_posix_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC != None:
-            MACOS_SYSCALL_FUNC_NAME = MACOS_SYSCALL_FUNC.__name__
-            break
-        MACOS_SYSCALL_FUNC_NAME = dict_x8664_macos_syscall.get(syscall_num, None)
-        if MACOS_SYSCALL_FUNC_NAME != None:
-            MACOS_SYSCALL_FUNC = eval(MACOS_SYSCALL_FUNC_NAME)
-            break
-        MACOS_SYSCALL_FUNC = None
-        MACOS_SYSCALL_FUNC_NAME = None
-        break
+
+    MACOS_SYSCALL_FUNC = ql.syscall_table.get(syscall_num)
 
     if MACOS_SYSCALL_FUNC != None:
         try:
-            MACOS_SYSCALL_FUNC(ql, param0, param1, param2, param3, param4, param5)
+            ql.syscall_table.call(MACOS_SYSCALL_FUNC, syscall_num)
         except KeyboardInterrupt:
             raise            
         except Exception:
-            ql.nprint("[!] SYSCALL ERROR: %s" % MACOS_SYSCALL_FUNC_NAME)
+            ql.nprint("[!] SYSCALL ERROR: %s", MACOS_SYSCALL_FUNC.name)
             #td = ql.thread_management.cur_thread
             #td.stop()
             #td.stop_event = THREAD_EVENT_UNEXECPT_EVENT
-            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC_NAME))
+            raise QlErrorSyscallError("[!] Syscall Implementation Error: %s" % (MACOS_SYSCALL_FUNC.name))
     else:
-        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement" %(pc, syscall_num, syscall_num))
+        pc = ql.uc.reg_read(UC_X86_REG_RIP)
+        ql.nprint("[!] 0x%x: syscall number = 0x%x(%d) not implement", pc, syscall_num, syscall_num)
         if ql.debug_stop:
             #td = ql.thread_management.cur_thread
             #td.stop()
@@ -77,6 +66,7 @@ def hook_syscall(ql):
 def loader_file(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_64)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     ql.macho_task = MachoTask()
     ql.macho_fs = FileSystem(ql)
     ql.macho_mach_port = MachPort(2187)
@@ -89,7 +79,7 @@ def loader_file(ql):
         ql.stack_address = QL_X8664_MACOS_PREDEFINE_STACKADDRESS
     if (ql.stack_size == 0): 
         ql.stack_size = QL_X8664_MACOS_PREDEFINE_STACKSIZE
-    ql.uc.mem_map(ql.stack_address, ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
 
     stack_esp = QL_X8664_MACOS_PREDEFINE_STACKADDRESS + QL_X8664_MACOS_PREDEFINE_STACKSIZE
     envs = env_dict_to_array(ql.env)
@@ -104,11 +94,12 @@ def loader_file(ql):
 def loader_shellcode(ql):
     uc = Uc(UC_ARCH_X86, UC_MODE_64)
     ql.uc = uc
+    ql_setup_syscall_table(ql)
     if (ql.stack_address == 0):
         ql.stack_address = 0x1000000
     if (ql.stack_size == 0): 
         ql.stack_size = 2 * 1024 * 1024
-    ql.uc.mem_map(ql.stack_address,  ql.stack_size)
+    ql.vma.reserve(ql.stack_address, ql.stack_size)
     ql.stack_address = ql.stack_address  + 0x200000 - 0x1000
     ql.uc.mem_write(ql.stack_address, ql.shellcoder)
     
@@ -136,10 +127,10 @@ def runner(ql):
             ql.uc.emu_start(ql.entry_point, ql.until_addr, ql.timeout)
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            ql.nprint("[+] PC = 0x%x\n" % (ql.pc))
+            ql.nprint("[+] PC = 0x%x\n", ql.pc)
             ql.show_map_info()
             buf = ql.uc.mem_read(ql.pc, 8)
-            ql.nprint("[+] %r" % ([hex(_) for _ in buf]))
+            ql.nprint("[+] %r", [hex(_) for _ in buf])
             ql_hook_code_disasm(ql, ql.pc, 64)
         raise QlErrorExecutionStop("[!] Execution Terminated")    
     
@@ -3,6 +3,13 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
+import ctypes
+import os
+import struct
+from bisect import bisect_left, bisect_right
+
+from unicorn import UcError
+
 from qiling.arch.filetype import *
 from qiling.exception import *
 
@@ -11,70 +18,624 @@ def align(size, unit):
     return (size // unit + (1 if size % unit else 0)) * unit
 
 
-# A Simple Heap Implementation
+# size classes, chunk sizes in [2 ** (n - 1), 2 ** n) go to bin n
+QL_HEAP_BINS = 65
+# least the heap grows by, every mem_map makes the next one slower in unicorn
+QL_HEAP_GROW_SIZE = 0x10000
+
+
+# A size class heap: free chunks wait in per size class bins, get split on allocation
+# and merged with free neighbours when freed
 class Chunk():
+    __slots__ = ("address", "size", "inuse")
+
     def __init__(self, address, size):
         self.inuse = True
         self.address = address
         self.size = size
 
-    @staticmethod
-    def compare(chunk):
-        return chunk.size
-
 
 class Heap:
-    def __init__(self, ql, start_address, end_address):
+    def __init__(self, ql, start_address, end_address, mapped=False, growable=True):
         self.ql = ql
-        self.chunks = []
         self.start_address = start_address
         self.end_address = end_address
+        # false for a HeapCreate heap with a maximum size, allocations past it fail
+        self.growable = growable
         # unicorn needs 0x1000
         self.page_size = 0x1000
-        # current alloced memory size
-        self.current_alloc = 0
-        # curent use memory size
+        # HeapAlloc alignment, 8 bytes on 32 bit and 16 on 64 bit windows
+        self.alignment = max(8, 2 * ql.pointersize)
+        # current alloced memory size, all of it when carved out of mapped memory
+        self.current_alloc = end_address - start_address if mapped else 0
+        # curent use memory size, chunks come from the top past it
         self.current_use = 0
+        # address -> chunk, in use or free
+        self.chunks = {}
+        # free chunks by size class, bit n of bin_map set when bin n is not empty
+        self.bins = [dict() for _ in range(QL_HEAP_BINS)]
+        self.bin_map = 0
+        # end address -> free chunk, to merge with the chunk right after
+        self.free_ends = {}
+
+    def __push(self, chunk):
+        chunk.inuse = False
+        n = chunk.size.bit_length()
+        self.bins[n][chunk.address] = chunk
+        self.bin_map |= 1 << n
+        self.free_ends[chunk.address + chunk.size] = chunk
+
+    def __pop(self, chunk):
+        n = chunk.size.bit_length()
+        free = self.bins[n]
+        del free[chunk.address]
+        if not free:
+            self.bin_map &= ~(1 << n)
+        del self.free_ends[chunk.address + chunk.size]
+
+    def __find_free(self, size):
+        n = size.bit_length()
+        for chunk in self.bins[n].values():
+            if chunk.size >= size:
+                return chunk
+
+        # any chunk of the next non empty class is large enough
+        larger = self.bin_map >> (n + 1)
+        if larger:
+            n += (larger & -larger).bit_length()
+            return next(iter(self.bins[n].values()))
+        return None
 
     def mem_alloc(self, size):
-        if self.ql.arch == QL_X86:
-            size = align(size, 4)
-        elif self.ql.arch == QL_X8664:
-            size = align(size, 8)
-        else:
-            raise QlErrorArch("[!] Unknown ql.arch")
+        size = align(max(size, 1), self.alignment)
+
+        chunk = self.__find_free(size)
+        if chunk is not None:
+            self.__pop(chunk)
+            rest = chunk.size - size
+            if rest >= self.alignment:
+                chunk.size = size
+                remainder = Chunk(chunk.address + size, rest)
+                self.chunks[remainder.address] = remainder
+                self.__push(remainder)
+            chunk.inuse = True
+            return chunk.address
 
-        # Find the heap chunks that best matches size 
-        self.chunks.sort(key=Chunk.compare)
-        for chunk in self.chunks:
-            if chunk.inuse is False and chunk.size > size:
-                chunk.inuse = True
-                return chunk.address
+        # If the heap is not enough
+        if self.start_address + self.current_use + size > self.end_address:
+            return 0
 
-        chunk = None
         # If we need mem_map new memory
         if self.current_use + size > self.current_alloc:
-            real_size = align(size, self.page_size)
-            # If the heap is not enough
-            if self.start_address + self.current_use + real_size > self.end_address:
-                return 0
+            real_size = align(max(self.current_use + size - self.current_alloc, QL_HEAP_GROW_SIZE), self.page_size)
+            real_size = min(real_size, self.end_address - self.start_address - self.current_alloc)
             self.ql.uc.mem_map(self.start_address + self.current_alloc, real_size)
-            chunk = Chunk(self.start_address + self.current_use, size)
             self.current_alloc += real_size
-            self.current_use += size
-            self.chunks.append(chunk)
-        else:
-            chunk = Chunk(self.start_address + self.current_use, size)
-            self.current_use += size
-            self.chunks.append(chunk)
 
-        chunk.inuse = True
-        # print("heap.mem_alloc addresss: " + hex(chunk.address))
+        chunk = Chunk(self.start_address + self.current_use, size)
+        self.current_use += size
+        self.chunks[chunk.address] = chunk
         return chunk.address
 
     def mem_free(self, addr):
-        for chunk in self.chunks:
-            if addr == chunk.address and chunk.inuse:
-                chunk.inuse = False
-                return True
-        return False
+        chunk = self.chunks.get(addr, None)
+        if chunk is None or not chunk.inuse:
+            return False
+
+        after = self.chunks.get(addr + chunk.size, None)
+        if after is not None and not after.inuse:
+            self.__pop(after)
+            del self.chunks[after.address]
+            chunk.size += after.size
+
+        before = self.free_ends.get(addr, None)
+        if before is not None:
+            self.__pop(before)
+            del self.chunks[addr]
+            before.size += chunk.size
+            chunk = before
+
+        if chunk.address + chunk.size == self.start_address + self.current_use:
+            # the top of the heap, give it back
+            del self.chunks[chunk.address]
+            self.current_use -= chunk.size
+        else:
+            self.__push(chunk)
+        return True
+
+    def mem_size(self, addr):
+        chunk = self.chunks.get(addr, None)
+        if chunk is None or not chunk.inuse:
+            return 0
+        return chunk.size
+
+    def mem_realloc(self, addr, size):
+        data = self.ql.uc.mem_read(addr, min(self.mem_size(addr), size))
+        self.mem_free(addr)
+        ret = self.mem_alloc(size)
+        if ret != 0:
+            self.ql.uc.mem_write(ret, bytes(data))
+        return ret
+
+    def save(self):
+        return [(c.address, c.size, c.inuse) for c in self.chunks.values()], self.current_alloc, self.current_use
+
+    def load(self, state):
+        chunks, self.current_alloc, self.current_use = state
+        self.chunks = {}
+        self.bins = [dict() for _ in range(QL_HEAP_BINS)]
+        self.bin_map = 0
+        self.free_ends = {}
+        for address, size, inuse in chunks:
+            chunk = Chunk(address, size)
+            self.chunks[address] = chunk
+            if not inuse:
+                self.__push(chunk)
+
+
+class Intervals:
+    """
+    sorted, disjoint [start, end) intervals with a value each, neighbours with equal
+    values are merged
+    """
+    def __init__(self):
+        self.starts = []
+        self.ends = []
+        self.values = []
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends, self.values)
+
+    def copy(self):
+        ret = Intervals()
+        ret.starts = list(self.starts)
+        ret.ends = list(self.ends)
+        ret.values = list(self.values)
+        return ret
+
+    def find(self, address):
+        # index of the interval holding address, -1 if none
+        idx = bisect_right(self.starts, address) - 1
+        if idx >= 0 and address < self.ends[idx]:
+            return idx
+        return -1
+
+    def span(self, start, end):
+        # indexes [lo, hi) of the intervals overlapping [start, end)
+        return bisect_right(self.ends, start), bisect_left(self.starts, end)
+
+    def remove(self, start, end):
+        """
+        cuts [start, end) out, returns the (start, end, value) pieces taken
+        """
+        lo, hi = self.span(start, end)
+        if lo >= hi:
+            return []
+
+        removed = [(max(s, start), min(e, end), v) for s, e, v in zip(self.starts[lo : hi], self.ends[lo : hi], self.values[lo : hi])]
+
+        starts, ends, values = [], [], []
+        if self.starts[lo] < start:
+            starts.append(self.starts[lo])
+            ends.append(start)
+            values.append(self.values[lo])
+        if self.ends[hi - 1] > end:
+            starts.append(end)
+            ends.append(self.ends[hi - 1])
+            values.append(self.values[hi - 1])
+
+        self.starts[lo : hi] = starts
+        self.ends[lo : hi] = ends
+        self.values[lo : hi] = values
+        return removed
+
+    def add(self, start, end, value):
+        self.remove(start, end)
+        lo = hi = bisect_left(self.starts, start)
+
+        if lo > 0 and self.ends[lo - 1] == start and self.values[lo - 1] == value:
+            lo -= 1
+            start = self.starts[lo]
+        if hi < len(self.starts) and self.starts[hi] == end and self.values[hi] == value:
+            end = self.ends[hi]
+            hi += 1
+
+        self.starts[lo : hi] = [start]
+        self.ends[lo : hi] = [end]
+        self.values[lo : hi] = [value]
+
+
+def _gaps(start, end, pieces):
+    # parts of [start, end) not covered by the sorted (start, end, ...) pieces
+    for s, e, *_ in pieces:
+        if s > start:
+            yield start, s
+        start = max(start, e)
+    if start < end:
+        yield start, end
+
+
+# mappings from this size up are only reserved with demand paging, and pages are
+# mapped this many at a time when touched
+QL_DEMAND_PAGING_MIN = 0x10000
+QL_DEMAND_PAGING_CHUNK = 0x10000
+
+
+class FileSource:
+    """
+    file data of a mapping reserved with demand paging, read from the file when its
+    pages are committed, which is how the kernel fills MAP_PRIVATE pages too. holds
+    a dup of the guest fd so the guest may close it, and whatever is past the end of
+    the file by then reads as zeros
+    """
+    def __init__(self, fd, offset, length):
+        self.fd = os.dup(fd)
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def read(self, offset, size):
+        size = min(size, self.length - offset)
+        if size <= 0:
+            return b''
+        return os.pread(self.fd, size, self.offset + offset)
+
+    def __del__(self):
+        os.close(self.fd)
+
+
+def _map_data(data, offset, size):
+    # [offset, offset + size) of what a mapping was given, a buffer or a FileSource
+    if isinstance(data, FileSource):
+        return data.read(offset, size)
+    return data[offset : offset + size]
+
+
+class VMAManager:
+    """
+    posix address space: mapped ranges with permissions and names (what map_info used
+    to be), ranges given back by munmap for mmap to reuse, and the brk heap
+
+    mmap(0, ...) takes the first (or with best_fit the smallest) munmapped range that
+    is large enough, and only moves ql.mmap_start up when none is
+
+    with demand_paging, large mmaps and the stack are only reserved: unicorn maps
+    nothing until the guest touches a page (hook_mem_unmapped) or a syscall reads or
+    writes it. pages of a file mapping given as a FileSource are then read from the
+    file, other file data is copied in at mmap time
+    """
+    def __init__(self, ql, best_fit=False, demand_paging=False):
+        self.ql = ql
+        self.best_fit = best_fit
+        self.demand_paging = demand_paging
+        # value is (perms, info)
+        self.vmas = Intervals()
+        # unmapped by munmap, value is None
+        self.holes = Intervals()
+        # not mapped in unicorn yet, value is None for zero pages or (address, source)
+        # for a FileSource whose first byte goes at address
+        self.reserved = Intervals()
+        self.demand_uc = None
+        self.brk_start = None
+
+    def save(self):
+        return self.vmas.copy(), self.holes.copy(), self.brk_start, self.reserved.copy()
+
+    def load(self, state):
+        vmas, holes, self.brk_start, reserved = state
+        self.vmas = vmas.copy()
+        self.holes = holes.copy()
+        self.reserved = reserved.copy()
+
+    @property
+    def map_info(self):
+        return [[s, e, p, info] for s, e, (p, info) in self.vmas]
+
+    @map_info.setter
+    def map_info(self, map_info):
+        self.vmas = Intervals()
+        self.holes = Intervals()
+        self.brk_start = None
+        for s, e, p, info in map_info:
+            self.vmas.add(s, e, (p, info))
+
+    def find(self, address):
+        idx = self.vmas.find(address)
+        if idx < 0:
+            return None
+        p, info = self.vmas.values[idx]
+        return [self.vmas.starts[idx], self.vmas.ends[idx], p, info]
+
+    def insert(self, start, end, perms, info):
+        self.vmas.add(start, end, (perms, info))
+        self.holes.remove(start, end)
+
+    def protect(self, start, end, perms):
+        for s, e, (p, info) in self.vmas.remove(start, end):
+            self.vmas.add(s, e, (perms, info))
+
+    def unmap(self, start, end):
+        reserved = self.reserved.remove(start, end)
+        if not reserved:
+            self.ql.uc.mem_unmap(start, end - start)
+        else:
+            for s, e in _gaps(start, end, reserved):
+                self.ql.uc.mem_unmap(s, e - s)
+        self.vmas.remove(start, end)
+        self.holes.add(start, end, None)
+
+    def __alloc(self, size):
+        base = None
+        for s, e, _ in self.holes:
+            if s == 0 or e - s < size:
+                continue
+            if base is None or e - s < base_size:
+                base, base_size = s, e - s
+            if not self.best_fit:
+                break
+
+        if base is not None:
+            self.holes.remove(base, base + size)
+            return base
+
+        # fresh space, stepping over anything mapped at a fixed address up there
+        base = self.ql.mmap_start
+        while True:
+            lo, hi = self.vmas.span(base, base + size)
+            if lo >= hi:
+                break
+            base = self.vmas.ends[hi - 1]
+        self.ql.mmap_start = base + size
+        return base
+
+    def mmap(self, addr, size, data=None):
+        """
+        maps size bytes (page aligned) at addr, or anywhere when addr is 0, returns the base
+
+        data (e.g. a view of a file image, or a FileSource read as the pages are
+        touched) goes at the base, the rest reads as zero
+        """
+        if data is not None and not isinstance(data, FileSource):
+            data = memoryview(data)
+
+        if addr == 0:
+            base = self.__alloc(size)
+            self.__map(base, base + size, base, data)
+            return base
+
+        end = addr + size
+        reused = self.holes.remove(addr, end)
+        if addr >= self.ql.mmap_start:
+            self.__map(addr, end, addr, data)
+            return addr
+
+        # below mmap_start only what munmap gave back is unmapped, the rest is
+        # mapped over
+        for s, e, _ in reused:
+            self.__map(s, e, addr, data)
+        for s, e in _gaps(addr, end, reused):
+            self.__overwrite(s, e, addr, data)
+        return addr
+
+    def reserve(self, address, size):
+        """
+        maps size bytes of zeros at address, lazily with demand paging
+        """
+        self.__map(address, address + size, address, None)
+
+    def __map(self, start, end, base, data):
+        # zero pages and FileSource pages are paged in on demand, buffers are copied
+        # in now
+        lazy = data is None or isinstance(data, FileSource)
+        if self.demand_paging and lazy and end - start >= QL_DEMAND_PAGING_MIN:
+            self.__track()
+            self.reserved.add(start, end, None if data is None else (base, data))
+            return
+
+        self.ql.uc.mem_map(start, end - start)
+        if data is not None:
+            self.__fill(start, end, base, data)
+
+    def __fill(self, start, end, base, data):
+        chunk = _map_data(data, start - base, end - start)
+        if len(chunk):
+            self.ql.mem.write(start, chunk)
+
+    def __overwrite(self, start, end, base, data):
+        reserved = self.reserved.remove(start, end)
+        for s, e, _ in reserved:
+            if data is None:
+                self.reserved.add(s, e, None)
+            elif isinstance(data, FileSource):
+                self.reserved.add(s, e, (base, data))
+            else:
+                self.ql.uc.mem_map(s, e - s)
+                self.__fill(s, e, base, data)
+
+        for s, e in _gaps(start, end, reserved):
+            self.ql.uc.mem_write(s, b'\x00' * (e - s))
+            if data is not None:
+                self.__fill(s, e, base, data)
+
+    def commit(self, address, size):
+        """
+        maps the reserved pages in and around [address, address + size), returns
+        False when there are none
+        """
+        lo, hi = self.reserved.span(address, address + size)
+        if lo >= hi:
+            return False
+
+        start = address & ~(QL_DEMAND_PAGING_CHUNK - 1)
+        end = align(address + size, QL_DEMAND_PAGING_CHUNK)
+        for s, e, source in self.reserved.remove(start, end):
+            self.ql.uc.mem_map(s, e - s)
+            if source is not None:
+                base, data = source
+                self.__fill(s, e, base, data)
+        return True
+
+    def __hook_mem_unmapped(self, ql, address, size, value):
+        return self.commit(address, size)
+
+    def __track(self):
+        # syscalls read and write guest memory through the Uc object, not the guest, so
+        # reserved pages they touch are committed when unicorn reports them unmapped
+        uc = self.ql.uc
+        if self.demand_uc is uc:
+            return
+        self.demand_uc = uc
+
+        mem_read, mem_write = uc.mem_read, uc.mem_write
+
+        def _mem_read(address, size):
+            try:
+                return mem_read(address, size)
+            except UcError:
+                if not self.commit(address, size):
+                    raise
+            return mem_read(address, size)
+
+        def _mem_write(address, data):
+            try:
+                return mem_write(address, data)
+            except UcError:
+                if not self.commit(address, len(data)):
+                    raise
+            return mem_write(address, data)
+
+        uc.mem_read = _mem_read
+        uc.mem_write = _mem_write
+        self.ql.hook_mem_unmapped(self.__hook_mem_unmapped)
+
+    def brk(self, address):
+        """
+        moves the program break, returns False when address is out of the heap
+        """
+        ql = self.ql
+        if self.brk_start is None:
+            self.brk_start = ql.brk_address
+
+        if address < self.brk_start:
+            return False
+
+        new_brk = align(address, 0x1000)
+        old_brk = ql.brk_address
+        if new_brk > old_brk:
+            # like the kernel, the break does not grow into another mapping
+            for intervals in (self.vmas, self.reserved):
+                lo, hi = intervals.span(old_brk, new_brk)
+                if lo < hi:
+                    return False
+            self.__map(old_brk, new_brk, old_brk, None)
+            self.insert(old_brk, new_brk, "rw-", "[heap]")
+        elif new_brk < old_brk:
+            self.unmap(new_brk, old_brk)
+
+        ql.brk_address = new_brk
+        return True
+
+
+QL_PAGE_SIZE = 0x1000
+
+
+class Memory:
+    """
+    bulk guest memory readers, ql.mem
+
+    strings and pointer arrays are read up to the next page boundary at a time (a page
+    is either mapped or not) and searched with bytes.find, instead of one uc.mem_read
+    per character
+    """
+    def __init__(self, ql):
+        self.ql = ql
+
+    def read(self, address, size):
+        return self.ql.uc.mem_read(address, size)
+
+    def write(self, address, data):
+        if isinstance(data, memoryview):
+            # unicorn wants a char pointer, a writable view (e.g. a copy-on-write file
+            # mapping) can be handed over without a copy
+            data = data.tobytes() if data.readonly else (ctypes.c_char * data.nbytes).from_buffer(data)
+        return self.ql.uc.mem_write(address, data)
+
+    def read_until(self, address, terminator, limit=None):
+        """
+        bytes up to (not including) terminator, which must be aligned to its own size
+        from address, or up to limit bytes
+        """
+        uc = self.ql.uc
+        unit = len(terminator)
+        buf = bytearray()
+        start = 0
+
+        while True:
+            end = address + len(buf)
+            buf += uc.mem_read(end, QL_PAGE_SIZE - (end & (QL_PAGE_SIZE - 1)))
+
+            idx = buf.find(terminator, start)
+            while idx >= 0 and idx % unit:
+                idx = buf.find(terminator, idx + 1)
+            if idx >= 0 and (limit is None or idx <= limit):
+                return bytes(buf[ : idx])
+
+            if limit is not None and len(buf) >= limit:
+                return bytes(buf[ : limit])
+            # a terminator may straddle the page boundary
+            start = len(buf) - unit + 1
+
+    def read_available(self, address, size):
+        """
+        up to size bytes, stopping at the first page that is not mapped
+        """
+        uc = self.ql.uc
+        try:
+            return bytes(uc.mem_read(address, size))
+        except UcError:
+            pass
+
+        buf = bytearray()
+        while len(buf) < size:
+            end = address + len(buf)
+            step = min(QL_PAGE_SIZE - (end & (QL_PAGE_SIZE - 1)), size - len(buf))
+            try:
+                buf += uc.mem_read(end, step)
+            except UcError:
+                break
+        return bytes(buf)
+
+    def read_cstr(self, address, encoding="utf-8", errors="backslashreplace", limit=None):
+        return self.read_until(address, b"\x00", limit).decode(encoding, errors)
+
+    def read_wstr(self, address, errors="backslashreplace", limit=None):
+        if limit is not None:
+            limit *= 2
+        return self.read_until(address, b"\x00\x00", limit).decode("utf-16le", errors)
+
+    def __ptr_format(self, count):
+        return "%s%d%s" % (">" if self.ql.archendian == QL_ENDIAN_EB else "<", count, "Q" if self.ql.pointersize == 8 else "I")
+
+    def read_ptr_array(self, address, count=None):
+        """
+        count pointers, or the pointers before the first NULL (argv, envp) when count is None
+        """
+        size = self.ql.pointersize
+        if count is None:
+            data = self.read_until(address, b"\x00" * size)
+        else:
+            data = self.ql.uc.mem_read(address, count * size)
+        return list(struct.unpack(self.__ptr_format(len(data) // size), data))
+
+    def read_struct(self, address, fmt):
+        """
+        fmt is a struct format or a struct.Struct, returns the unpacked tuple
+        """
+        if not isinstance(fmt, struct.Struct):
+            fmt = struct.Struct(fmt)
+        return fmt.unpack(self.ql.uc.mem_read(address, fmt.size))
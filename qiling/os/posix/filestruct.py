@@ -13,6 +13,7 @@ class ql_file:
     def __init__(self, path, fd):
         self.__path = path
         self.__fd = fd
+        self.closed = False
 
     @classmethod
     def open(self, open_path, open_flags, open_mode):
@@ -33,6 +34,7 @@ class ql_file:
         return os.lseek(self.__fd, lseek_offset, lseek_origin)
     
     def close(self):
+        self.closed = True
         return os.close(self.__fd)
     
     def fstat(self):
@@ -67,6 +69,7 @@ class ql_socket:
     def __init__(self, socket):
         self.__fd = socket.fileno()
         self.__socket = socket
+        self.closed = False
     
     @classmethod
     def open(self, socket_domain, socket_type, socket_protocol, opts=None):
@@ -85,6 +88,7 @@ class ql_socket:
         return self.__fd
     
     def close(self):
+        self.closed = True
         return os.close(self.__fd)
     
     def ioctl(self, ioctl_cmd, ioctl_arg):
@@ -137,6 +141,7 @@ class ql_socket:
 class ql_pipe:
     def __init__(self, fd):
         self.__fd = fd
+        self.closed = False
 
     @classmethod
     def open(self):
@@ -153,6 +158,7 @@ class ql_pipe:
         return self.__fd
 
     def close(self):
+        self.closed = True
         return os.close(self.__fd)
     
     def ioctl(self, ioctl_cmd, ioctl_arg):
@@ -165,3 +171,55 @@ class ql_pipe:
         new_fd = os.dup(self.__fd)
         new_ql_pipe = ql_pipe(new_fd)
         return new_ql_pipe
+
+
+class ql_buffer:
+    """
+    in-memory file, e.g. a fuzzing input served as stdin
+    """
+    def __init__(self, data=b'', name='buffer'):
+        self.__name = name
+        self.set(data)
+        self.closed = False
+
+    def set(self, data):
+        self.__data = bytes(data)
+        self.__pos = 0
+        self.written = bytearray()
+
+    def read(self, read_len):
+        data = self.__data[self.__pos : self.__pos + read_len]
+        self.__pos += len(data)
+        return data
+
+    def write(self, write_buf):
+        self.written += write_buf
+        return len(write_buf)
+
+    def fileno(self):
+        return -1
+
+    def lseek(self, lseek_offset, lseek_origin = os.SEEK_SET):
+        if lseek_origin == os.SEEK_CUR:
+            lseek_offset += self.__pos
+        elif lseek_origin == os.SEEK_END:
+            lseek_offset += len(self.__data)
+        self.__pos = max(0, lseek_offset)
+        return self.__pos
+
+    def close(self):
+        return 0
+
+    def fstat(self):
+        # a regular file of the buffer size
+        return os.stat_result((0o100644, 0, 0, 1, 0, 0, len(self.__data), 0, 0, 0), {'st_blksize': 0x1000, 'st_blocks': 0, 'st_rdev': 0})
+
+    def ioctl(self, ioctl_cmd, ioctl_arg):
+        pass
+
+    def dup(self):
+        return self
+
+    @property
+    def name(self):
+        return self.__name
@@ -12,6 +12,7 @@ import socket
 import time
 import io
 import select
+import selectors
 import pathlib
 import logging
 
@@ -32,11 +33,72 @@ from qiling.arch.filetype import *
 from qiling.os.posix.filestruct import *
 from qiling.os.posix.constant_mapping import *
 from qiling.utils import *
+from qiling.loader.imagecache import ql_image_cache
+from qiling.os.memory import FileSource, QL_DEMAND_PAGING_MIN
+
+def ql_io_ready(fd, events):
+    r = [fd] if events & selectors.EVENT_READ else []
+    w = [fd] if events & selectors.EVENT_WRITE else []
+    try:
+        ans = select.select(r, w, [], 0)
+    except (OSError, ValueError):
+        # let the syscall run into the error
+        return True
+    return len(ans[0]) + len(ans[1]) != 0
+
+
+def ql_host_fd(f):
+    """
+    the host fd behind a guest file object, -1 for anything but a host file, socket
+    or pipe: a user supplied stdin may hand out an fd (e.g. 0) it does not read from
+    """
+    if not isinstance(f, (ql_file, ql_socket, ql_pipe)) or getattr(f, "closed", False):
+        return -1
+    try:
+        return f.fileno()
+    except (AttributeError, OSError, ValueError):
+        # io.UnsupportedOperation is an OSError
+        return -1
+
+
+def ql_io_parkable(ql):
+    # parking only pays off when another thread can run meanwhile
+    tm = ql.thread_management
+    return tm != None and (len(tm.run_queue) != 0 or len(tm.blocking_threads) != 0)
+
+
+def ql_io_wait(ql, fd, events, complete):
+    """
+    run complete(), the blocking part of a syscall, now when the guest fd is ready,
+    is not a host fd or there are no other threads. otherwise park the current
+    thread in the reactor and complete the syscall once fd is ready, the others
+    keep running meanwhile. returns the syscall return value, 0 while parked
+    """
+    if ql_io_parkable(ql) and 0 <= fd < 256 and ql.file_des[fd] != 0:
+        tm = ql.thread_management
+        host_fd = ql_host_fd(ql.file_des[fd])
+        if host_fd >= 0 and not ql_io_ready(host_fd, events):
+            ql.uc.emu_stop()
+            tm.wait_fd(tm.cur_thread, host_fd, events, lambda th, ev: th.set_syscall_return(complete()))
+            return 0
+    return complete()
+
+
+def ql_io_drop(ql, fd):
+    # threads parked on a guest fd that goes away (close, shutdown) get -EBADF
+    EBADF = 9
+    tm = ql.thread_management
+    if tm == None:
+        return
+    host_fd = ql_host_fd(ql.file_des[fd])
+    if host_fd >= 0:
+        tm.drop_fd(host_fd, -EBADF)
+
 
 def ql_syscall_exit(ql, null0, null1, null2, null3, null4, null5):
     ql.exit_code = null0
     
-    ql.nprint("exit(%u) = %u" % (null0, null0))
+    ql.nprint("exit(%u) = %u", null0, null0)
     
     if ql.child_processes == True:
         os._exit(0)
@@ -46,47 +108,16 @@ def ql_syscall_exit(ql, null0, null1, null2, null3, null4, null5):
 
 def ql_syscall_munmap(ql, munmap_addr , munmap_len, null0, null1, null2, null3):
     munmap_len = ((munmap_len + 0x1000 - 1) // 0x1000) * 0x1000
-    ql.uc.mem_unmap(munmap_addr, munmap_len)
+    ql.vma.unmap(munmap_addr, munmap_addr + munmap_len)
     regreturn = 0
 
-    map_info = ql.map_info
-    unmap_range = []
-    munmap_end = munmap_addr+munmap_len
-
-    for idx, val in enumerate(map_info):
-        mem_start, mem_end, prot, info = val
-        if mem_start <= munmap_addr <= mem_end or mem_start <= munmap_end <= mem_end:
-            unmap_range.append(val)
-            map_info[idx] = []
-
-    for start, end, prot, info in unmap_range:
-        if start < munmap_addr < end:
-            new_start = start
-            new_prot = prot
-            new_info = info
-            break
-    else:
-        new_start = 0
-
-    for start, end, _, _ in unmap_range:
-        if start < munmap_end <= end:
-            new_end = munmap_addr
-            break
-    else:
-        new_end = 0
-
-    ql.map_info = [each for each in map_info if each != []]
-
-    if new_start and new_end: # need to insert extra mapping area
-        ql.insert_map_info(new_start, new_end, new_prot, new_info)
-
-    ql.nprint("munmap(0x%x, 0x%x) = %d" % (munmap_addr , munmap_len, regreturn))
+    ql.nprint("munmap(0x%x, 0x%x) = %d", munmap_addr, munmap_len, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 def ql_syscall_exit_group(ql, exit_code, null1, null2, null3, null4, null5):
     ql.exit_code = exit_code
 
-    ql.nprint("exit_group(%u)" % ql.exit_code)
+    ql.nprint("exit_group(%u)", ql.exit_code)
 
     if ql.child_processes == True:
         os._exit(0)
@@ -96,7 +127,7 @@ def ql_syscall_exit_group(ql, exit_code, null1, null2, null3, null4, null5):
 
 def ql_syscall_madvise(ql, null0, null1, null2, null3, null4, null5):
     regreturn = 0
-    ql.nprint("madvise() = %d" %  regreturn)
+    ql.nprint("madvise() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)    
 
 
@@ -121,20 +152,20 @@ def ql_syscall_sysinfo(ql, sysinfo_info, null0, null1, null2, null3, null4):
     )
     
     regreturn = 0
-    ql.nprint("sysinfo(0x%x) = %d" % (sysinfo_info, regreturn))
+    ql.nprint("sysinfo(0x%x) = %d", sysinfo_info, regreturn)
     #uc.mem_write(sysinfo_info, data)   
     ql_definesyscall_return(ql, regreturn)    
 
 
 def ql_syscall_alarm(ql, alarm_seconds, null0, null1, null2, null3, null4):
     regreturn = 0
-    ql.nprint("alarm(%d) = %d" % (alarm_seconds, regreturn))
+    ql.nprint("alarm(%d) = %d", alarm_seconds, regreturn)
     ql_definesyscall_return(ql, regreturn)    
 
 def ql_syscall_chmod(ql, filename, mode, null1, null2, null3, null4):
     regreturn = 0
     filename = ql_read_string(ql, filename)
-    ql.nprint("chmod(%s,%d) = %d" % (filename, mode, regreturn))
+    ql.nprint("chmod(%s,%d) = %d", filename, mode, regreturn)
     ql_definesyscall_return(ql, regreturn) 
 
 def ql_syscall_issetugid(ql, null0, null1, null2, null3, null4, null5):
@@ -142,7 +173,7 @@ def ql_syscall_issetugid(ql, null0, null1, null2, null3, null4, null5):
         UGID = 0
     else:    
         UGID = 1000    
-    ql.nprint("issetugid(%i)" % UGID)
+    ql.nprint("issetugid(%i)", UGID)
     regreturn = UGID
     ql_definesyscall_return(ql, regreturn)
 
@@ -152,7 +183,7 @@ def ql_syscall_getuid(ql, null0, null1, null2, null3, null4, null5):
         UID = 0
     else:    
         UID = 1000
-    ql.nprint("getuid(%i)" % UID)
+    ql.nprint("getuid(%i)", UID)
     regreturn = UID
     ql_definesyscall_return(ql, regreturn)    
 
@@ -161,7 +192,7 @@ def ql_syscall_getuid32(ql, null0, null1, null2, null3, null4, null5):
         UID = 0
     else:    
         UID = 1000
-    ql.nprint("getuid32(%i)" % UID)
+    ql.nprint("getuid32(%i)", UID)
     regreturn = UID
     ql_definesyscall_return(ql, regreturn)  
 
@@ -170,7 +201,7 @@ def ql_syscall_getgid32(ql, null0, null1, null2, null3, null4, null5):
         GID = 0
     else:    
         GID = 1000
-    ql.nprint("getgid32(%i)" % GID)
+    ql.nprint("getgid32(%i)", GID)
     regreturn = GID
     ql_definesyscall_return(ql, regreturn)  
 
@@ -180,7 +211,7 @@ def ql_syscall_geteuid(ql, null0, null1, null2, null3, null4, null5):
         EUID = 0
     else:    
         EUID = 1000
-    ql.nprint("geteuid(%i)" % EUID)
+    ql.nprint("geteuid(%i)", EUID)
     regreturn = EUID
     ql_definesyscall_return(ql, regreturn) 
 
@@ -190,7 +221,7 @@ def ql_syscall_getegid(ql, null0, null1, null2, null3, null4, null5):
         EGID = 0
     else:    
         EGID = 1000
-    ql.nprint("getegid(%i)" % EGID)
+    ql.nprint("getegid(%i)", EGID)
     regreturn = EGID
     ql_definesyscall_return(ql, regreturn) 
 
@@ -200,7 +231,7 @@ def ql_syscall_getgid(ql, null0, null1, null2, null3, null4, null5):
         GID = 0
     else:    
         GID = 1000
-    ql.nprint("getgid(%i)" % GID)
+    ql.nprint("getgid(%i)", GID)
     regreturn = GID
     ql_definesyscall_return(ql, regreturn)    
 
@@ -212,7 +243,7 @@ def ql_syscall_setgroups(ql, gidsetsize, grouplist, null0, null1, null2, null3):
         GID = 1000
 
     regreturn = GID
-    ql.nprint("setgroups(0x%x, 0x%x) = %d" % (gidsetsize, grouplist, regreturn))
+    ql.nprint("setgroups(0x%x, 0x%x) = %d", gidsetsize, grouplist, regreturn)
     ql_definesyscall_return(ql, regreturn)    
 
 
@@ -221,7 +252,7 @@ def ql_syscall_setgid(ql, null0, null1, null2, null3, null4, null5):
         GID = 0
     else:    
         GID = 1000
-    ql.nprint("setgid(%i)" % GID)
+    ql.nprint("setgid(%i)", GID)
     regreturn = GID
     ql_definesyscall_return(ql, regreturn)           
 
@@ -231,7 +262,7 @@ def ql_syscall_setuid(ql, null0, null1, null2, null3, null4, null5):
         UID = 0
     else:    
         UID = 1000
-    ql.nprint("setuid(%i)" % UID)
+    ql.nprint("setuid(%i)", UID)
     regreturn = UID
     ql_definesyscall_return(ql, regreturn)     
 
@@ -251,12 +282,12 @@ def ql_syscall_faccessat(ql, faccessat_dfd, faccessat_filename, faccessat_mode,
         regreturn = -1
 
     ql_definesyscall_return(ql, regreturn)
-    ql.nprint("facccessat (%d, 0x%x, 0x%x) = %d" %(faccessat_dfd, faccessat_filename, faccessat_mode, regreturn))
+    ql.nprint("facccessat (%d, 0x%x, 0x%x) = %d", faccessat_dfd, faccessat_filename, faccessat_mode, regreturn)
     
     if regreturn == -1:
-        ql.dprint("[!] File Not Found or Skipped: %s" % access_path)
+        ql.dprint("[!] File Not Found or Skipped: %s", access_path)
     else:
-        ql.dprint("[+] File Found: %s" % access_path)
+        ql.dprint("[+] File Found: %s", access_path)
 
 
 def ql_syscall_open(ql, filename, flags, mode, null0, null1, null2):
@@ -287,12 +318,12 @@ def ql_syscall_open(ql, filename, flags, mode, null0, null1, null2):
         except:
             regreturn = -1
 
-    ql.nprint("open(%s, 0x%x, 0o%o) = %d" % (relative_path, flags, mode, regreturn))
-    ql.dprint("[+] open(%s, %s, 0o%o) = %d" % (relative_path, open_flags_mapping(flags, ql.arch), mode, regreturn))
+    ql.nprint("open(%s, 0x%x, 0o%o) = %d", relative_path, flags, mode, regreturn)
+    ql.dprint("[+] open(%s, %s, 0o%o) = %d", relative_path, QlLazyStr(open_flags_mapping, flags, ql.arch), mode, regreturn)
     if regreturn >= 0 and regreturn != 2:
-        ql.dprint("[+] File Found: %s" % relative_path)
+        ql.dprint("[+] File Found: %s", relative_path)
     else:
-        ql.dprint("[!] File Not Found %s" % relative_path)
+        ql.dprint("[!] File Not Found %s", relative_path)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -326,24 +357,24 @@ def ql_syscall_openat(ql, openat_fd, openat_path, openat_flags, openat_mode, nul
         except:
             regreturn = -1
 
-    ql.nprint("openat(%d, %s, 0x%x, 0o%o) = %d" % (openat_fd, relative_path, openat_flags, openat_mode, regreturn))
-    ql.dprint("[+] openat(%d, %s, %s, 0o%o) = %d" % (openat_fd, relative_path, open_flags_mapping(openat_flags, ql.arch), openat_mode, regreturn))
+    ql.nprint("openat(%d, %s, 0x%x, 0o%o) = %d", openat_fd, relative_path, openat_flags, openat_mode, regreturn)
+    ql.dprint("[+] openat(%d, %s, %s, 0o%o) = %d", openat_fd, relative_path, QlLazyStr(open_flags_mapping, openat_flags, ql.arch), openat_mode, regreturn)
     if regreturn >= 0 and regreturn != 2:
-        ql.dprint("[+] File Found: %s" % relative_path)
+        ql.dprint("[+] File Found: %s", relative_path)
     else:
-        ql.dprint("[!] File Not Found %s" % relative_path)
+        ql.dprint("[!] File Not Found %s", relative_path)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_lseek(ql, lseek_fd, lseek_ofset, lseek_origin, null0, null1, null2):
     lseek_ofset = ql.unpacks(ql.pack(lseek_ofset))
     regreturn = 0
-    ql.dprint("lseek(%d, 0x%x, 0x%x) = %d" % (lseek_fd, lseek_ofset, lseek_origin, regreturn))
+    ql.dprint("lseek(%d, 0x%x, 0x%x) = %d", lseek_fd, lseek_ofset, lseek_origin, regreturn)
     try:
         regreturn = ql.file_des[lseek_fd].lseek(lseek_ofset, lseek_origin)
     except OSError:
         regreturn = -1
-    ql.nprint("lseek(%d, 0x%x, 0x%x) = %d" % (lseek_fd, lseek_ofset, lseek_origin, regreturn))
+    ql.nprint("lseek(%d, 0x%x, 0x%x) = %d", lseek_fd, lseek_ofset, lseek_origin, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -351,7 +382,7 @@ def ql_syscall__llseek(ql, fd, offset_high, offset_low, result, whence, null0):
     offset = offset_high << 32 | offset_low
     origin = whence
     regreturn = 0
-    ql.nprint("_llseek(%d, 0x%x, 0x%x, 0x%x = %d)" % (fd, offset_high, offset_low, origin, regreturn))
+    ql.nprint("_llseek(%d, 0x%x, 0x%x, 0x%x = %d)", fd, offset_high, offset_low, origin, regreturn)
     try:
         ret = ql.file_des[fd].lseek(offset, origin)
     except OSError:
@@ -360,25 +391,21 @@ def ql_syscall__llseek(ql, fd, offset_high, offset_low, result, whence, null0):
     if regreturn == 0:
         ql.mem_write(result, ql.pack64(ret))
 
-    ql.nprint("_llseek(%d, 0x%x, 0x%x, 0x%x = %d)" % (fd, offset_high, offset_low, origin, regreturn))
+    ql.nprint("_llseek(%d, 0x%x, 0x%x, 0x%x = %d)", fd, offset_high, offset_low, origin, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_brk(ql, brk_input, null0, null1, null2, null3, null4):
-    ql.nprint("brk(0x%x)" % brk_input)
-    if brk_input != 0:
-        if brk_input > ql.brk_address:
-            ql.uc.mem_map(ql.brk_address, (int(((brk_input + 0xfff) // 0x1000) * 0x1000 - ql.brk_address)))
-            ql.brk_address = int(((brk_input + 0xfff) // 0x1000) * 0x1000)
-    else:
+    ql.nprint("brk(0x%x)", brk_input)
+    if brk_input == 0 or not ql.vma.brk(brk_input):
         brk_input = ql.brk_address
     ql_definesyscall_return(ql, brk_input)
-    ql.dprint("[+] brk return(0x%x)" % ql.brk_address)
+    ql.dprint("[+] brk return(0x%x)", ql.brk_address)
 
 def ql_syscall_mprotect(ql, mprotect_start, mprotect_len, mprotect_prot, null0, null1, null2):
     regreturn = 0
-    ql.nprint("mprotect(0x%x, 0x%x, 0x%x) = %d" % (mprotect_start, mprotect_len, mprotect_prot, regreturn))
-    ql.dprint("[+] mprotect(0x%x, 0x%x, %s) = %d" % (mprotect_start, mprotect_len, mmap_prot_mapping(mprotect_prot), regreturn))
+    ql.nprint("mprotect(0x%x, 0x%x, 0x%x) = %d", mprotect_start, mprotect_len, mprotect_prot, regreturn)
+    ql.dprint("[+] mprotect(0x%x, 0x%x, %s) = %d", mprotect_start, mprotect_len, QlLazyStr(mmap_prot_mapping, mprotect_prot), regreturn)
 
     new_prot = []
     prot_dict = {"PROT_READ": "r", "PROT_WRITE": "w", "PROT_EXEC": "x"}
@@ -395,14 +422,7 @@ def ql_syscall_mprotect(ql, mprotect_start, mprotect_len, mprotect_prot, null0,
 
     new_prot = ''.join(new_prot)
 
-    map_info = ql.map_info
-
-    for idx, val in enumerate(map_info):
-        start, end, prot, info = val
-        if start < mprotect_start+mprotect_len-1 < end:
-            map_info[idx] = [start, end, new_prot, info]
-
-    ql.map_info = map_info
+    ql.vma.protect(mprotect_start, mprotect_start + ((mprotect_len + 0x1000 - 1) // 0x1000) * 0x1000, new_prot)
 
     ql_definesyscall_return(ql, regreturn)
 
@@ -416,7 +436,7 @@ def ql_syscall_uname(ql, address, null0, null1, null2, null3, null4):
     buf += b''.ljust(65, b'\x00')
     ql.uc.mem_write(address, buf)
     regreturn = 0
-    ql.nprint("uname(0x%x) = %d" % (address, regreturn))
+    ql.nprint("uname(0x%x) = %d", address, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -433,13 +453,37 @@ def ql_syscall_access(ql, access_path, access_mode, null0, null1, null2, null3):
 
     ql_definesyscall_return(ql, regreturn)
 
-    ql.nprint("access(%s, 0x%x) = %d " % (relative_path, access_mode, regreturn))
+    ql.nprint("access(%s, 0x%x) = %d ", relative_path, access_mode, regreturn)
     if regreturn == 0:
-        ql.dprint("[+] File found: %s" % relative_path)
+        ql.dprint("[+] File found: %s", relative_path)
     else:
         ql.dprint("[!] No such file or directory")
 
 
+def ql_mmap_file_read(ql, mmap_file, mmap_offset, mmap_length):
+    # regular files (libraries mapped by ld.so) come from the shared image cache,
+    # without moving the file offset, same as a real mmap
+    if isinstance(mmap_file, ql_file):
+        try:
+            image = ql_image_cache.get_fd(mmap_file.fileno(), mmap_file.name)
+        except OSError:
+            # not mappable, read it instead
+            image = None
+        if image is not None:
+            return image.getdata(mmap_offset, mmap_length)
+
+    mmap_file.lseek(mmap_offset)
+    return mmap_file.read(mmap_length)
+
+
+def ql_mmap_file_data(ql, mmap_file, mmap_offset, mmap_length):
+    # with demand paging, large mappings of regular files are read as their pages
+    # are touched
+    if ql.vma.demand_paging and isinstance(mmap_file, ql_file) and mmap_length >= QL_DEMAND_PAGING_MIN:
+        return FileSource(mmap_file.fileno(), mmap_offset, mmap_length)
+    return ql_mmap_file_read(ql, mmap_file, mmap_offset, mmap_length)
+
+
 def ql_syscall_old_mmap(ql, struct_mmap_args, null0, null1, null2, null3, null4):
     # according to the linux kernel this is only for the ia32 compatibility
     _struct = []
@@ -450,8 +494,8 @@ def ql_syscall_old_mmap(ql, struct_mmap_args, null0, null1, null2, null3, null4)
 
     mmap_addr, mmap_length, mmap_prot, mmap_flags, mmap_fd, mmap_offset = _struct
 
-    ql.dprint("[+] log old_mmap - old_mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)" % (mmap_addr, mmap_length, mmap_prot, mmap_flags, mmap_fd, mmap_offset))
-    ql.dprint("[+] log old_mmap - old_mmap(0x%x, 0x%x, %s, %s, %d, %d)" % (mmap_addr, mmap_length, mmap_prot_mapping(mmap_prot), mmap_flag_mapping(mmap_flags), mmap_fd, mmap_offset))
+    ql.dprint("[+] log old_mmap - old_mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)", mmap_addr, mmap_length, mmap_prot, mmap_flags, mmap_fd, mmap_offset)
+    ql.dprint("[+] log old_mmap - old_mmap(0x%x, 0x%x, %s, %s, %d, %d)", mmap_addr, mmap_length, QlLazyStr(mmap_prot_mapping, mmap_prot), QlLazyStr(mmap_flag_mapping, mmap_flags), mmap_fd, mmap_offset)
 
     # FIXME
     # this is ugly patch, we might need to get value from elf parse,
@@ -470,35 +514,26 @@ def ql_syscall_old_mmap(ql, struct_mmap_args, null0, null1, null2, null3, null4)
     else:
         mmap_fd = ql.unpack32s(ql.pack32(mmap_fd))
 
-    mmap_base = mmap_addr
-    need_mmap = True
-
-    if mmap_addr != 0 and (mmap_addr < ql.mmap_start):
-        need_mmap = False
-
-    # initial ql.mmap_start
-    if mmap_addr == 0:
-        mmap_base = ql.mmap_start
-        ql.mmap_start = mmap_base + ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000
-
+    data = None
+    mem_info = '[mapped]'
+    if ((mmap_flags & MAP_ANONYMOUS) == 0) and mmap_fd < 256 and ql.file_des[mmap_fd] != 0:
+        data = ql_mmap_file_data(ql, ql.file_des[mmap_fd], mmap_offset, mmap_length)
+        ql.dprint("[+] log mem wirte : 0x%x", len(data))
+        ql.dprint("[+] log mem mmap  : %s", ql.file_des[mmap_fd].name)
+        mem_info = ql.file_des[mmap_fd].name
 
-    ql.dprint("[+] log old_mmap - return addr : " + hex(mmap_base))
-    ql.dprint("[+] log old_mmap - addr range  : " + hex(mmap_base) + ' - ' + hex(mmap_base + ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000))
+    try:
+        mmap_base = ql.vma.mmap(mmap_addr, ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000, data)
+    except:
+        ql.show_map_info()
+        raise
 
-    # initialized mapping
-    if need_mmap:
-        ql.dprint("[+] log old_mmap - mapping needed")
-        try:
-            ql.uc.mem_map(mmap_base, ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000)
-        except:
-            ql.show_map_info()
-            raise
 
-    ql.uc.mem_write(mmap_base, b'\x00' * (((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000))
+    ql.dprint("[+] log old_mmap - return addr : 0x%x", mmap_base)
+    ql.dprint("[+] log old_mmap - addr range  : 0x%x - 0x%x", mmap_base, mmap_base + ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000)
 
     mem_s = mmap_base
     mem_e = mmap_base + ((mmap_length + 0x1000 - 1) // 0x1000) * 0x1000
-    mem_info = '[mapped]'
     mem_p = []
     prot_dict = {"PROT_READ": "r", "PROT_WRITE": "w", "PROT_EXEC": "x"}
 
@@ -510,29 +545,19 @@ def ql_syscall_old_mmap(ql, struct_mmap_args, null0, null1, null2, null3, null4)
 
     mem_p = ''.join(mem_p)
 
-    if ((mmap_flags & MAP_ANONYMOUS) == 0) and mmap_fd < 256 and ql.file_des[mmap_fd] != 0:
-        ql.file_des[mmap_fd].lseek(mmap_offset)
-        data = ql.file_des[mmap_fd].read(mmap_length)
-
-        ql.dprint("[+] log mem wirte : " + hex(len(data)))
-        ql.dprint("[+] log mem mmap  : " + str(ql.file_des[mmap_fd].name))
-
-        ql.uc.mem_write(mmap_base, data)
-        mem_info = ql.file_des[mmap_fd].name
-
     ql.insert_map_info(mem_s, mem_e, mem_p, mem_info)
 
 
-    ql.nprint("old_mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x" % (mmap_addr, mmap_length, mmap_prot, mmap_flags, mmap_fd, mmap_offset, mmap_base))
+    ql.nprint("old_mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x", mmap_addr, mmap_length, mmap_prot, mmap_flags, mmap_fd, mmap_offset, mmap_base)
     regreturn = mmap_base
-    ql.dprint("[+] mmap_base is 0x%x" % regreturn)
+    ql.dprint("[+] mmap_base is 0x%x", regreturn)
 
     ql_definesyscall_return(ql, regreturn)
     
 
 def ql_syscall_mmap(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset):
-    ql.dprint("[+] log mmap - mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)" % (mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset))
-    ql.dprint("[+] log mmap - mmap(0x%x, 0x%x, %s, %s, %d, %d)" % (mmap2_addr, mmap2_length, mmap_prot_mapping(mmap2_prot), mmap_flag_mapping(mmap2_flags), mmap2_fd, mmap2_pgoffset))
+    ql.dprint("[+] log mmap - mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)", mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset)
+    ql.dprint("[+] log mmap - mmap(0x%x, 0x%x, %s, %s, %d, %d)", mmap2_addr, mmap2_length, QlLazyStr(mmap_prot_mapping, mmap2_prot), QlLazyStr(mmap_flag_mapping, mmap2_flags), mmap2_fd, mmap2_pgoffset)
 
     # FIXME
     # this is ugly patch, we might need to get value from elf parse,
@@ -550,36 +575,26 @@ def ql_syscall_mmap(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2
     else:
         mmap2_fd = ql.unpack32s(ql.pack32(mmap2_fd))
 
-    mmap_base = mmap2_addr
-    need_mmap = True
-
-    if mmap2_addr != 0 and (mmap2_addr < ql.mmap_start):
-        need_mmap = False    
-    
-    # initial ql.mmap_start
-    if mmap2_addr == 0:
-        mmap_base = ql.mmap_start
-        ql.mmap_start = mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000
+    data = None
+    mem_info = '[mapped]'
+    if ((mmap2_flags & MAP_ANONYMOUS) == 0) and mmap2_fd < 256 and ql.file_des[mmap2_fd] != 0:
+        data = ql_mmap_file_data(ql, ql.file_des[mmap2_fd], mmap2_pgoffset, mmap2_length)
+        ql.dprint("[+] log mem wirte : 0x%x", len(data))
+        ql.dprint("[+] log mem mmap  : %s", ql.file_des[mmap2_fd].name)
+        mem_info = ql.file_des[mmap2_fd].name
 
+    try:
+        mmap_base = ql.vma.mmap(mmap2_addr, ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000, data)
+    except:
+        ql.show_map_info()
+        raise
 
-    ql.dprint("[+] log mmap - return addr : " + hex(mmap_base))
-    ql.dprint("[+] log mmap - addr range  : " + hex(mmap_base) + ' - ' + hex(mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000))
 
-    # initialized mapping
-    if need_mmap:
-        ql.dprint("[+] log mmap - mapping needed")
-        try:
-            ql.uc.mem_map(mmap_base, ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000)
-        except:
-            ql.show_map_info()
-            raise   
-    
-    ql.uc.mem_write(mmap_base, b'\x00' * (((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000))
-    
+    ql.dprint("[+] log mmap - return addr : 0x%x", mmap_base)
+    ql.dprint("[+] log mmap - addr range  : 0x%x - 0x%x", mmap_base, mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000)
 
     mem_s = mmap_base
     mem_e = mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000
-    mem_info = '[mapped]'
     mem_p = []
     prot_dict = {"PROT_READ": "r", "PROT_WRITE": "w", "PROT_EXEC": "x"}
 
@@ -591,22 +606,12 @@ def ql_syscall_mmap(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2
 
     mem_p = ''.join(mem_p)
 
-    if ((mmap2_flags & MAP_ANONYMOUS) == 0) and mmap2_fd < 256 and ql.file_des[mmap2_fd] != 0:
-        ql.file_des[mmap2_fd].lseek(mmap2_pgoffset)
-        data = ql.file_des[mmap2_fd].read(mmap2_length)
-
-        ql.dprint("[+] log mem wirte : " + hex(len(data)))
-        ql.dprint("[+] log mem mmap  : " + str(ql.file_des[mmap2_fd].name))
-
-        ql.uc.mem_write(mmap_base, data)
-        mem_info = ql.file_des[mmap2_fd].name
-        
     ql.insert_map_info(mem_s, mem_e, mem_p, mem_info)
     
 
-    ql.nprint("mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x" % (mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset, mmap_base))
+    ql.nprint("mmap(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x", mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset, mmap_base)
     regreturn = mmap_base
-    ql.dprint("[+] mmap_base is 0x%x" % regreturn)
+    ql.dprint("[+] mmap_base is 0x%x", regreturn)
 
     ql_definesyscall_return(ql, regreturn)
 
@@ -629,33 +634,27 @@ def ql_syscall_mmap2(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap
         mmap2_pgoffset = mmap2_pgoffset * 4096
 
 
-    mmap_base = mmap2_addr
-    need_mmap = True
-
-    if mmap2_addr != 0 and mmap2_addr < ql.mmap_start:
-        need_mmap = False
-    if mmap2_addr == 0:
-        mmap_base = ql.mmap_start
-        ql.mmap_start = mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000
+    data = None
+    mem_info = '[mapped]'
+    if ((mmap2_flags & MAP_ANONYMOUS) == 0) and mmap2_fd < 256 and ql.file_des[mmap2_fd] != 0:
+        data = ql_mmap_file_data(ql, ql.file_des[mmap2_fd], mmap2_pgoffset, mmap2_length)
+        ql.dprint("[+] log2 mem wirte : 0x%x", len(data))
+        ql.dprint("[+] log2 mem mmap  : %s", ql.file_des[mmap2_fd].name)
+        mem_info = ql.file_des[mmap2_fd].name
 
-    ql.dprint("[+] log mmap2 - mmap2(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)" % (mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset))
-    ql.dprint("[+] log mmap2 - mmap2(0x%x, 0x%x, %s, %s, %d, %d)" % (mmap2_addr, mmap2_length, mmap_prot_mapping(mmap2_prot), mmap_flag_mapping(mmap2_flags), mmap2_fd, mmap2_pgoffset))
-    ql.dprint("[+] log mmap2 - return addr : " + hex(mmap_base))
-    ql.dprint("[+] log mmap2 - addr range  : " + hex(mmap_base) + ' - ' + hex(mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000))
+    try:
+        mmap_base = ql.vma.mmap(mmap2_addr, ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000, data)
+    except:
+        ql.show_map_info()
+        raise
 
-    if need_mmap:
-        ql.dprint("[+] log mmap - mapping needed")
-        try:
-            ql.uc.mem_map(mmap_base, ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000)
-        except:
-            ql.show_map_info()
-            raise     
+    ql.dprint("[+] log mmap2 - mmap2(0x%x, 0x%x, 0x%x, 0x%x, %d, %d)", mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset)
+    ql.dprint("[+] log mmap2 - mmap2(0x%x, 0x%x, %s, %s, %d, %d)", mmap2_addr, mmap2_length, QlLazyStr(mmap_prot_mapping, mmap2_prot), QlLazyStr(mmap_flag_mapping, mmap2_flags), mmap2_fd, mmap2_pgoffset)
+    ql.dprint("[+] log mmap2 - return addr : 0x%x", mmap_base)
+    ql.dprint("[+] log mmap2 - addr range  : 0x%x - 0x%x", mmap_base, mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000)
 
-    ql.uc.mem_write(mmap_base, b'\x00' * (((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000))
-    
     mem_s = mmap_base
     mem_e = mmap_base + ((mmap2_length + 0x1000 - 1) // 0x1000) * 0x1000
-    mem_info = '[mapped]'
     mem_p = []
     prot_dict = {"PROT_READ": "r", "PROT_WRITE": "w", "PROT_EXEC": "x"}
 
@@ -667,22 +666,12 @@ def ql_syscall_mmap2(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap
 
     mem_p = ''.join(mem_p)
 
-    if ((mmap2_flags & MAP_ANONYMOUS) == 0) and mmap2_fd < 256 and ql.file_des[mmap2_fd] != 0:
-        ql.file_des[mmap2_fd].lseek(mmap2_pgoffset)
-        data = ql.file_des[mmap2_fd].read(mmap2_length)
-
-        ql.dprint("[+] log2 mem wirte : " + hex(len(data)))
-        ql.dprint("[+] log2 mem mmap  : " + str(ql.file_des[mmap2_fd].name))
-        ql.uc.mem_write(mmap_base, data)
-        
-        mem_info = ql.file_des[mmap2_fd].name
-        
     ql.insert_map_info(mem_s, mem_e, mem_p, mem_info)
     
-    ql.nprint("mmap2(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x" % (mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset, mmap_base))
+    ql.nprint("mmap2(0x%x, 0x%x, 0x%x, 0x%x, %d, %d) = 0x%x", mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap2_fd, mmap2_pgoffset, mmap_base)
     
     regreturn = mmap_base
-    ql.dprint("[+] mmap2_base is 0x%x" % regreturn)
+    ql.dprint("[+] mmap2_base is 0x%x", regreturn)
 
     ql_definesyscall_return(ql, regreturn)
 
@@ -690,10 +679,11 @@ def ql_syscall_mmap2(ql, mmap2_addr, mmap2_length, mmap2_prot, mmap2_flags, mmap
 def ql_syscall_close(ql, close_fd, null0, null1, null2, null3, null4):
     regreturn = -1
     if close_fd < 256 and ql.file_des[close_fd] != 0:
+        ql_io_drop(ql, close_fd)
         ql.file_des[close_fd].close()
         ql.file_des[close_fd] = 0
         regreturn = 0
-    ql.nprint("close(%d) = %d" % (close_fd, regreturn))
+    ql.nprint("close(%d) = %d", close_fd, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -743,11 +733,11 @@ def ql_syscall_fstatat64(ql, fstatat64_fd, fstatat64_fname, fstatat64_buf, fstat
         ql.uc.mem_write(fstatat64_buf,fstat64_buf)
         regreturn = 0
 
-    ql.nprint("fstatat64(0x%x, %s) = %d" % (fstatat64_fd, relative_path, regreturn))
+    ql.nprint("fstatat64(0x%x, %s) = %d", fstatat64_fd, relative_path, regreturn)
     if regreturn == 0:
-        ql.dprint("[+] Directory Found: %s"  % relative_path)
+        ql.dprint("[+] Directory Found: %s", relative_path)
     else:
-        ql.dprint("[!] Directory Not Found: %s"  % relative_path)
+        ql.dprint("[!] Directory Not Found: %s", relative_path)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -814,7 +804,7 @@ def ql_syscall_fstat64(ql, fstat64_fd, fstat64_add, null0, null1, null2, null3):
     else:
         regreturn = -1
 
-    ql.nprint("fstat64(%d, 0x%x) = %d" % (fstat64_fd, fstat64_add, regreturn))
+    ql.nprint("fstat64(%d, 0x%x) = %d", fstat64_fd, fstat64_add, regreturn)
     if regreturn == 0:
         ql.dprint("[+] fstat64 write completed")
     else:
@@ -889,7 +879,7 @@ def ql_syscall_fstat(ql, fstat_fd, fstat_add, null0, null1, null2, null3):
     else:
         regreturn = -1
 
-    ql.nprint("fstat(%d, 0x%x) = %d" % (fstat_fd, fstat_add, regreturn))
+    ql.nprint("fstat(%d, 0x%x) = %d", fstat_fd, fstat_add, regreturn)
     if regreturn == 0:
         ql.dprint("[+] fstat write completed")
     else:
@@ -962,7 +952,7 @@ def ql_syscall_stat64(ql, stat64_pathname, stat64_buf_ptr, null0, null1, null2,
         ql.uc.mem_write(stat64_buf_ptr, stat64_buf)
         regreturn = 0
 
-    ql.nprint("stat64(%s, 0x%x) = %d" % (relative_path, stat64_buf_ptr, regreturn))
+    ql.nprint("stat64(%s, 0x%x) = %d", relative_path, stat64_buf_ptr, regreturn)
     if regreturn == 0:
         ql.dprint("[+] stat64 write completed")
     else:
@@ -1023,7 +1013,7 @@ def ql_syscall_stat(ql, stat_path, stat_buf_ptr, null0, null1, null2, null3):
         regreturn = 0
         ql.uc.mem_write(stat_buf_ptr, stat_buf)
 
-    ql.nprint("stat(%s, 0x%x) = %d" % (relative_path, stat_buf_ptr, regreturn))
+    ql.nprint("stat(%s, 0x%x) = %d", relative_path, stat_buf_ptr, regreturn)
     if regreturn == 0:
         ql.dprint("[+] stat() write completed")
     else:
@@ -1083,7 +1073,7 @@ def ql_syscall_lstat(ql, lstat_path, lstat_buf_ptr, null0, null1, null2, null3):
         regreturn = 0
         ql.mem_write(lstat_buf_ptr, lstat_buf)
 
-    ql.nprint("lstat(%s, 0x%x) = %d" % (relative_path, lstat_buf_ptr, regreturn))
+    ql.nprint("lstat(%s, 0x%x) = %d", relative_path, lstat_buf_ptr, regreturn)
     if regreturn == 0:
         ql.dprint("[+] lstat() write completed")
     else:
@@ -1092,21 +1082,25 @@ def ql_syscall_lstat(ql, lstat_path, lstat_buf_ptr, null0, null1, null2, null3):
 
 
 def ql_syscall_read(ql, read_fd, read_buf, read_len, null0, null1, null2):
-    data = None
-    if read_fd < 256 and ql.file_des[read_fd] != 0:
-        try:
-            data = ql.file_des[read_fd].read(read_len)
-            ql.uc.mem_write(read_buf, data)
-            regreturn = len(data)
-        except:
+    def read():
+        data = None
+        if read_fd < 256 and ql.file_des[read_fd] != 0:
+            try:
+                data = ql.file_des[read_fd].read(read_len)
+                ql.uc.mem_write(read_buf, data)
+                regreturn = len(data)
+            except:
+                regreturn = -1
+        else:
             regreturn = -1
-    else:
-        regreturn = -1
-    ql.nprint("read(%d, 0x%x, 0x%x) = %d" % (read_fd, read_buf, read_len, regreturn))
+        ql.nprint("read(%d, 0x%x, 0x%x) = %d", read_fd, read_buf, read_len, regreturn)
 
-    if data:
-        ql.dprint("[+] read() CONTENT:")
-        ql.dprint(data)
+        if data:
+            ql.dprint("[+] read() CONTENT:")
+            ql.dprint(data)
+        return regreturn
+
+    regreturn = ql_io_wait(ql, read_fd, selectors.EVENT_READ, read)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1116,7 +1110,7 @@ def ql_syscall_write(ql, write_fd, write_buf, write_count, null0, null1, null2):
     
     try:
         buf = ql.uc.mem_read(write_buf, write_count)
-        ql.nprint("\nwrite(%d,%x,%i) = %d" % (write_fd, write_buf, write_count, regreturn))
+        ql.nprint("\nwrite(%d,%x,%i) = %d", write_fd, write_buf, write_count, regreturn)
         if buf:
             ql.dprint("[+] write() CONTENT:")
             ql.dprint(buf)
@@ -1125,7 +1119,7 @@ def ql_syscall_write(ql, write_fd, write_buf, write_count, null0, null1, null2):
         regreturn = write_count
     except:
         regreturn = -1
-        ql.nprint("write(%d,%x,%i) = %d" % (write_fd, write_buf, write_count, regreturn))
+        ql.nprint("write(%d,%x,%i) = %d", write_fd, write_buf, write_count, regreturn)
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
             raise
     #ql.nprint("write(%d,%x,%i) = %d" % (write_fd, write_buf, write_count, regreturn))
@@ -1138,7 +1132,7 @@ def ql_syscall_writev(ql, writev_fd, writev_vec, writev_vien, null0, null1, null
     regreturn = 0
     size_t_len = ql.archbit // 8
     iov = ql.uc.mem_read(writev_vec, writev_vien * size_t_len * 2)
-    ql.nprint("writev(0x%x, 0x%x, 0x%x)" % (writev_fd, writev_vec, writev_vien))
+    ql.nprint("writev(0x%x, 0x%x, 0x%x)", writev_fd, writev_vec, writev_vien)
     for i in range(writev_vien):
         addr = ql.unpack(iov[i * size_t_len * 2 : i * size_t_len * 2 + size_t_len])
         l = ql.unpack(iov[i * size_t_len * 2 + size_t_len : i * size_t_len * 2 + size_t_len * 2])
@@ -1150,13 +1144,13 @@ def ql_syscall_archprctl(ql, null0, ARCH_SET_FS, null1, null2, null3, null4):
     FSMSR = 0xC0000100
     ql.uc.msr_write(FSMSR, ARCH_SET_FS)
     regreturn = 0
-    ql.nprint("archprctl(0x%x) = %d" % (ARCH_SET_FS, regreturn))
+    ql.nprint("archprctl(0x%x) = %d", ARCH_SET_FS, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_prctl(ql, null0, null1, null2, null3, null4, null5):
     regreturn = 0
-    ql.nprint("prctl() = %d" % (regreturn))
+    ql.nprint("prctl() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1178,7 +1172,7 @@ def ql_syscall_readlink(ql, path_name, path_buff, path_buffsize, null0, null1, n
     else:
         regreturn = 0x0    
     
-    ql.nprint("readlink(%s, 0x%x, 0x%x) = %d" % (relative_path, path_buff, path_buffsize, regreturn))
+    ql.nprint("readlink(%s, 0x%x, 0x%x) = %d", relative_path, path_buff, path_buffsize, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1191,7 +1185,7 @@ def ql_syscall_getcwd(ql, path_buff, path_buffsize, null0, null1, null2, null3):
     pathname = (ql.uc.mem_read(path_buff, 0x100).split(b'\x00'))[0]
     pathname = str(pathname, 'utf-8', errors="ignore")
 
-    ql.nprint("getcwd(%s, 0x%x) = %d" % (pathname, path_buffsize, regreturn))
+    ql.nprint("getcwd(%s, 0x%x) = %d", pathname, path_buffsize, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1207,10 +1201,10 @@ def ql_syscall_chdir(ql, path_name, null0, null1, null2, null3, null4):
             pass
         else:
             ql.current_path = relative_path + '/'
-        ql.nprint("chdir(%s) = %d"% (relative_path, regreturn))
+        ql.nprint("chdir(%s) = %d", relative_path, regreturn)
     else:
         regreturn = -1    
-        ql.nprint("chdir(%s) = %d : Not Found" % (relative_path, regreturn))
+        ql.nprint("chdir(%s) = %d : Not Found", relative_path, regreturn)
     ql_definesyscall_return(ql, regreturn)     
 
 
@@ -1232,7 +1226,7 @@ def ql_syscall_readlinkat(ql, readlinkat_dfd, readlinkat_path, readlinkat_buf, r
     else:
         regreturn = 0x0
 
-    ql.nprint("readlinkat(0x%x, 0x%x, 0x%x, 0x%x) = %d" % (readlinkat_dfd, readlinkat_path, readlinkat_buf, readlinkat_bufsiz, regreturn))
+    ql.nprint("readlinkat(0x%x, 0x%x, 0x%x, 0x%x) = %d", readlinkat_dfd, readlinkat_path, readlinkat_buf, readlinkat_bufsiz, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1240,7 +1234,7 @@ def ql_syscall_ugetrlimit(ql, ugetrlimit_resource, ugetrlimit_rlim, null0, null1
     rlim = resource.getrlimit(ugetrlimit_resource)
     ql.uc.mem_write(ugetrlimit_rlim, ql.pack32s(rlim[0]) + ql.pack32s(rlim[1]))
     regreturn = 0
-    ql.nprint("ugetrlimit(%d, 0x%x) = %d" % (ugetrlimit_resource, ugetrlimit_rlim, regreturn))
+    ql.nprint("ugetrlimit(%d, 0x%x) = %d", ugetrlimit_resource, ugetrlimit_rlim, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1251,7 +1245,7 @@ def ql_syscall_setrlimit(ql, setrlimit_resource, setrlimit_rlim, null0, null1, n
     resource.setrlimit(setrlimit_resource, tmp_rlim)
 
     regreturn = 0
-    ql.nprint("setrlimit(%d, 0x%x) = %d" % (setrlimit_resource, setrlimit_rlim, regreturn))
+    ql.nprint("setrlimit(%d, 0x%x) = %d", setrlimit_resource, setrlimit_rlim, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 def ql_syscall_prlimit64(ql, pid, resource, new_limit, old_limit, null0, null1):
@@ -1284,7 +1278,7 @@ def ql_syscall_rt_sigaction(ql, rt_sigaction_signum, rt_sigaction_act, rt_sigact
         ql.sigaction_act[rt_sigaction_signum] = data
 
     regreturn = 0
-    ql.nprint("rt_sigaction(0x%x, 0x%x, = 0x%x) = %d" % (rt_sigaction_signum, rt_sigaction_act, rt_sigaction_oldact, regreturn))
+    ql.nprint("rt_sigaction(0x%x, 0x%x, = 0x%x) = %d", rt_sigaction_signum, rt_sigaction_act, rt_sigaction_oldact, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1357,7 +1351,7 @@ def ql_syscall_ioctl(ql, ioctl_fd, ioctl_cmd, ioctl_arg, null0, null1, null2):
     if isinstance(ql.file_des[ioctl_fd], ql_socket) and (ioctl_cmd == SIOCGIFADDR or ioctl_cmd == SIOCGIFNETMASK):
         try:
             tmp_arg = ql.uc.mem_read(ioctl_arg, 64)
-            ql.dprint("[+] query network card : %s" % tmp_arg)
+            ql.dprint("[+] query network card : %s", tmp_arg)
             data = ql.file_des[ioctl_fd].ioctl(ioctl_cmd, bytes(tmp_arg))
             ql.uc.mem_write(ioctl_arg, data)
             regreturn = 0
@@ -1378,19 +1372,19 @@ def ql_syscall_ioctl(ql, ioctl_fd, ioctl_cmd, ioctl_arg, null0, null1, null2):
         except :
             regreturn = -1
 
-    ql.nprint("ioctl(0x%x, 0x%x, 0x%x) = %d" % (ioctl_fd, ioctl_cmd, ioctl_arg, regreturn))
+    ql.nprint("ioctl(0x%x, 0x%x, 0x%x) = %d", ioctl_fd, ioctl_cmd, ioctl_arg, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_getpid(ql, null0, null1, null2, null3, null4, null5):
     regreturn= 0x512
-    ql.nprint("getpid() = %d" % (regreturn))
+    ql.nprint("getpid() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_getppid(ql, null0, null1, null2, null3, null4, null5):
     regreturn= 0x1024
-    ql.nprint("getpid() = %d" % (regreturn))
+    ql.nprint("getpid() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1402,7 +1396,7 @@ def ql_syscall_rt_sigprocmask(ql, rt_sigprocmask_how, rt_sigprocmask_nset, rt_si
         pass
 
     regreturn = 0
-    ql.nprint("rt_sigprocmask(0x%x, 0x%x, 0x%x, 0x%x) = %d" % (rt_sigprocmask_how, rt_sigprocmask_nset, rt_sigprocmask_oset, rt_sigprocmask_sigsetsize, regreturn))
+    ql.nprint("rt_sigprocmask(0x%x, 0x%x, 0x%x, 0x%x) = %d", rt_sigprocmask_how, rt_sigprocmask_nset, rt_sigprocmask_oset, rt_sigprocmask_sigsetsize, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1411,7 +1405,7 @@ def ql_syscall_vfork(ql, null0, null1, null2, null3, null4, null5):
 
     if pid == 0:
         ql.child_processes = True
-        ql.dprint ("[+] vfork(): is this a child process: %r" % (ql.child_processes))
+        ql.dprint("[+] vfork(): is this a child process: %r", ql.child_processes)
         regreturn = 0
         if ql.thread_management != None:
             ql.thread_management.cur_thread.set_thread_log_file(ql.log_dir)
@@ -1428,27 +1422,68 @@ def ql_syscall_vfork(ql, null0, null1, null2, null3, null4, null5):
     if ql.thread_management != None:
         ql.uc.emu_stop()
 
-    ql.nprint("vfork() = %d" % regreturn)
+    ql.nprint("vfork() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_setsid(ql, null0, null1, null2, null3, null4, null5):
     regreturn = os.getpid()
-    ql.nprint("setsid() = %d" % regreturn)
+    ql.nprint("setsid() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_time(ql, null0, null1, null2, null3, null4, null5):
     regreturn = int(time.time()) 
-    ql.nprint("time() = %d" % regreturn)
+    ql.nprint("time() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_wait4(ql, wait4_pid, wait4_wstatus, wait4_options, wait4_rusage, null0, null1):
-    spid, status, rusage = os.wait4(wait4_pid, wait4_options)
-    ql.uc.mem_write(wait4_wstatus, ql.pack32(status))
-    regreturn = spid
-    ql.nprint("wait4(%d, %d) = %d"% (wait4_pid, wait4_options, regreturn))
+    def wait4(options):
+        spid, status, rusage = os.wait4(wait4_pid, options)
+        if spid != 0:
+            ql.uc.mem_write(wait4_wstatus, ql.pack32(status))
+            ql.nprint("wait4(%d, %d) = %d", wait4_pid, wait4_options, spid)
+        return spid
+
+    def wait4_wake(th, events, pidfd = None):
+        if pidfd != None:
+            os.close(pidfd)
+        try:
+            spid = wait4(wait4_options | os.WNOHANG)
+        except ChildProcessError:
+            spid = -1
+        if spid == 0:
+            wait4_park(th)
+        else:
+            th.set_syscall_return(spid)
+
+    def wait4_park(th):
+        # a pidfd turns readable when the child exits, without one check back
+        # every idle pass
+        tm = ql.thread_management
+        if wait4_pid > 0 and hasattr(os, "pidfd_open"):
+            try:
+                pidfd = os.pidfd_open(wait4_pid)
+            except OSError:
+                pidfd = None
+            if pidfd != None:
+                tm.wait_fd(th, pidfd, selectors.EVENT_READ, lambda th, events: wait4_wake(th, events, pidfd))
+                return
+        tm.wait_until(th, tm.runing_time + THREAD_IDLE_TIME, wait4_wake)
+
+    tm = ql.thread_management
+    if tm == None or wait4_options & os.WNOHANG:
+        regreturn = wait4(wait4_options)
+    else:
+        # do not hold up the other threads while the child runs
+        try:
+            regreturn = wait4(wait4_options | os.WNOHANG)
+        except ChildProcessError:
+            regreturn = -1
+        if regreturn == 0:
+            ql.uc.emu_stop()
+            wait4_park(tm.cur_thread)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1457,30 +1492,19 @@ def ql_syscall_execve(ql, execve_pathname, execve_argv, execve_envp, null0, null
     real_path = ql_transform_to_real_path(ql, pathname)
     relative_path = ql_transform_to_relative_path(ql, pathname)
 
-    word_size = 8 if (ql.arch == QL_ARM64) or (ql.arch == QL_X8664) else 4
-    unpack = ql.unpack64 if (ql.arch == QL_ARM64) or (ql.arch == QL_X8664) else ql.unpack32
-
     argv = []
     if execve_argv != 0:
-        while True:
-            argv_addr = unpack(ql.uc.mem_read(execve_argv, word_size))
-            if argv_addr == 0:
-                break
+        for argv_addr in ql.mem.read_ptr_array(execve_argv):
             argv.append(ql_read_string(ql, argv_addr))
-            execve_argv += word_size
 
     env = {}
     if execve_envp != 0:
-        while True:
-            env_addr = unpack(ql.uc.mem_read(execve_envp, word_size))
-            if env_addr == 0:
-                break
+        for env_addr in ql.mem.read_ptr_array(execve_envp):
             env_str = ql_read_string(ql, env_addr)
             idx = env_str.index('=')
             key = env_str[ : idx]
             val = env_str[idx + 1 : ]
             env[key] = val
-            execve_envp += word_size
 
     ql.uc.emu_stop()
 
@@ -1498,7 +1522,7 @@ def ql_syscall_execve(ql, execve_pathname, execve_argv, execve_envp, null0, null
         loader_file(ql)
         ql.run()
     
-    ql.nprint("execve(%s, [%s], [%s])"% (pathname, ', '.join(argv), ', '.join([key + '=' + value for key, value in env.items()])))    
+    ql.nprint("execve(%s, [%s], [%s])", pathname, QlLazyStr(', '.join, argv), QlLazyStr(lambda: ', '.join([key + '=' + value for key, value in env.items()])))
 
 
 def ql_syscall_socket(ql, socket_domain, socket_type, socket_protocol, null0, null1, null2):
@@ -1525,11 +1549,11 @@ def ql_syscall_socket(ql, socket_domain, socket_type, socket_protocol, null0, nu
     except:
         regreturn = -1
     
-    ql.nprint("socket(%d, %d, %d) = %d" % (socket_domain, socket_type, socket_protocol, regreturn))
+    ql.nprint("socket(%d, %d, %d) = %d", socket_domain, socket_type, socket_protocol, regreturn)
     
     socket_type = socket_type_mapping(socket_type, ql.arch)
     socket_domain = socket_domain_mapping(socket_domain, ql.arch)
-    ql.dprint("[+] socket(%s, %s, %s) = %d" % (socket_domain, socket_type, socket_protocol, regreturn))
+    ql.dprint("[+] socket(%s, %s, %s) = %d", socket_domain, socket_type, socket_protocol, regreturn)
 
     ql_definesyscall_return(ql, regreturn)
 
@@ -1563,11 +1587,11 @@ def ql_syscall_connect(ql, connect_sockfd, connect_addr, connect_addrlen, null0,
         regreturn = -1
     
     if s.family == AF_UNIX:
-        ql.nprint("connect(%s) = %d" % (sun_path, regreturn))
+        ql.nprint("connect(%s) = %d", sun_path, regreturn)
     elif s.family == AF_INET:
-        ql.nprint("connect(%s, %d) = %d" % (ip, port, regreturn))
+        ql.nprint("connect(%s, %d) = %d", ip, port, regreturn)
     else:
-        ql.nprint("connect() = %d" % (regreturn))
+        ql.nprint("connect() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1586,7 +1610,7 @@ def ql_syscall_dup2(ql, dup2_oldfd, dup2_newfd, null0, null1, null2, null3):
             regreturn = -1
     else:
         regreturn = -1
-    ql.nprint("dup2(%d, %d) = %d" % (dup2_oldfd, dup2_newfd, regreturn))
+    ql.nprint("dup2(%d, %d) = %d", dup2_oldfd, dup2_newfd, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1599,7 +1623,7 @@ def ql_syscall_dup3(ql, dup3_oldfd, dup3_newfd, dup3_flags, null2, null3, null4,
             regreturn = -1
     else:
         regreturn = -1
-    ql.nprint("dup3(%d, %d, %d) = %d" % (dup3_oldfd, dup3_newfd,dup3_flags ,regreturn))
+    ql.nprint("dup3(%d, %d, %d) = %d", dup3_oldfd, dup3_newfd, dup3_flags, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1607,7 +1631,7 @@ def ql_syscall_dup3(ql, dup3_oldfd, dup3_newfd, dup3_flags, null2, null3, null4,
 def ql_syscall___sysctl(ql, sysctl_name, sysctl_namelen, sysctl_bytes_oldlenp, sysctl_size_oldlenp, sysctl_bytes_newlen, sysctl_size_newlen):
     # sysctl (name=0x7fffffffe3d8, namelen=2, oldp=0x7fffffffe3d4, oldlenp=0x7fffffffe3e0, newp=0x0, newlen=<optimized out>)
     regreturn = 0
-    ql.nprint("__sysctl(0x%x) = %i" % (sysctl_name, regreturn)) 
+    ql.nprint("__sysctl(0x%x) = %i", sysctl_name, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1623,7 +1647,7 @@ def ql_syscall_fcntl(ql, fcntl_fd, fcntl_cmd, null0, null1, null2, null3):
     elif fcntl_cmd == F_SETFL:
         regreturn = 0
 
-    ql.nprint("fcntl(%d, %d) = %d" % (fcntl_fd, fcntl_cmd, regreturn))
+    ql.nprint("fcntl(%d, %d) = %d", fcntl_fd, fcntl_cmd, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1645,13 +1669,14 @@ def ql_syscall_fcntl64(ql, fcntl_fd, fcntl_cmd, fcntl_arg, null1, null2, null3):
     else:
         regreturn = 0    
 
-    ql.nprint("fcntl64(%d, %d, %d) = %d" % (fcntl_fd, fcntl_cmd, fcntl_arg, regreturn))
+    ql.nprint("fcntl64(%d, %d, %d) = %d", fcntl_fd, fcntl_cmd, fcntl_arg, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_shutdown(ql, shutdown_fd, shutdown_how, null0, null1, null2, null3):
-    ql.nprint("shutdown(%d, %d)" % (shutdown_fd, shutdown_how))
+    ql.nprint("shutdown(%d, %d)", shutdown_fd, shutdown_how)
     if shutdown_fd >=0 and shutdown_fd < 256 and ql.file_des[shutdown_fd] != 0:
+        ql_io_drop(ql, shutdown_fd)
         try:
             ql.file_des[shutdown_fd].shutdown(shutdown_how)
             regreturn = 0
@@ -1701,10 +1726,10 @@ def ql_syscall_bind(ql, bind_fd, bind_addr, bind_addrlen,  null0, null1, null2):
         regreturn = 0
 
     if sin_family == 1:
-        ql.nprint("bind(%d, %s, %d) = %d" % (bind_fd, path, bind_addrlen, regreturn))
+        ql.nprint("bind(%d, %s, %d) = %d", bind_fd, path, bind_addrlen, regreturn)
     else:
-        ql.nprint("bind(%d,%s:%d,%d) = %d" % (bind_fd, host, port, bind_addrlen,regreturn))
-        ql.dprint ("[+] syscall bind host: %s and port: %i sin_family: %i" % (ql_bin_to_ip(host), port, sin_family))
+        ql.nprint("bind(%d,%s:%d,%d) = %d", bind_fd, host, port, bind_addrlen, regreturn)
+        ql.dprint("[+] syscall bind host: %s and port: %i sin_family: %i", ql_bin_to_ip(host), port, sin_family)
 
     ql_definesyscall_return(ql, regreturn)    
 
@@ -1720,19 +1745,11 @@ def ql_syscall_listen(ql, listen_sockfd, listen_backlog, null0, null1, null2, nu
             regreturn = -1
     else:
         regreturn = -1
-    ql.nprint("listen(%d, %d) = %d" % (listen_sockfd, listen_backlog, regreturn))
+    ql.nprint("listen(%d, %d) = %d", listen_sockfd, listen_backlog, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_nanosleep(ql, nanosleep_req, nanosleep_rem, null0, null1, null2, null3):
-    def nanosleep_block_fuc(ql, th, arg):
-        st, tm = arg
-        et = ql.thread_management.runing_time
-        if et - st >= tm:
-            return False
-        else:
-            return True
-
     n = ql.archbit // 8 # 4 for 32-bit , 8 for 64-bit
 
     tv_sec = ql.unpack(ql.uc.mem_read(nanosleep_req, n))
@@ -1743,12 +1760,11 @@ def ql_syscall_nanosleep(ql, nanosleep_req, nanosleep_rem, null0, null1, null2,
     else:
         ql.uc.emu_stop()
 
-        th = ql.thread_management.cur_thread
-        th.blocking()
-        th.set_blocking_condition(nanosleep_block_fuc, [ql.thread_management.runing_time, int(tv_sec * 1000000)])
+        tm = ql.thread_management
+        tm.wait_until(tm.cur_thread, tm.runing_time + int(tv_sec * 1000000))
 
     regreturn = 0
-    ql.nprint("nanosleep(0x%x, 0x%x) = %d" % (nanosleep_req, nanosleep_rem, regreturn))
+    ql.nprint("nanosleep(0x%x, 0x%x) = %d", nanosleep_req, nanosleep_rem, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1757,7 +1773,7 @@ def ql_syscall_setitimer(ql, setitimer_which, setitimer_new_value, setitimer_old
     # When any timer expires, a signal is sent to the process, and the timer (potentially) restarts.
     # But I haven’t figured out how to send a signal yet.
     regreturn = 0
-    ql.nprint("setitimer(%d, %x, %x) = %d" % (setitimer_which, setitimer_new_value, setitimer_old_value, regreturn))
+    ql.nprint("setitimer(%d, %x, %x) = %d", setitimer_which, setitimer_new_value, setitimer_old_value, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1774,10 +1790,10 @@ def ql_syscall__newselect(ql, _newselect_nfds, _newselect_readfds, _newselect_wr
             return fd_list, fd_map
         while idx < max_fd:
             if idx % 32 == 0:
-                tmp = ql.unpack32(ql.uc.mem_read(struct_addr + idx, 4))
+                tmp = ql.unpack32(ql.uc.mem_read(struct_addr + idx // 8, 4))
             if tmp & 0x1 != 0:
-                fd_list.append(ql.file_des[idx].socket)
-                fd_map[ql.file_des[idx].socket] = idx
+                fd_list.append(ql.file_des[idx])
+                fd_map[ql.file_des[idx]] = idx
             tmp = tmp >> 1
             idx += 1
         return fd_list, fd_map
@@ -1790,8 +1806,7 @@ def ql_syscall__newselect(ql, _newselect_nfds, _newselect_readfds, _newselect_wr
     tmp_w_fd, tmp_w_map = parse_fd_set(ql, _newselect_nfds, _newselect_writefds)
     tmp_e_fd, tmp_e_map = parse_fd_set(ql, _newselect_nfds, _newselect_exceptfds)
 
-    timeout = ql.unpack32(ql.uc.mem_read(_newselect_timeout, 4))
-    try:
+    def select_fds(timeout):
         ans = select.select(tmp_r_fd, tmp_w_fd, tmp_e_fd, timeout)
         regreturn = len(ans[0]) + len(ans[1]) + len(ans[2])
 
@@ -1813,10 +1828,62 @@ def ql_syscall__newselect(ql, _newselect_nfds, _newselect_readfds, _newselect_wr
             for i in ans[2]:
                 tmp_buf = set_fd_set(tmp_buf, tmp_e_map[i])
             ql.uc.mem_write(_newselect_exceptfds, tmp_buf)
+        return regreturn
+
+    # a NULL timeout waits forever
+    timeout = None
+    if _newselect_timeout != 0:
+        n = ql.archbit // 8
+        timeout = ql.unpack(ql.uc.mem_read(_newselect_timeout, n))
+        timeout += ql.unpack(ql.uc.mem_read(_newselect_timeout + n, n)) / 1000000
+
+    tm = ql.thread_management
+    deadline = None
+
+    def select_park(th):
+        # exceptional conditions (out of band data) have no selector event, exceptfds
+        # are watched for reading and select_wake checks what it really was
+        events = {}
+        for f in tmp_r_fd + tmp_e_fd:
+            events[f.fileno()] = selectors.EVENT_READ
+        for f in tmp_w_fd:
+            events[f.fileno()] = events.get(f.fileno(), 0) | selectors.EVENT_WRITE
+        for fd, e in events.items():
+            tm.wait_fd(th, fd, e, select_wake)
+        if deadline != None:
+            tm.wait_until(th, deadline, select_wake)
+        elif not events:
+            # nothing can wake it
+            th.blocking()
+            th.set_blocking_condition(None)
+
+    def select_wake(th, events):
+        try:
+            regreturn = select_fds(0)
+        except:
+            regreturn = -1
+        if regreturn == 0 and events != 0:
+            # readable but not in readfds, e.g. an exceptfd without out of band data
+            select_park(th)
+        else:
+            th.set_syscall_return(regreturn)
+
+    try:
+        fds = tmp_r_fd + tmp_w_fd + tmp_e_fd
+        if not ql_io_parkable(ql) or any(ql_host_fd(f) < 0 for f in fds):
+            regreturn = select_fds(timeout)
+        else:
+            # poll, and when nothing is ready park the thread on the fds and the timeout
+            regreturn = select_fds(0)
+            if regreturn == 0 and timeout != 0:
+                ql.uc.emu_stop()
+                if timeout != None:
+                    deadline = tm.runing_time + int(timeout * 1000000)
+                select_park(tm.cur_thread)
     except:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
             raise
-    ql.nprint("_newselect(%d, %x, %x, %x, %x) = %d" % (_newselect_nfds, _newselect_readfds, _newselect_writefds, _newselect_exceptfds, _newselect_timeout, regreturn))
+    ql.nprint("_newselect(%d, %x, %x, %x, %x) = %d", _newselect_nfds, _newselect_readfds, _newselect_writefds, _newselect_exceptfds, _newselect_timeout, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1829,31 +1896,36 @@ def ql_syscall_accept(ql, accept_sockfd, accept_addr, accept_addrlen, null0, nul
         for i in tmp[ : : -1]:
             ret += bytes([int(i)])
         return ret
-    try:
-        conn, address = ql.file_des[accept_sockfd].accept()
-        idx = -1
-        for i in range(256):
-            if ql.file_des[i] == 0:
-                idx = i
-                break
-        if idx == -1:
+
+    def accept():
+        try:
+            conn, address = ql.file_des[accept_sockfd].accept()
+            idx = -1
+            for i in range(256):
+                if ql.file_des[i] == 0:
+                    idx = i
+                    break
+            if idx == -1:
+                regreturn = -1
+            else:
+                ql.file_des[idx] = conn
+                regreturn = idx
+
+            if ql.shellcoder == None:    
+                tmp_buf = ql.pack16(conn.family)
+                tmp_buf += ql.pack16(address[1])
+                tmp_buf += inet_addr(address[0])
+                tmp_buf += b'\x00' * 8
+                ql.uc.mem_write(accept_addr, tmp_buf)
+                ql.uc.mem_write(accept_addrlen, ql.pack32(16))
+        except:
+            if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
+                raise
             regreturn = -1
-        else:
-            ql.file_des[idx] = conn
-            regreturn = idx
+        ql.nprint("accep(%d, %x, %x) = %d", accept_sockfd, accept_addr, accept_addrlen, regreturn)
+        return regreturn
 
-        if ql.shellcoder == None:    
-            tmp_buf = ql.pack16(conn.family)
-            tmp_buf += ql.pack16(address[1])
-            tmp_buf += inet_addr(address[0])
-            tmp_buf += b'\x00' * 8
-            ql.uc.mem_write(accept_addr, tmp_buf)
-            ql.uc.mem_write(accept_addrlen, ql.pack32(16))
-    except:
-        if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
-            raise
-        regreturn = -1
-    ql.nprint("accep(%d, %x, %x) = %d" %(accept_sockfd, accept_addr, accept_addrlen, regreturn))
+    regreturn = ql_io_wait(ql, accept_sockfd, selectors.EVENT_READ, accept)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1867,7 +1939,7 @@ def ql_syscall_times(ql, times_tbuf, null0, null1, null2, null3, null4):
         tmp_buf += ql.pack32(int(tmp_times.children_sytem * 1000))
         ql.uc.mem_write(times_tbuf, tmp_buf)
     regreturn = int(tmp_times.elapsed * 100)
-    ql.nprint('times(%x) = %d' % (times_tbuf, regreturn))
+    ql.nprint('times(%x) = %d', times_tbuf, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1881,18 +1953,22 @@ def ql_syscall_gettimeofday(ql, gettimeofday_tv, gettimeofday_tz, null0, null1,
     if gettimeofday_tz != 0:
         ql.uc.mem_write(gettimeofday_tz, b'\x00' * 8)
     regreturn = 0
-    ql.nprint("gettimeofday(%x, %x) = %d" % (gettimeofday_tv, gettimeofday_tz, regreturn))
+    ql.nprint("gettimeofday(%x, %x) = %d", gettimeofday_tv, gettimeofday_tz, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_recv(ql, recv_sockfd, recv_buf, recv_len, recv_flags, null0, null1):
-    if recv_sockfd < 256 and ql.file_des[recv_sockfd] != 0:
-        tmp_buf = ql.file_des[recv_sockfd].recv(recv_len, recv_flags)
-        ql.uc.mem_write(recv_buf, tmp_buf)
-        regreturn = len(tmp_buf)
-    else:
-        regreturn = -1
-    ql.nprint("recv(%d, %x, %d, %x) = %d" % (recv_sockfd, recv_buf, recv_len, recv_flags, regreturn))
+    def recv():
+        if recv_sockfd < 256 and ql.file_des[recv_sockfd] != 0:
+            tmp_buf = ql.file_des[recv_sockfd].recv(recv_len, recv_flags)
+            ql.uc.mem_write(recv_buf, tmp_buf)
+            regreturn = len(tmp_buf)
+        else:
+            regreturn = -1
+        ql.nprint("recv(%d, %x, %d, %x) = %d", recv_sockfd, recv_buf, recv_len, recv_flags, regreturn)
+        return regreturn
+
+    regreturn = ql_io_wait(ql, recv_sockfd, selectors.EVENT_READ, recv)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1917,7 +1993,7 @@ def ql_syscall_send(ql, send_sockfd, send_buf, send_len, send_flags, null0, null
                 raise
     else:
         regreturn = -1
-    ql.nprint("send(%d, %x, %d, %x) = %d" % (send_sockfd, send_buf, send_len, send_flags, regreturn))
+    ql.nprint("send(%d, %x, %d, %x) = %d", send_sockfd, send_buf, send_len, send_flags, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -1962,17 +2038,17 @@ def ql_syscall_socketcall(ql, socketcall_call, socketcall_args, null0, null1, nu
         socketcall_flags = ql.unpack(ql.uc.mem_read(socketcall_args + ql.byte * 3, ql.byte))
         ql_syscall_recv(ql, socketcall_sockfd, socketcall_buf, socketcall_len, socketcall_flags, 0, 0)
     else:
-        ql.dprint("[!] error call %d" % socketcall_call)
+        ql.dprint("[!] error call %d", socketcall_call)
         ql.stop(stop_event = THREAD_EVENT_UNEXECPT_EVENT)
 
 def ql_syscall_signal(ql, sig, __sighandler_t, null0, null1, null2, null3):
     regreturn = 0
-    ql.nprint("signal(%d, 0x%x) = %d" % (sig, __sighandler_t,regreturn))
+    ql.nprint("signal(%d, 0x%x) = %d", sig, __sighandler_t, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 def ql_syscall_ptrace(ql, request, pid, addr, data, null0, null1):
     regreturn = 0
-    ql.nprint("ptrace(0x%x, 0x%x, 0x%x, 0x%x) = %d" % (request, pid, addr, data, regreturn))
+    ql.nprint("ptrace(0x%x, 0x%x, 0x%x, 0x%x) = %d", request, pid, addr, data, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 def ql_syscall_clone(ql, clone_flags, clone_child_stack, clone_parent_tidptr, clone_newtls, clone_child_tidptr, null0):
@@ -2011,7 +2087,7 @@ def ql_syscall_clone(ql, clone_flags, clone_child_stack, clone_parent_tidptr, cl
         pid = os.fork()
         if pid != 0:
             regreturn = pid
-            ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d" % (clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn))
+            ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d", clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn)
             ql_definesyscall_return(ql, regreturn)
         else:
             ql.child_processes = True
@@ -2033,7 +2109,7 @@ def ql_syscall_clone(ql, clone_flags, clone_child_stack, clone_parent_tidptr, cl
             if clone_child_stack != 0:
                 ql.archfunc.set_sp(clone_child_stack)
             regreturn = 0
-            ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d" % (clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn))
+            ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d", clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn)
             ql_definesyscall_return(ql, regreturn)
         ql.uc.emu_stop()
         return
@@ -2067,8 +2143,8 @@ def ql_syscall_clone(ql, clone_flags, clone_child_stack, clone_parent_tidptr, cl
     th.save()
 
     ql.thread_management.cur_thread = th
-    ql.dprint("[+] Currently running pid is: %d; tid is: %d " % (os.getpid() ,ql.thread_management.cur_thread.get_thread_id()))
-    ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d" % (clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn))
+    ql.dprint("[+] Currently running pid is: %d; tid is: %d ", os.getpid(), ql.thread_management.cur_thread.get_thread_id())
+    ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d", clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn)
 
     # Restore the stack and return value of the parent process
     ql.archfunc.set_sp(f_sp)
@@ -2081,8 +2157,8 @@ def ql_syscall_clone(ql, clone_flags, clone_child_stack, clone_parent_tidptr, cl
     f_th.stop_return_val = th
 
     ql.thread_management.cur_thread = f_th
-    ql.dprint("[+] Currently running pid is: %d; tid is: %d " % (os.getpid() ,ql.thread_management.cur_thread.get_thread_id()))
-    ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d" % (clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn))
+    ql.dprint("[+] Currently running pid is: %d; tid is: %d ", os.getpid(), ql.thread_management.cur_thread.get_thread_id())
+    ql.nprint("clone(new_stack = %x, flags = %x, tls = %x, ptidptr = %x, ctidptr = %x) = %d", clone_child_stack, clone_flags, clone_newtls, clone_parent_tidptr, clone_child_tidptr, regreturn)
 
 
 def ql_syscall_set_tid_address(ql, set_tid_address_tidptr, null0, null1, null2, null3, null4):
@@ -2091,7 +2167,7 @@ def ql_syscall_set_tid_address(ql, set_tid_address_tidptr, null0, null1, null2,
     else:
         ql.thread_management.cur_thread.set_clear_child_tid_addr(set_tid_address_tidptr)
         regreturn = ql.thread_management.cur_thread.get_thread_id()
-    ql.nprint("set_tid_address(%x) = %d" % (set_tid_address_tidptr, regreturn))
+    ql.nprint("set_tid_address(%x) = %d", set_tid_address_tidptr, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2102,7 +2178,7 @@ def ql_syscall_set_robust_list(ql, set_robust_list_head_ptr, set_robust_list_hea
         ql.thread_management.cur_thread.robust_list_head_ptr = set_robust_list_head_ptr
         ql.thread_management.cur_thread.robust_list_head_len = set_robust_list_head_len
     regreturn = 0
-    ql.nprint("set_robust_list(%x, %x) = %d"%(set_robust_list_head_ptr, set_robust_list_head_len, regreturn))
+    ql.nprint("set_robust_list(%x, %x) = %d", set_robust_list_head_ptr, set_robust_list_head_len, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2121,28 +2197,123 @@ def ql_syscall_futex(ql, futex_uaddr, futex_op, futex_val, futex_timeout, futex_
     FUTEX_WAIT_REQUEUE_PI = 11
     FUTEX_CMP_REQUEUE_PI = 12
     FUTEX_PRIVATE_FLAG = 128
+    FUTEX_CLOCK_REALTIME = 256
 
-    if futex_op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAIT:
-        def futex_wait_addr(ql, th, arg):
-            addr, val = arg
-            if ql.unpack32(ql.uc.mem_read(addr, 4)) != val:
-                return False
+    EAGAIN = 11
+    EINVAL = 22
+    ENOSYS = 38
+    ETIMEDOUT = 110
+
+    def futex_load(addr):
+        return ql.unpack32s(ql.uc.mem_read(addr, 4))
+
+    def futex_expire(th, events):
+        ql.thread_management.futex_cancel(th)
+        th.set_syscall_return(-ETIMEDOUT)
+
+    tm = ql.thread_management
+    cmd = futex_op & ~(FUTEX_PRIVATE_FLAG | FUTEX_CLOCK_REALTIME)
+
+    if cmd in (FUTEX_WAIT, FUTEX_WAIT_BITSET):
+        bitset = futex_val3 if cmd == FUTEX_WAIT_BITSET else FUTEX_BITSET_MATCH_ANY
+        if bitset == 0:
+            regreturn = -EINVAL
+        elif futex_load(futex_uaddr) != ql.unpack32s(ql.pack32(futex_val & 0xffffffff)):
+            regreturn = -EAGAIN
+        else:
+            timeout = None
+            if futex_timeout != 0:
+                n = ql.archbit // 8
+                tv_sec = ql.unpack(ql.uc.mem_read(futex_timeout, n))
+                tv_nsec = ql.unpack(ql.uc.mem_read(futex_timeout + n, n))
+                timeout = tv_sec * 1000000 + tv_nsec // 1000
+                if cmd == FUTEX_WAIT_BITSET:
+                    # absolute and host-timed: the guest reads the host clocks (gettimeofday),
+                    # so what is left of it now is waited for on the scheduler clock like
+                    # a relative FUTEX_WAIT timeout. with the guest running slower than the
+                    # host it expires later than the host deadline
+                    now = time.time() if futex_op & FUTEX_CLOCK_REALTIME else time.monotonic()
+                    timeout = max(timeout - int(now * 1000000), 0)
+
+            regreturn = 0
+            if tm == None:
+                # no other thread to wake us up
+                if timeout is not None:
+                    time.sleep(timeout / 1000000)
+                    regreturn = -ETIMEDOUT
             else:
-                return True
-        ql.uc.emu_stop()
-        ql.thread_management.cur_thread.blocking()
-        ql.thread_management.cur_thread.set_blocking_condition(futex_wait_addr, [futex_uaddr, futex_val])
-        regreturn = 0
-        ql.nprint("futex(%x, %d, %d, %x) = %d" % (futex_uaddr, futex_op, futex_val, futex_timeout, regreturn))
-    elif futex_op & (FUTEX_PRIVATE_FLAG - 1) == FUTEX_WAKE:
-        regreturn = 0
-        ql.nprint("futex(%x, %d, %d) = %d" % (futex_uaddr, futex_op, futex_val, regreturn))
+                ql.uc.emu_stop()
+                th = tm.cur_thread
+                # woken up through ThreadManagement.futex_wake, or the timeout
+                tm.futex_wait(th, futex_uaddr, bitset)
+                if timeout is not None:
+                    tm.wait_until(th, tm.runing_time + timeout, futex_expire)
+        ql.nprint("futex(%x, %d, %d, %x) = %d", futex_uaddr, futex_op, futex_val, futex_timeout, regreturn)
+
+    elif cmd in (FUTEX_WAKE, FUTEX_WAKE_BITSET):
+        bitset = futex_val3 if cmd == FUTEX_WAKE_BITSET else FUTEX_BITSET_MATCH_ANY
+        if bitset == 0:
+            regreturn = -EINVAL
+        else:
+            regreturn = tm.futex_wake(futex_uaddr, futex_val, bitset) if tm != None else 0
+        ql.nprint("futex(%x, %d, %d) = %d", futex_uaddr, futex_op, futex_val, regreturn)
+
+    elif cmd in (FUTEX_REQUEUE, FUTEX_CMP_REQUEUE):
+        # the timeout argument carries the number of waiters to requeue
+        if cmd == FUTEX_CMP_REQUEUE and futex_load(futex_uaddr) != ql.unpack32s(ql.pack32(futex_val3 & 0xffffffff)):
+            regreturn = -EAGAIN
+        elif tm == None:
+            regreturn = 0
+        else:
+            woken, requeued = tm.futex_requeue(futex_uaddr, futex_uaddr2, futex_val, futex_timeout)
+            regreturn = woken + requeued if cmd == FUTEX_CMP_REQUEUE else woken
+        ql.nprint("futex(%x, %d, %d, %d, %x) = %d", futex_uaddr, futex_op, futex_val, futex_timeout, futex_uaddr2, regreturn)
+
+    elif cmd == FUTEX_WAKE_OP:
+        # val3 encodes: op (bit 31 shifts oparg), cmp, oparg, cmparg
+        def sign_extend12(v):
+            return v - 0x1000 if v & 0x800 else v
+
+        op = (futex_val3 >> 28) & 0xf
+        cmp = (futex_val3 >> 24) & 0xf
+        oparg = sign_extend12((futex_val3 >> 12) & 0xfff)
+        cmparg = sign_extend12(futex_val3 & 0xfff)
+        if op & 8:
+            oparg = 1 << (oparg & 31)
+            op &= 7
+
+        oldval = futex_load(futex_uaddr2)
+        newval = {
+            0: lambda: oparg,
+            1: lambda: oldval + oparg,
+            2: lambda: oldval | oparg,
+            3: lambda: oldval & ~oparg,
+            4: lambda: oldval ^ oparg,
+            }.get(op, lambda: None)()
+        cond = {
+            0: oldval == cmparg,
+            1: oldval != cmparg,
+            2: oldval < cmparg,
+            3: oldval <= cmparg,
+            4: oldval > cmparg,
+            5: oldval >= cmparg,
+            }.get(cmp, None)
+
+        if newval is None or cond is None:
+            regreturn = -ENOSYS
+        else:
+            ql.uc.mem_write(futex_uaddr2, ql.pack32(newval & 0xffffffff))
+            regreturn = 0
+            if tm != None:
+                regreturn = tm.futex_wake(futex_uaddr, futex_val)
+                if cond:
+                    regreturn += tm.futex_wake(futex_uaddr2, futex_timeout)
+        ql.nprint("futex(%x, %d, %d, %d, %x, %x) = %d", futex_uaddr, futex_op, futex_val, futex_timeout, futex_uaddr2, futex_val3, regreturn)
+
     else:
-        ql.nprint("futex(%x, %d, %d) = ?" % (futex_uaddr, futex_op, futex_val))
-        ql.uc.emu_stop()
-        ql.thread_management.cur_thread.stop()
-        ql.thread_management.cur_thread.stop_event = THREAD_EVENT_EXIT_GROUP_EVENT
-        regreturn = 0
+        # FUTEX_FD and the priority inheritance ops are not there
+        regreturn = -ENOSYS
+        ql.nprint("futex(%x, %d, %d) = %d", futex_uaddr, futex_op, futex_val, regreturn)
 
     ql_definesyscall_return(ql, regreturn)
 
@@ -2150,7 +2321,7 @@ def ql_syscall_futex(ql, futex_uaddr, futex_op, futex_val, futex_timeout, futex_
 def ql_syscall_gettid(ql, null0, null1, null2, null3, null4, null5):
     th = ql.thread_management.cur_thread
     regreturn = th.get_thread_id()    
-    ql.nprint("gettid() = %d" % regreturn)
+    ql.nprint("gettid() = %d", regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2182,20 +2353,20 @@ def ql_syscall_pipe(ql, pipe_pipefd, null0, null1, null2, null3, null4):
                 ql.uc.mem_write(pipe_pipefd, ql.pack32(idx1) + ql.pack32(idx2))
                 regreturn = 0
 
-    ql.nprint("pipe(%x, [%d, %d]) = %d" % (pipe_pipefd, idx1, idx2, regreturn))
+    ql.nprint("pipe(%x, [%d, %d]) = %d", pipe_pipefd, idx1, idx2, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_nice(ql, nice_inc, null0, null1, null2, null3, null4):
     regreturn = 0
-    ql.nprint("nice(%d) = %d" % (nice_inc, regreturn))
+    ql.nprint("nice(%d) = %d", nice_inc, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
 def ql_syscall_getpriority(ql, getpriority_which, getpriority_who, null1, null2, null3, null4):
     base = os.getpriority(getpriority_which, getpriority_who)
     regreturn = base
-    ql.nprint("getpriority(0x%x, 0x%x) = %d" % (getpriority_which, getpriority_who, regreturn))
+    ql.nprint("getpriority(0x%x, 0x%x) = %d", getpriority_which, getpriority_who, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2207,7 +2378,7 @@ def ql_syscall_sendfile64(ql, sendfile64_out_fd, sendfile64_in_fd, sendfile64_of
     else:
         regreturn = -1
 
-    ql.nprint("sendfile64(%d, %d, %x, %d) = %d" % (sendfile64_out_fd, sendfile64_in_fd, sendfile64_offest, sendfile64_count, regreturn))
+    ql.nprint("sendfile64(%d, %d, %x, %d) = %d", sendfile64_out_fd, sendfile64_in_fd, sendfile64_offest, sendfile64_count, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2229,7 +2400,7 @@ def ql_syscall_truncate(ql, path, length, null0, null1, null2, null3):
     except:
         regreturn = -1
 
-    ql.nprint('truncate(%s, 0x%x) = %d' % (path, length, regreturn))
+    ql.nprint('truncate(%s, 0x%x) = %d', path, length, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2251,7 +2422,7 @@ def ql_syscall_ftruncate(ql, ftrunc_fd, ftrunc_length, null0, null1, null2, null
     except:
         regreturn = -1
 
-    ql.nprint('ftruncate(%d, 0x%x) = %d' % (ftrunc_fd, ftrunc_length, regreturn))
+    ql.nprint('ftruncate(%d, 0x%x) = %d', ftrunc_fd, ftrunc_length, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2273,7 +2444,7 @@ def ql_syscall_unlink(ql, unlink_pathname, null0, null1, null2, null3, null4):
     else:
         regreturn = -1
 
-    ql.nprint('unlink(%s) = %d' % (pathname, regreturn))
+    ql.nprint('unlink(%s) = %d', pathname, regreturn)
     ql_definesyscall_return(ql, regreturn)
 
 
@@ -2281,7 +2452,7 @@ def ql_syscall_unlinkat(ql, dirfd, pathname, flag, null0, null1, null2):
     # fix me. dirfd(relative path) not implement.
     file_path = ql_read_string(ql, pathname)
     real_path = ql_transform_to_real_path(ql, file_path)
-    ql.nprint("unlinkat(%d, %s, 0%o)" % (dirfd, real_path, flag))
+    ql.nprint("unlinkat(%d, %s, 0%o)", dirfd, real_path, flag)
     try:
         os.unlink(real_path)
         regreturn = 0
@@ -2297,7 +2468,7 @@ def ql_syscall_mknodat(ql, dirfd, pathname, mode, dev, null0, null1):
     # fix me. dirfd(relative path) not implement.
     file_path = ql_read_string(ql, pathname)
     real_path = ql_transform_to_real_path(ql, file_path)
-    ql.nprint("mknodat(%d, %s, 0%o, %d)" % (dirfd, real_path, mode, dev))
+    ql.nprint("mknodat(%d, %s, 0%o, %d)", dirfd, real_path, mode, dev)
     try:
         os.mknod(real_path, mode, dev)
         regreturn = 0
@@ -2308,6 +2479,6 @@ def ql_syscall_mknodat(ql, dirfd, pathname, mode, dev, null0, null1):
 
 def ql_syscall_umask(ql, mode, null0, null1, null2, null3, null4):
     oldmask = os.umask(mode)
-    ql.nprint("umask(0%o) return oldmask 0%o" % (mode, oldmask))
+    ql.nprint("umask(0%o) return oldmask 0%o", mode, oldmask)
     regreturn = oldmask
     ql_definesyscall_return(ql, regreturn)
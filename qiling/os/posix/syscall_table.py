@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+import dis
+
+# every posix syscall handler takes (ql, param0 ... param5)
+QL_SYSCALL_MAX_PARAMS = 6
+
+_argc_cache = {}
+
+
+def ql_syscall_argc(func):
+    """
+    number of leading syscall parameters the handler actually reads,
+    so hook_syscall does not need to fetch all six registers every time
+    """
+    argc = _argc_cache.get(func, None)
+    if argc is not None:
+        return argc
+
+    try:
+        code = func.__code__
+    except AttributeError:
+        return QL_SYSCALL_MAX_PARAMS
+
+    if code.co_flags & (0x04 | 0x08):  # CO_VARARGS | CO_VARKEYWORDS
+        argc = QL_SYSCALL_MAX_PARAMS
+    else:
+        params = code.co_varnames[1 : code.co_argcount]
+        used = set(code.co_cellvars)
+        for insn in dis.get_instructions(code):
+            if isinstance(insn.argval, tuple):
+                used.update(insn.argval)
+            elif isinstance(insn.argval, str):
+                used.add(insn.argval)
+        argc = 0
+        for idx, name in enumerate(params[ : QL_SYSCALL_MAX_PARAMS]):
+            if name in used:
+                argc = idx + 1
+
+    _argc_cache[func] = argc
+    return argc
+
+
+def ql_syscall_reg_reader(*regs):
+    # build an argument reader fetching the first argc registers only
+    def reader(ql, argc):
+        reg_read = ql.uc.reg_read
+        return [reg_read(reg) for reg in regs[ : argc]]
+    return reader
+
+
+class SyscallEntry:
+    __slots__ = ("func", "name", "argc")
+
+    def __init__(self, func, name):
+        self.func = func
+        self.name = name
+        self.argc = ql_syscall_argc(func)
+
+
+class SyscallTable:
+    """
+    syscall number -> resolved handler, built once by the loader
+
+    syscall_map is one of the dict_*_syscall tables, namespace is the globals() of
+    the os/arch module that used to eval() the handler names
+    """
+    def __init__(self, ql, syscall_map, namespace, read_args):
+        self.ql = ql
+        self.read_args = read_args
+        self.entries = {}
+        self.pre_hooks = []
+        self.post_hooks = []
+        self.call = self.__call_direct
+
+        for num, name in syscall_map.items():
+            func = namespace.get(name, None)
+            if func is not None:
+                self.entries[num] = SyscallEntry(func, name)
+
+        # syscalls overridden by the user before the table existed
+        for num, func in ql.dict_posix_syscall.items():
+            self.set(num, func)
+
+    def get(self, syscall_num):
+        return self.entries.get(syscall_num, None)
+
+    def set(self, syscall_num, func):
+        self.entries[syscall_num] = SyscallEntry(func, func.__name__)
+
+    def hook_pre(self, callback):
+        # callback(ql, syscall_num, params) before the handler runs
+        self.pre_hooks.append(callback)
+        self.call = self.__call_hooked
+
+    def hook_post(self, callback):
+        # callback(ql, syscall_num, params) after the handler returned
+        self.post_hooks.append(callback)
+        self.call = self.__call_hooked
+
+    def unhook(self, callback):
+        if callback in self.pre_hooks:
+            self.pre_hooks.remove(callback)
+        if callback in self.post_hooks:
+            self.post_hooks.remove(callback)
+        if not self.pre_hooks and not self.post_hooks:
+            self.call = self.__call_direct
+
+    def params(self, entry):
+        params = self.read_args(self.ql, entry.argc)
+        if entry.argc < QL_SYSCALL_MAX_PARAMS:
+            params += [0] * (QL_SYSCALL_MAX_PARAMS - entry.argc)
+        return params
+
+    def __call_direct(self, entry, syscall_num):
+        entry.func(self.ql, *self.params(entry))
+
+    def __call_hooked(self, entry, syscall_num):
+        ql = self.ql
+        params = self.params(entry)
+        for callback in self.pre_hooks:
+            callback(ql, syscall_num, params)
+        entry.func(ql, *params)
+        for callback in self.post_hooks:
+            callback(ql, syscall_num, params)
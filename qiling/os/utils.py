@@ -70,15 +70,7 @@ def ql_bin_to_ip(ip):
 
 
 def ql_read_string(ql, address):
-    ret = ""
-    c = ql.uc.mem_read(address, 1)[0]
-    read_bytes = 1
-
-    while c != 0x0:
-        ret += chr(c)
-        c = ql.uc.mem_read(address + read_bytes, 1)[0]
-        read_bytes += 1
-    return ret
+    return ql.mem.read_cstr(address, "latin-1")
 
 
 def ql_parse_sock_address(sock_addr):
@@ -92,103 +84,162 @@ def ql_parse_sock_address(sock_addr):
 
 
 def ql_hook_block_disasm(ql, address, size):
-    ql.nprint("[+] Tracing basic block at 0x%x\n" % (address))
-
-
-def ql_hook_code_disasm(ql, address, size):
-    uc = ql.uc
-    tmp = uc.mem_read(address, size)
-
-    if (ql.arch == QL_ARM):  # QL_ARM
-        reg_cpsr = uc.reg_read(UC_ARM_REG_CPSR)
-        mode = CS_MODE_ARM
-        # ql.nprint("cpsr : " + bin(reg_cpsr))
-        if reg_cpsr & 0b100000 != 0:
-            mode = CS_MODE_THUMB
-        md = Cs(CS_ARCH_ARM, mode)
-        syscall_num = [uc.reg_read(UC_ARM_REG_R7), "R7"]
-        arg_0 = [uc.reg_read(UC_ARM_REG_R0), "R0"]
-        arg_1 = [uc.reg_read(UC_ARM_REG_R1), "R1"]
-        arg_2 = [uc.reg_read(UC_ARM_REG_R2), "R2"]
-        arg_3 = [uc.reg_read(UC_ARM_REG_R3), "R3"]
-        arg_4 = [uc.reg_read(UC_ARM_REG_R4), "R4"]
-        arg_5 = [uc.reg_read(UC_ARM_REG_R5), "R5"]
-
-    elif (ql.arch == QL_X86):  # QL_X86
-        md = Cs(CS_ARCH_X86, CS_MODE_32)
-        if ql.ostype == QL_MACOS:
-            syscall_num = [uc.reg_read(UC_X86_REG_EAX), "EAX"]
-            arg_0 = [uc.reg_read(UC_X86_REG_ESP + 4 * 1), "ESP_1"]
-            arg_1 = [uc.reg_read(UC_X86_REG_ESP + 4 * 2), "ESP_2"]
-            arg_2 = [uc.reg_read(UC_X86_REG_ESP + 4 * 3), "ESP_3"]
-            arg_3 = [uc.reg_read(UC_X86_REG_ESP + 4 * 4), "ESP_4"]
-            arg_4 = [uc.reg_read(UC_X86_REG_ESP + 4 * 5), "ESP_5"]
-            arg_5 = [uc.reg_read(UC_X86_REG_ESP + 4 * 6), "ESP_6"]
-        else:
-            syscall_num = [uc.reg_read(UC_X86_REG_EAX), "EAX"]
-            arg_0 = [uc.reg_read(UC_X86_REG_EBX), "EBX"]
-            arg_1 = [uc.reg_read(UC_X86_REG_ECX), "ECX"]
-            arg_2 = [uc.reg_read(UC_X86_REG_EDX), "EDX"]
-            arg_3 = [uc.reg_read(UC_X86_REG_ESI), "ESI"]
-            arg_4 = [uc.reg_read(UC_X86_REG_EDI), "EDI"]
-            arg_5 = [uc.reg_read(UC_X86_REG_EBP), "EBP"]
-
-    elif (ql.arch == QL_X8664):  # QL_X86_64
-        md = Cs(CS_ARCH_X86, CS_MODE_64)
-        syscall_num = [uc.reg_read(UC_X86_REG_RAX), "RAX"]
-        arg_0 = [uc.reg_read(UC_X86_REG_RDI), "RDI"]
-        arg_1 = [uc.reg_read(UC_X86_REG_RSI), "RSI"]
-        arg_2 = [uc.reg_read(UC_X86_REG_RDX), "RDX"]
-        arg_3 = [uc.reg_read(UC_X86_REG_R10), "R10"]
-        arg_4 = [uc.reg_read(UC_X86_REG_R8), "R8"]
-        arg_5 = [uc.reg_read(UC_X86_REG_R9), "R9"]
-
-    elif (ql.arch == QL_ARM64):  # QL_ARM64
-        md = Cs(CS_ARCH_ARM64, CS_MODE_ARM)
-        syscall_num = [uc.reg_read(UC_ARM64_REG_X0), "X7"]
-        arg_0 = [uc.reg_read(UC_ARM64_REG_X0), "X0"]
-        arg_1 = [uc.reg_read(UC_ARM64_REG_X1), "X1"]
-        arg_2 = [uc.reg_read(UC_ARM64_REG_X2), "X2"]
-        arg_3 = [uc.reg_read(UC_ARM64_REG_X3), "X3"]
-        arg_4 = [uc.reg_read(UC_ARM64_REG_X4), "X4"]
-        arg_5 = [uc.reg_read(UC_ARM64_REG_X5), "X5"]
-
-    elif (ql.arch == QL_MIPS32):  # QL_MIPS32
+    ql.nprint("[+] Tracing basic block at 0x%x\n", address)
+
+
+# (arch, mode) -> Cs, building a capstone engine is far more expensive than using it
+_disasm_engines = {}
+
+# (mode, address, code) -> formatted trace line, cleared once it grows past the limit
+_disasm_cache = {}
+QL_DISASM_CACHE_SIZE = 0x10000
+
+# registers shown in dump mode: (register, name, offset added to the value)
+_dump_regs_arm = (
+    (UC_ARM_REG_R7, "R7", 0),
+    (UC_ARM_REG_R0, "R0", 0),
+    (UC_ARM_REG_R1, "R1", 0),
+    (UC_ARM_REG_R2, "R2", 0),
+    (UC_ARM_REG_R3, "R3", 0),
+    (UC_ARM_REG_R4, "R4", 0),
+    (UC_ARM_REG_R5, "R5", 0),
+)
+
+_dump_regs_x86 = (
+    (UC_X86_REG_EAX, "EAX", 0),
+    (UC_X86_REG_EBX, "EBX", 0),
+    (UC_X86_REG_ECX, "ECX", 0),
+    (UC_X86_REG_EDX, "EDX", 0),
+    (UC_X86_REG_ESI, "ESI", 0),
+    (UC_X86_REG_EDI, "EDI", 0),
+    (UC_X86_REG_EBP, "EBP", 0),
+)
+
+_dump_regs_x86_macos = (
+    (UC_X86_REG_EAX, "EAX", 0),
+    (UC_X86_REG_ESP + 4 * 1, "ESP_1", 0),
+    (UC_X86_REG_ESP + 4 * 2, "ESP_2", 0),
+    (UC_X86_REG_ESP + 4 * 3, "ESP_3", 0),
+    (UC_X86_REG_ESP + 4 * 4, "ESP_4", 0),
+    (UC_X86_REG_ESP + 4 * 5, "ESP_5", 0),
+    (UC_X86_REG_ESP + 4 * 6, "ESP_6", 0),
+)
+
+_dump_regs_x8664 = (
+    (UC_X86_REG_RAX, "RAX", 0),
+    (UC_X86_REG_RDI, "RDI", 0),
+    (UC_X86_REG_RSI, "RSI", 0),
+    (UC_X86_REG_RDX, "RDX", 0),
+    (UC_X86_REG_R10, "R10", 0),
+    (UC_X86_REG_R8, "R8", 0),
+    (UC_X86_REG_R9, "R9", 0),
+)
+
+_dump_regs_arm64 = (
+    (UC_ARM64_REG_X0, "X7", 0),
+    (UC_ARM64_REG_X0, "X0", 0),
+    (UC_ARM64_REG_X1, "X1", 0),
+    (UC_ARM64_REG_X2, "X2", 0),
+    (UC_ARM64_REG_X3, "X3", 0),
+    (UC_ARM64_REG_X4, "X4", 0),
+    (UC_ARM64_REG_X5, "X5", 0),
+)
+
+_dump_regs_mips32 = (
+    (UC_MIPS_REG_V0, "V0", 0),
+    (UC_MIPS_REG_A0, "A0", 0),
+    (UC_MIPS_REG_A1, "A1", 0),
+    (UC_MIPS_REG_A2, "A2", 0),
+    (UC_MIPS_REG_A3, "A3", 0),
+    (UC_MIPS_REG_SP, "SP+0x10", 0x10),
+    (UC_MIPS_REG_SP, "SP+0x14", 0x14),
+)
+
+
+def ql_get_disassembler(arch, mode):
+    md = _disasm_engines.get((arch, mode), None)
+    if md is None:
+        md = Cs(arch, mode)
+        _disasm_engines[(arch, mode)] = md
+    return md
+
+
+def ql_disasm_mode(ql):
+    """
+    capstone (arch, mode) for the code currently running, ARM switches to thumb with CPSR
+    """
+    if ql.arch == QL_ARM:
+        if ql.uc.reg_read(UC_ARM_REG_CPSR) & 0b100000 != 0:
+            return CS_ARCH_ARM, CS_MODE_THUMB
+        return CS_ARCH_ARM, CS_MODE_ARM
+    elif ql.arch == QL_X86:
+        return CS_ARCH_X86, CS_MODE_32
+    elif ql.arch == QL_X8664:
+        return CS_ARCH_X86, CS_MODE_64
+    elif ql.arch == QL_ARM64:
+        return CS_ARCH_ARM64, CS_MODE_ARM
+    elif ql.arch == QL_MIPS32:
         if ql.archendian == QL_ENDIAN_EB:
-            md = Cs(CS_ARCH_MIPS, CS_MODE_MIPS32 + CS_MODE_BIG_ENDIAN)
-        else:
-            md = Cs(CS_ARCH_MIPS, CS_MODE_MIPS32 + CS_MODE_LITTLE_ENDIAN)
-        syscall_num = [uc.reg_read(UC_MIPS_REG_V0), "V0"]
-        arg_0 = [uc.reg_read(UC_MIPS_REG_A0), "A0"]
-        arg_1 = [uc.reg_read(UC_MIPS_REG_A1), "A1"]
-        arg_2 = [uc.reg_read(UC_MIPS_REG_A2), "A2"]
-        arg_3 = [uc.reg_read(UC_MIPS_REG_A3), "A3"]
-        arg_4 = uc.reg_read(UC_MIPS_REG_SP)
-        arg_4 = [arg_4 + 0x10, "SP+0x10"]
-        arg_5 = uc.reg_read(UC_MIPS_REG_SP)
-        arg_5 = [arg_5 + 0x14, "SP+0x14"]
-
-    else:
-        raise QlErrorArch("[!] Unknown arch defined in utils.py (debug output mode)")
+            return CS_ARCH_MIPS, CS_MODE_MIPS32 + CS_MODE_BIG_ENDIAN
+        return CS_ARCH_MIPS, CS_MODE_MIPS32 + CS_MODE_LITTLE_ENDIAN
+    raise QlErrorArch("[!] Unknown arch defined in utils.py (debug output mode)")
 
-    insn = md.disasm(tmp, address)
-    opsize = int(size)
 
-    ql.nprint("[+] 0x%x\t" % (address))
-
-    for i in tmp:
-        ql.nprint(" %02x" % i)
+def ql_dump_regs(ql):
+    if ql.arch == QL_ARM:
+        return _dump_regs_arm
+    elif ql.arch == QL_X86:
+        if ql.ostype == QL_MACOS:
+            return _dump_regs_x86_macos
+        return _dump_regs_x86
+    elif ql.arch == QL_X8664:
+        return _dump_regs_x8664
+    elif ql.arch == QL_ARM64:
+        return _dump_regs_arm64
+    elif ql.arch == QL_MIPS32:
+        return _dump_regs_mips32
+    raise QlErrorArch("[!] Unknown arch defined in utils.py (debug output mode)")
+
+
+def ql_disasm_line(ql, address, size):
+    """
+    one formatted trace line for the instruction at address, decoded once per address and bytes
+    """
+    mode = ql_disasm_mode(ql)
+    tmp = bytes(ql.uc.mem_read(address, size))
+    key = (mode, address, tmp)
+
+    line = _disasm_cache.get(key, None)
+    if line is not None:
+        return line
+
+    md = ql_get_disassembler(*mode)
+    out = ["[+] 0x%x\t" % (address)]
+    out.extend(" %02x" % i for i in tmp)
+
+    if size < 4:
+        out.append("\t  ")
+
+    for i in md.disasm(tmp, address):
+        out.append('\t%s \t%s\n' % (i.mnemonic, i.op_str))
+
+    line = "".join(out)
+    if len(_disasm_cache) >= QL_DISASM_CACHE_SIZE:
+        _disasm_cache.clear()
+    _disasm_cache[key] = line
+    return line
 
-    if opsize < 4:
-        ql.nprint("\t  ")
 
-    for i in insn:
-        ql.nprint('\t%s \t%s\n' % (i.mnemonic, i.op_str))
+def ql_hook_code_disasm(ql, address, size):
+    line = ql_disasm_line(ql, address, int(size))
 
     if ql.output == QL_OUT_DUMP:
-        ql.nprint("[-] %s= 0x%x %s= 0x%x %s= 0x%x %s= 0x%x %s= 0x%x %s= 0x%x %s= 0x%x\n" % \
-                  (syscall_num[1], syscall_num[0], arg_0[1], arg_0[0], arg_1[1], arg_1[0], arg_2[1], arg_2[0], arg_3[1],
-                   arg_3[0], arg_4[1], arg_4[0], arg_5[1], arg_5[0]))
+        reg_read = ql.uc.reg_read
+        regs = ql_dump_regs(ql)
+        line += "[-] " + " ".join("%s= 0x%x" % (name, reg_read(reg) + offset) for reg, name, offset in regs) + "\n"
+
+    # one write per instruction
+    ql.nprint(line)
 
 
 def ql_setup_output(ql):
@@ -466,6 +517,8 @@ def ql_open_flag_mapping(flags, ql):
 
 
 def print_function(ql, address, function_name, params, ret):
+    if ql.output == QL_OUT_OFF:
+        return
     function_name = function_name.replace('hook_', '')
     if function_name in ("__stdio_common_vfprintf", "printf"):
         return
@@ -484,10 +537,4 @@ def print_function(ql, address, function_name, params, ret):
 
 
 def read_cstring(ql, address):
-    result = ""
-    char = ql.uc.mem_read(address, 1)
-    while char.decode("utf-8", "backslashreplace") != "\x00":
-        address += 1
-        result += char.decode("utf-8", "backslashreplace")
-        char = ql.uc.mem_read(address, 1)
-    return result
+    return ql.mem.read_cstr(address)
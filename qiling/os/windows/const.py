@@ -98,6 +98,9 @@ RTL_QUERY_ACTIVATION_CONTEXT_FLAG_USE_ACTIVE_ACTIVATION_CONTEXT = 0x01
 RTL_QUERY_ACTIVATION_CONTEXT_FLAG_IS_HMODULE = 0x02
 RTL_QUERY_ACTIVATION_CONTEXT_FLAG_IS_ADDRESS = 0x04
 RTL_QUERY_ACTIVATION_CONTEXT_FLAG_NO_ADDREF = 0x80000000
+HEAP_NO_SERIALIZE = 0x00000001
+HEAP_GENERATE_EXCEPTIONS = 0x00000004
+HEAP_ZERO_MEMORY = 0x00000008
 HEAP_SETTABLE_USER_VALUE = 0x00000100
 HEAP_SETTABLE_USER_FLAG1 = 0x00000200
 HEAP_SETTABLE_USER_FLAG2 = 0x00000400
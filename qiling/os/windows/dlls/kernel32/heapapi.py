@@ -9,11 +9,47 @@ from qiling.os.windows.const import *
 from qiling.os.fncc import *
 from qiling.os.windows.fncc import *
 from qiling.os.windows.utils import *
-from qiling.os.memory import align
+from qiling.os.memory import align, Heap
 from qiling.os.windows.thread import *
 from qiling.os.windows.handle import *
 from qiling.exception import *
 
+# arena of a growable HeapCreate heap, HeapAlloc falls back to the process heap past it
+HEAP_ARENA_SIZE = 0x10000
+
+
+def _get_heap(ql, handle):
+    return ql.heaps.get(handle, ql.heap)
+
+
+def _heap_create(ql, initial_size, maximum_size):
+    # a heap with a maximum size is fixed, HeapAlloc fails once it is full
+    growable = maximum_size == 0
+    size = max(initial_size, HEAP_ARENA_SIZE) if growable else maximum_size
+    size = align(size, ql.heap.page_size)
+
+    # the arena is carved out of the process heap, the handle is its base like on windows
+    base = ql.heap.mem_alloc(size)
+    if base == 0:
+        return 0
+    ql.heaps[base] = Heap(ql, base, base + size, mapped=True, growable=growable)
+    return base
+
+
+def _heap_alloc(ql, handle, flags, size):
+    heap = _get_heap(ql, handle)
+    ret = heap.mem_alloc(size)
+    if ret == 0 and heap.growable and heap is not ql.heap:
+        ret = ql.heap.mem_alloc(size)
+    if ret != 0 and flags & HEAP_ZERO_MEMORY:
+        ql.uc.mem_write(ret, b'\x00' * size)
+    return ret
+
+
+def _heap_fallback(ql, heap):
+    # what a growable heap handed out past its arena came from the process heap
+    return ql.heap if heap.growable and heap is not ql.heap else None
+
 
 # HANDLE HeapCreate(
 #   DWORD  flOptions,
@@ -26,9 +62,21 @@ from qiling.exception import *
     "dwMaximumSize": SIZE_T
 })
 def hook_HeapCreate(ql, address, params):
-    dwInitialSize = params["dwInitialSize"]
-    addr = ql.heap.mem_alloc(dwInitialSize)
-    return addr
+    return _heap_create(ql, params["dwInitialSize"], params["dwMaximumSize"])
+
+
+# BOOL HeapDestroy(
+#   HANDLE hHeap
+# );
+@winapi(cc=STDCALL, params={
+    "hHeap": HANDLE
+})
+def hook_HeapDestroy(ql, address, params):
+    heap = ql.heaps.pop(params["hHeap"], None)
+    if heap is None:
+        return 0
+    ql.heap.mem_free(heap.start_address)
+    return 1
 
 
 # DECLSPEC_ALLOCATOR LPVOID HeapAlloc(
@@ -42,8 +90,7 @@ def hook_HeapCreate(ql, address, params):
     "dwBytes": SIZE_T
 })
 def hook_HeapAlloc(ql, address, params):
-    ret = ql.heap.mem_alloc(params["dwBytes"])
-    return ret
+    return _heap_alloc(ql, params["hHeap"], params["dwFlags"], params["dwBytes"])
 
 
 # SIZE_T HeapSize(
@@ -54,10 +101,17 @@ def hook_HeapAlloc(ql, address, params):
 @winapi(cc=STDCALL, params={
     "hHeap": HANDLE,
     "dwFlags": DWORD,
-    "dwBytes": SIZE_T
+    "lpMem": POINTER
 })
 def hook_HeapSize(ql, address, params):
-    return ql.HEAP_SIZE
+    lpMem = params["lpMem"]
+    heap = _get_heap(ql, params["hHeap"])
+    size = heap.mem_size(lpMem)
+    fallback = _heap_fallback(ql, heap)
+    if size == 0 and fallback is not None:
+        size = fallback.mem_size(lpMem)
+    # (SIZE_T)-1 on failure
+    return size if size != 0 else (1 << (ql.pointersize * 8)) - 1
 
 
 # BOOL HeapFree(
@@ -71,7 +125,12 @@ def hook_HeapSize(ql, address, params):
     "lpMem": POINTER
 })
 def hook_HeapFree(ql, address, params):
-    return ql.heap.mem_free(params['lpMem'])
+    lpMem = params['lpMem']
+    heap = _get_heap(ql, params["hHeap"])
+    if heap.mem_free(lpMem):
+        return 1
+    fallback = _heap_fallback(ql, heap)
+    return fallback is not None and fallback.mem_free(lpMem)
 
 
 # BOOL HeapSetInformation(
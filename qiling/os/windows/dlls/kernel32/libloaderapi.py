@@ -46,7 +46,6 @@ def hook_GetModuleHandleW(ql, address, params):
     if lpModuleName == 0:
         ret = ql.PE.PE_IMAGE_BASE
     else:
-        lpModuleName = bytes(lpModuleName, "ascii").decode('utf-16le')
         if not lpModuleName.lower().endswith(".dll") and not lpModuleName.lower().endswith(".drv"):
             lpModuleName += ".dll"
         if lpModuleName.lower() in ql.PE.dlls:
@@ -137,6 +136,9 @@ def hook_GetProcAddress(ql, address, params):
         ql.nprint('[!] Failed to import function "%s" with handle 0x%X' % (lpProcName, params['hModule']))
         return 0
 
+    if dll_name in ql.PE.reserved_dlls:
+        ql.PE.map_reserved_dll(dll_name)
+
     if lpProcName in ql.PE.import_address_table[dll_name]:
         return ql.PE.import_address_table[dll_name][lpProcName]
 
@@ -178,7 +180,7 @@ def hook_LoadLibraryExA(ql, address, params):
     "lpLibFileName": WSTRING
 })
 def hook_LoadLibraryW(ql, address, params):
-    lpLibFileName = bytes(bytes(params["lpLibFileName"], 'ascii').decode('utf-16le'), 'ascii')
+    lpLibFileName = params["lpLibFileName"].encode()
     dll_base = ql.PE.load_dll(lpLibFileName)
     return dll_base
 
@@ -194,7 +196,7 @@ def hook_LoadLibraryW(ql, address, params):
     "dwFlags": DWORD
 })
 def hook_LoadLibraryExW(ql, address, params):
-    lpLibFileName = bytes(bytes(params["lpLibFileName"], "ascii").decode('utf-16le'), 'ascii')
+    lpLibFileName = params["lpLibFileName"].encode()
     dll_base = ql.PE.load_dll(lpLibFileName)
     return dll_base
 
@@ -238,6 +238,9 @@ def hook_CreateThread(ql, address, params):
     if lpThreadId != 0:
         ql.mem_write(lpThreadId, ql.pack(thread_id))
 
+    # give the scheduler a chance to run the new thread right away
+    ql.uc.emu_stop()
+
     # set thread handle
     return ret
 
@@ -81,12 +81,11 @@ def hook_WideCharToMultiByte(ql, address, params):
     s_lpWideCharStr = params["lpWideCharStr"]
     lpMultiByteStr = params["lpMultiByteStr"]
 
+    s = bytes(s_lpWideCharStr + "\x00", 'utf-8')
     if cbMultiByte == 0:
-        ret = len(s_lpWideCharStr) + 2
-        ret = align(ret // 2, 2)
+        ret = len(s)
     else:
-        s = bytes(s_lpWideCharStr, 'utf-16le').decode('utf-16le') + "\x00"
-        ql.uc.mem_write(lpMultiByteStr, bytes(s, 'utf-16le'))
+        ql.uc.mem_write(lpMultiByteStr, s)
         ret = len(s)
 
     return ret
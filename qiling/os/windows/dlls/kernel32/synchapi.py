@@ -96,6 +96,9 @@ def hook_WaitForSingleObject(ql, address, params):
     dwMilliseconds = params["dwMilliseconds"]
     target_thread = ql.handle_manager.get(hHandle).thread
     ql.thread_manager.current_thread.waitfor(target_thread)
+    if not target_thread.is_stop():
+        # switch now, the rest of the time slice must not run past the wait
+        ql.uc.emu_stop()
     return ret
 
 
@@ -124,4 +127,7 @@ def hook_WaitForMultipleObjects(ql, address, params):
             thread = ql.handle_manager.get(handle_value).thread
             ql.thread_manager.current_thread.waitfor(thread)
 
+    if ql.thread_manager.current_thread.has_waitfor():
+        # switch now, the rest of the time slice must not run past the wait
+        ql.uc.emu_stop()
     return ret
@@ -97,10 +97,7 @@ def hook_LocalAlloc(ql, address, params):
     "uFlags": UINT
 })
 def hook_LocalReAlloc(ql, address, params):
-    old_mem = params["hMem"]
-    ql.heap.mem_free(old_mem)
-    ret = ql.heap.mem_alloc(params["uBytes"])
-    return ret
+    return ql.heap.mem_realloc(params["hMem"], params["uBytes"])
 
 
 # UINT SetHandleCount(
@@ -7,7 +7,9 @@
 import os
 import json
 import sys
-from Registry import Registry
+import tempfile
+from collections import OrderedDict
+from Registry import Registry, RegistryParse
 from qiling.os.windows.const import *
 from qiling.exception import *
 
@@ -22,6 +24,73 @@ from qiling.exception import *
 # Registry Manager will only write registry changes to config.json 
 # and will not modify the hive file.
 
+# hives are opened on first use, resolved keys are kept in an LRU. a hive may come
+# with an index (hive file + ".qlidx", see ql_registry_build_index) mapping every
+# key path to its record, so a lookup does not walk the hive from the root
+
+QL_REGISTRY_HIVES = ("SECURITY", "SAM", "SOFTWARE", "SYSTEM")
+QL_REGISTRY_CACHE_SIZE = 0x1000
+QL_REGISTRY_INDEX_VERSION = 1
+
+
+def ql_registry_index_path(path):
+    return path + ".qlidx"
+
+
+def ql_registry_build_index(path):
+    """
+    write the index of the hive file at path, returns the index file
+    """
+    hive = Registry.Registry(path)
+    keys = {}
+    todo = [("", hive.root())]
+    while todo:
+        name, key = todo.pop()
+        keys[name] = key._nkrecord.offset()
+        for sub in key.subkeys():
+            todo.append(((name + "\\" if name else "") + sub.name().lower(), sub))
+
+    st = os.stat(path)
+    index = {"version": QL_REGISTRY_INDEX_VERSION, "size": st.st_size, "mtime": st.st_mtime_ns, "keys": keys}
+    findex = ql_registry_index_path(path)
+    fd, tmp = tempfile.mkstemp(prefix=os.path.basename(findex), dir=os.path.dirname(findex) or ".")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(index, f)
+        os.replace(tmp, findex)
+    except:
+        os.remove(tmp)
+        raise
+    return findex
+
+
+class RegistryHive:
+    def __init__(self, path):
+        self.hive = Registry.Registry(path)
+        self.index = None
+
+        # an index older than the hive is ignored
+        findex = ql_registry_index_path(path)
+        if os.path.exists(findex):
+            st = os.stat(path)
+            with open(findex, "r") as f:
+                index = json.load(f)
+            if index.get("version") == QL_REGISTRY_INDEX_VERSION and index.get("size") == st.st_size and index.get("mtime") == st.st_mtime_ns:
+                self.index = index["keys"]
+
+    def open(self, sub):
+        """
+        the key at sub, raises Registry.RegistryKeyNotFoundException
+        """
+        if self.index is None:
+            return self.hive.open(sub)
+
+        offset = self.index.get(sub.strip("\\").lower(), None)
+        if offset is None:
+            raise Registry.RegistryKeyNotFoundException(sub)
+        root = self.hive.root()._nkrecord
+        return Registry.RegistryKey(RegistryParse.NKRecord(root._buf, offset, root.parent()))
+
 
 class RegistryManager:
     def __init__(self, ql, hive=None, config=None):
@@ -67,41 +136,65 @@ class RegistryManager:
                 finally:
                     self.f_config.close()
 
-        # hkey local system
-        self.hklm = {}
+        self.hives = {}
+        self.keys = OrderedDict()
+
+    def __hive(self, name):
+        if name in self.hives:
+            return self.hives[name]
+
+        hive = None
         try:
-            self.hklm['SECURITY'] = Registry.Registry(os.path.join(self.hive, 'SECURITY'))
-            self.hklm['SAM'] = Registry.Registry(os.path.join(self.hive, 'SAM'))
-            self.hklm['SOFTWARE'] = Registry.Registry(os.path.join(self.hive, 'SOFTWARE'))
-            self.hklm['SYSTEM'] = Registry.Registry(os.path.join(self.hive, 'SYSTEM'))
-            # hkey current user
-            self.hkcu = Registry.Registry(os.path.join(self.hive, 'NTUSER.DAT'))
+            hive = RegistryHive(os.path.join(self.hive, name))
         except FileNotFoundError:
-            if not ql.shellcode:
-                QlPrintException("WARNING: Registry files not found!")
+            if not self.ql.shellcode:
+                self.ql.nprint("[!] WARNING: Registry file %s not found!" % name)
         except Exception:
-            QlPrintException("WARNING: Registry files format error")
+            self.ql.nprint("[!] WARNING: Registry file %s format error" % name)
+        self.hives[name] = hive
+        return hive
+
+    def __lookup(self, key):
+        """
+        {value name: value} of a hive key, None when there is no such key
+        """
+        key = key.replace("\x00", "").rstrip("\\")
+        lkey = key.lower()
+        if lkey in self.keys:
+            self.keys.move_to_end(lkey)
+            return self.keys[lkey]
+
+        keys = key.split("\\")
+        if keys[0] == "HKEY_LOCAL_MACHINE":
+            hive = self.__hive(keys[1].upper()) if len(keys) > 1 and keys[1].upper() in QL_REGISTRY_HIVES else None
+            sub = "\\".join(keys[2:])
+        elif keys[0] == "HKEY_CURRENT_USER":
+            hive = self.__hive("NTUSER.DAT")
+            sub = "\\".join(keys[1:])
+        else:
+            raise QlErrorNotImplemented("[!] Windows Registry %s not implemented" % (keys[0]))
+
+        values = None
+        if hive is not None:
+            try:
+                values = {value.name(): value for value in hive.open(sub).values()}
+            except Registry.RegistryKeyNotFoundException:
+                pass
+
+        # missing keys are cached too, probing for them is common
+        self.keys[lkey] = values
+        if len(self.keys) > QL_REGISTRY_CACHE_SIZE:
+            self.keys.popitem(last=False)
+        return values
 
     def exists(self, key):
         if key in self.config:
             return True
-        keys = key.split("\\")
         try:
-            if keys[0] == "HKEY_LOCAL_MACHINE":
-                reg = self.hklm[keys[1]]
-                sub = "\\".join(keys[2:]).replace("\x00", "")
-                data = reg.open(sub)
-            elif keys[0] == "HKEY_CURRENT_USER":
-                reg = self.hkcu
-                sub = "\\".join(keys[1:]).replace("\x00", "")
-                data = reg.open(sub)
-            else:
-                raise QlErrorNotImplemented("[!] Windows Registry %s not implemented" % (keys[0]))
-        except Exception as e:
+            return self.__lookup(key) is not None
+        except Exception:
             return False
 
-        return True
-
     def read(self, key, subkey, reg_type):
         # read reg conf first
         if key in self.config and subkey in self.config[key]:
@@ -112,29 +205,14 @@ class RegistryManager:
                     "[!] Windows Registry Type %s not implemented" % self.config[key][subkey].type)
 
         # read hive
-        reg = None
-        data = None
-        keys = key.split('\\')
-        try:
-            if keys[0] == "HKEY_LOCAL_MACHINE":
-                reg = self.hklm[keys[1]]
-                sub = "\\".join(keys[2:]).replace("\x00", "")
-                data = reg.open(sub)
-            elif keys[0] == "HKEY_CURRENT_USER":
-                reg = self.hkcu
-                sub = "\\".join(keys[1:]).replace("\x00", "")
-                data = reg.open(sub)
-            else:
-                raise QlErrorNotImplemented("[!] Windows Registry %s not implemented" % (keys[0]))
-
-            subkey = subkey.replace("\x00", "")
-            for value in data.values():
-                if value.name() == subkey and (reg_type == Registry.RegNone or
-                                               value.value_type() == reg_type):
-                    return value.value_type(), value.value()
+        values = self.__lookup(key)
+        if values is None:
             return None, None
-        except Registry.RegistryKeyNotFoundException:
+
+        value = values.get(subkey.replace("\x00", ""), None)
+        if value is None or (reg_type != Registry.RegNone and value.value_type() != reg_type):
             return None, None
+        return value.value_type(), value.value()
 
     def create(self, key):
         self.registry_config[key] = dict()
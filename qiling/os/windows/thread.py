@@ -3,131 +3,114 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
+import time
+
 from unicorn.x86_const import *
 from qiling.os.windows.utils import *
 from qiling.exception import *
 
 
-def thread_scheduler(ql, address, size):
-    if ql.pc == ql.thread_manager.THREAD_RET_ADDR:
-        ql.thread_manager.current_thread.stop()
-        ql.thread_manager.do_schedule()
-    else:
-        ql.thread_manager.ins_count += 1
-        ql.thread_manager.do_schedule()
-
-
 class Context:
+    """
+    cpu state of a suspended thread, saved with a single unicorn context switch
+
+    regs holds registers to override on the next restore, e.g. the entry point and
+    stack of a thread that never ran
+    """
     def __init__(self, ql):
         self.ql = ql
+        self.uc_context = None
+        self.regs = {}
 
     def save(self):
-        if self.ql.arch == QL_X86:
-            self.edi = self.ql.uc.reg_read(UC_X86_REG_EDI)
-            self.esi = self.ql.uc.reg_read(UC_X86_REG_ESI)
-            self.ebx = self.ql.uc.reg_read(UC_X86_REG_EBX)
-            self.edx = self.ql.uc.reg_read(UC_X86_REG_EDX)
-            self.ecx = self.ql.uc.reg_read(UC_X86_REG_ECX)
-            self.eax = self.ql.uc.reg_read(UC_X86_REG_EAX)
-            self.ebp = self.ql.uc.reg_read(UC_X86_REG_EBP)
-            self.eip = self.ql.uc.reg_read(UC_X86_REG_EIP)
-            self.esp = self.ql.uc.reg_read(UC_X86_REG_ESP)
-            self.eflags = self.ql.uc.reg_read(UC_X86_REG_EFLAGS)
-        elif self.ql.arch == QL_X8664:
-            self.rdi = self.ql.uc.reg_read(UC_X86_REG_RDI)
-            self.rsi = self.ql.uc.reg_read(UC_X86_REG_RSI)
-            self.rbx = self.ql.uc.reg_read(UC_X86_REG_RBX)
-            self.rdx = self.ql.uc.reg_read(UC_X86_REG_RDX)
-            self.rcx = self.ql.uc.reg_read(UC_X86_REG_RCX)
-            self.rax = self.ql.uc.reg_read(UC_X86_REG_RAX)
-            self.rbp = self.ql.uc.reg_read(UC_X86_REG_RBP)
-            self.rip = self.ql.uc.reg_read(UC_X86_REG_RIP)
-            self.rsp = self.ql.uc.reg_read(UC_X86_REG_RSP)
-            self.r8 = self.ql.uc.reg_read(UC_X86_REG_R8)
-            self.r9 = self.ql.uc.reg_read(UC_X86_REG_R9)
-            self.r10 = self.ql.uc.reg_read(UC_X86_REG_R10)
-            self.r11 = self.ql.uc.reg_read(UC_X86_REG_R11)
-            self.r12 = self.ql.uc.reg_read(UC_X86_REG_R12)
-            self.r13 = self.ql.uc.reg_read(UC_X86_REG_R13)
-            self.r14 = self.ql.uc.reg_read(UC_X86_REG_R14)
-            self.r15 = self.ql.uc.reg_read(UC_X86_REG_R15)
-            self.eflags = self.ql.uc.reg_read(UC_X86_REG_EFLAGS)
-        else:
+        if self.ql.arch not in (QL_X86, QL_X8664):
             raise QlErrorArch("[!] unknown ql.arch")
+        if self.uc_context is None:
+            self.uc_context = self.ql.uc.context_save()
+        else:
+            self.ql.uc.context_update(self.uc_context)
 
     def restore(self):
-        if self.ql.arch == QL_X86:
-            self.ql.uc.reg_write(UC_X86_REG_EDI, self.edi)
-            self.ql.uc.reg_write(UC_X86_REG_ESI, self.esi)
-            self.ql.uc.reg_write(UC_X86_REG_EBX, self.ebx)
-            self.ql.uc.reg_write(UC_X86_REG_EDX, self.edx)
-            self.ql.uc.reg_write(UC_X86_REG_ECX, self.ecx)
-            self.ql.uc.reg_write(UC_X86_REG_EAX, self.eax)
-            self.ql.uc.reg_write(UC_X86_REG_EBP, self.ebp)
-            self.ql.uc.reg_write(UC_X86_REG_EIP, self.eip)
-            self.ql.uc.reg_write(UC_X86_REG_ESP, self.esp)
-            self.ql.uc.reg_write(UC_X86_REG_EFLAGS, self.eflags)
-        elif self.ql.arch == QL_X8664:
-            self.ql.uc.reg_write(UC_X86_REG_RDI, self.rdi)
-            self.ql.uc.reg_write(UC_X86_REG_RSI, self.rsi)
-            self.ql.uc.reg_write(UC_X86_REG_RBX, self.rbx)
-            self.ql.uc.reg_write(UC_X86_REG_RDX, self.rdx)
-            self.ql.uc.reg_write(UC_X86_REG_RCX, self.rcx)
-            self.ql.uc.reg_write(UC_X86_REG_RAX, self.rax)
-            self.ql.uc.reg_write(UC_X86_REG_RBP, self.rbp)
-            self.ql.uc.reg_write(UC_X86_REG_RIP, self.rip)
-            self.ql.uc.reg_write(UC_X86_REG_RSP, self.rsp)
-            self.ql.uc.reg_write(UC_X86_REG_R8, self.r8)
-            self.ql.uc.reg_write(UC_X86_REG_R9, self.r9)
-            self.ql.uc.reg_write(UC_X86_REG_R10, self.r10)
-            self.ql.uc.reg_write(UC_X86_REG_R11, self.r11)
-            self.ql.uc.reg_write(UC_X86_REG_R12, self.r12)
-            self.ql.uc.reg_write(UC_X86_REG_R13, self.r13)
-            self.ql.uc.reg_write(UC_X86_REG_R14, self.r14)
-            self.ql.uc.reg_write(UC_X86_REG_R15, self.r15)
-            self.ql.uc.reg_write(UC_X86_REG_EFLAGS, self.eflags)
-        else:
-            raise QlErrorArch("[!] unknown ql.arch")
+        if self.uc_context is not None:
+            self.ql.uc.context_restore(self.uc_context)
+        for reg, value in self.regs.items():
+            self.ql.uc.reg_write(reg, value)
+        self.regs = {}
 
 
 # A Simple Thread Manager
 class ThreadManager:
-    TIME_SLICE = 10
+    # instructions a thread runs before the scheduler gets a chance to switch
+    TIME_SLICE = 1000
 
-    def __init__(self, ql, current_thread):
+    def __init__(self, ql, current_thread, time_slice=None):
         self.ql = ql
         # main thread
         self.current_thread = current_thread
         self.threads = [self.current_thread]
-        self.ins_count = 0
+        self.time_slice = time_slice if time_slice else ThreadManager.TIME_SLICE
         self.THREAD_RET_ADDR = self.ql.heap.mem_alloc(8)
         # write nop to THREAD_RET_ADDR
         self.ql.mem_write(self.THREAD_RET_ADDR, b"\x90"*8)
-        self.ql.hook_code(thread_scheduler)
+        # threads return here once their start routine is done
+        self.ql.hook_address(self.__thread_exit, self.THREAD_RET_ADDR)
+
+    def __thread_exit(self, ql):
+        self.current_thread.stop()
+        ql.uc.emu_stop()
 
     def append(self, thread):
         self.threads.append(thread)
 
-    def need_schedule(self):
-        return self.current_thread.is_stop() or self.ins_count % ThreadManager.TIME_SLICE == 0
+    def next_thread(self):
+        idx = self.threads.index(self.current_thread)
+        for i in range(1, len(self.threads)):
+            thread = self.threads[(idx + i) % len(self.threads)]
+            if thread.status == Thread.RUNNING and not thread.has_waitfor():
+                return thread
+        return None
 
     def do_schedule(self):
-        if self.current_thread.is_stop() or self.ins_count % ThreadManager.TIME_SLICE == 0:
-            if len(self.threads) <= 1:
-                return
+        # called between two time slices, returns False once nothing is left to run
+        next_thread = self.next_thread()
+        if next_thread is None:
+            return not self.current_thread.is_stop()
+
+        if not self.current_thread.is_stop():
+            self.current_thread.suspend()
+        next_thread.resume()
+        self.current_thread = next_thread
+        return True
+
+    def run(self, begin, end, timeout=0):
+        """
+        run all threads from begin until one of them reaches end, one time slice at a time
+        """
+        if timeout:
+            deadline = time.time() + timeout / 1000000.0
+
+        pc = begin
+        while True:
+            if timeout:
+                remaining = int((deadline - time.time()) * 1000000)
+                if remaining <= 0:
+                    break
             else:
-                for i in range(1, len(self.threads)):
-                    next_id = (self.current_thread.id + i) % len(self.threads)
-                    next_thread = self.threads[next_id]
-                    # find next thread
-                    if next_thread.status == Thread.RUNNING and (not next_thread.has_waitfor()):
-                        if self.current_thread.is_stop():
-                            pass
-                        else:
-                            self.current_thread.suspend()
-                        next_thread.resume()
-                        self.current_thread = next_thread
-                        break
+                remaining = 0
+
+            self.ql.uc.emu_start(pc, end, remaining, self.time_slice)
+
+            if not self.ql.RUN or self.ql.internal_exception is not None:
+                break
+
+            pc = self.ql.pc
+            if pc == end:
+                break
+
+            if len(self.threads) > 1 or self.current_thread.is_stop():
+                if not self.do_schedule():
+                    break
+                pc = self.ql.pc
 
 
 class Thread:
@@ -163,13 +146,13 @@ class Thread:
         # set eip, ebp, esp
         self.context.save()
         if self.ql.arch == QL_X86:
-            self.context.eip = func_addr
-            self.context.ebp = new_stack - 4
-            self.context.esp = new_stack - 4
+            self.context.regs[UC_X86_REG_EIP] = func_addr
+            self.context.regs[UC_X86_REG_EBP] = new_stack - 4
+            self.context.regs[UC_X86_REG_ESP] = new_stack - 4
         elif self.ql.arch == QL_X8664:
-            self.context.rip = func_addr
-            self.context.rbp = new_stack - 8
-            self.context.rsp = new_stack - 8
+            self.context.regs[UC_X86_REG_RIP] = func_addr
+            self.context.regs[UC_X86_REG_RBP] = new_stack - 8
+            self.context.regs[UC_X86_REG_RSP] = new_stack - 8
 
         self.status = status
         return self.id
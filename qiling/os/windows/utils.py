@@ -18,13 +18,7 @@ def string_unpack(string):
 
 
 def read_wstring(ql, address):
-    result = ""
-    char = ql.uc.mem_read(address, 2)
-    while char.decode("utf-8", "backslashreplace") != "\x00\x00":
-        address += 2
-        result += char.decode("utf-8", "backslashreplace")
-        char = ql.uc.mem_read(address, 2)
-    return result
+    return ql.mem.read_wstr(address)
 
 
 def w2cstring(string):
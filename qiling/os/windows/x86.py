@@ -24,32 +24,46 @@ QL_X86_WINDOWS_STACK_SIZE = 0x21000
 QL_X86_WINDOWS_EMU_END = 0x0
 
 
-# hook WinAPI in PE EMU
+# resolve the python implementation of an exported win api, once per export address
+def resolve_winapi(ql, address):
+    winapi_name = ql.PE.import_symbols[address]['name']
+    if winapi_name is None:
+        # exported by ordinal only
+        winapi_name = "ordinal_%d" % ql.PE.import_symbols[address]['ordinal']
+    else:
+        winapi_name = winapi_name.decode()
+    entry = (winapi_name, globals().get('hook_' + winapi_name, None))
+    ql.winapi_table[address] = entry
+    return entry
+
+
+# hook WinAPI in PE EMU, only registered over the loaded dll images
 def hook_winapi(ql, address, size):
     # call win32 api
-    if address in ql.PE.import_symbols:
-        winapi_name = ql.PE.import_symbols[address]['name'].decode()
-        winapi_func = None
+    entry = ql.winapi_table.get(address, None)
+    if entry is None:
+        if address not in ql.PE.import_symbols:
+            return
+        entry = resolve_winapi(ql, address)
 
-        if winapi_name in ql.user_defined_api:
-            if isinstance(ql.user_defined_api[winapi_name], types.FunctionType):
-                winapi_func = ql.user_defined_api[winapi_name]
-        else:
-            try:
-                winapi_func = globals()['hook_' + winapi_name]
-            except KeyError:
-                winapi_func = None
+    winapi_name, winapi_func = entry
 
-        if winapi_func:
-            try:
-                winapi_func(ql, address, {})
-            except Exception:
-                ql.dprint("[!] %s Exception Found" % winapi_name)
-                raise QlErrorSyscallError("[!] Windows API Implementation Error")
+    if winapi_name in ql.user_defined_api:
+        if isinstance(ql.user_defined_api[winapi_name], types.FunctionType):
+            winapi_func = ql.user_defined_api[winapi_name]
         else:
-            ql.nprint("[!] %s is not implemented\n" % winapi_name)
-            if ql.debug_stop:
-                raise QlErrorSyscallNotFound("[!] Windows API Implementation Not Found")
+            winapi_func = None
+
+    if winapi_func:
+        try:
+            winapi_func(ql, address, {})
+        except Exception:
+            ql.dprint("[!] %s Exception Found" % winapi_name)
+            raise QlErrorSyscallError("[!] Windows API Implementation Error")
+    else:
+        ql.nprint("[!] %s is not implemented\n" % winapi_name)
+        if ql.debug_stop:
+            raise QlErrorSyscallNotFound("[!] Windows API Implementation Not Found")
 
 
 def setup_windows32(ql):
@@ -73,6 +87,11 @@ def setup_windows32(ql):
     ql.DLL_LAST_ADDR = ql.DLL_BASE_ADDR
 
     ql.heap = Heap(ql, ql.HEAP_BASE_ADDR, ql.HEAP_BASE_ADDR + ql.HEAP_SIZE)
+    # HeapCreate arenas, handle -> Heap
+    ql.heaps = {}
+    # win api dispatch, Process.load_dll hooks it over every loaded dll image
+    ql.winapi_table = {}
+    ql.winapi_hook = hook_winapi
     ql.hook_mem_unmapped(ql_x86_windows_hook_mem_error)
 
     ql.RUN = True
@@ -117,9 +136,6 @@ def loader_file(ql):
     ql.PE = PE(ql, ql.path)
     ql.PE.load()
 
-    # hook win api
-    ql.hook_code(hook_winapi)
-
     ql_setup_output(ql)
 
 
@@ -142,9 +158,6 @@ def loader_shellcode(ql):
     ql.PE = Shellcode(ql, [b"ntdll.dll", b"kernel32.dll", b"user32.dll"])
     ql.PE.load()
 
-    # hook win api
-    ql.hook_code(hook_winapi)
-
     ql_setup_output(ql)
 
 
@@ -153,9 +166,9 @@ def runner(ql):
         ql.until_addr = QL_X86_WINDOWS_EMU_END
     try:
         if ql.shellcoder:
-            ql.uc.emu_start(ql.code_address, ql.code_address + len(ql.shellcoder))
+            ql.thread_manager.run(ql.code_address, ql.code_address + len(ql.shellcoder))
         else:
-            ql.uc.emu_start(ql.entry_point, ql.until_addr, ql.timeout)
+            ql.thread_manager.run(ql.entry_point, ql.until_addr, ql.timeout)
     except UcError:
         if ql.output in (QL_OUT_DEBUG, QL_OUT_DUMP):
             ql.nprint("[+] PC = 0x%x\n" %(ql.pc))
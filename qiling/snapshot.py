@@ -0,0 +1,341 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+Emulator snapshots, taken with Qiling.snapshot and brought back with Qiling.restore
+
+A snapshot keeps a copy of every mapped region. Between a snapshot and the next
+restore, host writes (uc.mem_write, mem_map, mem_unmap, mem_protect) and guest
+stores to writable regions (a write hook on each of them) mark pages dirty, and
+restoring the latest snapshot rewrites only the dirty pages.
+
+With compare=True the guest is not hooked and runs at full speed, restoring then
+compares the writable regions with their copy instead, which costs a read of all
+of them on every restore.
+"""
+
+import copy, os
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from bisect import bisect_right
+
+from unicorn import UC_PROT_ALL, UC_PROT_WRITE
+
+from qiling.arch.filetype import *
+from qiling.exception import *
+from qiling.os.posix.filestruct import ql_file
+
+QL_SNAPSHOT_PAGE_SIZE = 0x1000
+QL_SNAPSHOT_PAGE_SHIFT = 12
+
+
+def _subtract(ranges, holes):
+    """
+    parts of the sorted, disjoint [begin, end) ranges not covered by holes
+    """
+    ret = []
+    for begin, end in ranges:
+        for hole_begin, hole_end in holes:
+            if hole_end <= begin or hole_begin >= end:
+                continue
+            if hole_begin > begin:
+                ret.append((begin, hole_begin))
+            begin = max(begin, hole_end)
+            if begin >= end:
+                break
+        if begin < end:
+            ret.append((begin, end))
+    return ret
+
+
+class Snapshot:
+    def __init__(self, ql):
+        uc = ql.uc
+        self.uc = uc
+        self.context = uc.context_save()
+
+        # (begin, end, perms, data), end exclusive
+        self.regions = []
+        for begin, end, perms in sorted(uc.mem_regions()):
+            self.regions.append((begin, end + 1, perms, bytes(uc.mem_read(begin, end + 1 - begin))))
+        self.starts = [r[0] for r in self.regions]
+
+        self.vma = ql.vma.save()
+        self.brk_address = ql.brk_address
+        self.mmap_start = ql.mmap_start
+        self.current_path = ql.current_path
+        self.exit_code = ql.exit_code
+        self.internal_exception = ql.internal_exception
+        self.thread_management = ql.thread_management
+        self.threads = None
+        if ql.thread_management is not None:
+            self.threads = ql.thread_management.save()
+
+        # posix file descriptors, fd -> (offset, open flags) to rewind or reopen them
+        self.file_des = list(ql.file_des)
+        self.file_state = {}
+        for fd, f in enumerate(self.file_des):
+            if f != 0 and hasattr(f, "lseek") and f not in (ql.stdin, ql.stdout, ql.stderr):
+                try:
+                    offset = f.lseek(0, os.SEEK_CUR)
+                except Exception:
+                    continue
+                flags = None
+                if isinstance(f, ql_file) and fcntl is not None:
+                    flags = fcntl.fcntl(f.fileno(), fcntl.F_GETFL)
+                self.file_state[fd] = (offset, flags)
+        self.sigaction_act = list(ql.sigaction_act)
+
+        # windows heap, handles and registry
+        self.windows = None
+        if ql.ostype == QL_WINDOWS:
+            self.windows = {
+                "RUN": ql.RUN,
+                "last_error": getattr(ql, "last_error", 0),
+                "heap": ql.heap.save(),
+                "heaps": [(handle, heap, heap.save()) for handle, heap in ql.heaps.items()],
+                "handles": dict(ql.handle_manager.handles),
+                "registry": copy.deepcopy(ql.registry_manager.registry_config),
+                "current_thread": ql.thread_manager.current_thread,
+                "threads": [(t, t.status) for t in ql.thread_manager.threads],
+                "reserved_dlls": dict(ql.PE.reserved_dlls),
+            }
+
+    def region(self, address):
+        idx = bisect_right(self.starts, address) - 1
+        if idx >= 0 and address < self.regions[idx][1]:
+            return self.regions[idx]
+        return None
+
+    def restore_state(self, ql):
+        ql.vma.load(self.vma)
+        ql.brk_address = self.brk_address
+        ql.mmap_start = self.mmap_start
+        ql.current_path = self.current_path
+        ql.exit_code = self.exit_code
+        ql.internal_exception = self.internal_exception
+        ql.thread_management = self.thread_management
+        if self.threads is not None:
+            self.thread_management.load(self.threads)
+
+        # close what was opened after the snapshot, reopen what was closed since and
+        # rewind the rest
+        for f in ql.file_des:
+            if f != 0 and f not in self.file_des and hasattr(f, "close") and not getattr(f, "closed", False):
+                try:
+                    f.close()
+                except Exception:
+                    pass
+        for fd, f in enumerate(self.file_des):
+            if f != 0 and getattr(f, "closed", False):
+                self.file_des[fd] = self.__reopen(fd, f)
+        ql.file_des = list(self.file_des)
+        for fd, (offset, _) in self.file_state.items():
+            if self.file_des[fd] != 0:
+                self.file_des[fd].lseek(offset, os.SEEK_SET)
+        ql.sigaction_act = list(self.sigaction_act)
+
+        if self.windows is not None:
+            ql.RUN = self.windows["RUN"]
+            ql.last_error = self.windows["last_error"]
+            ql.heap.load(self.windows["heap"])
+            ql.heaps = {}
+            for handle, heap, state in self.windows["heaps"]:
+                heap.load(state)
+                ql.heaps[handle] = heap
+            ql.handle_manager.handles = dict(self.windows["handles"])
+            ql.registry_manager.registry_config = copy.deepcopy(self.windows["registry"])
+            ql.thread_manager.current_thread = self.windows["current_thread"]
+            ql.thread_manager.threads = [t for t, _ in self.windows["threads"]]
+            for t, status in self.windows["threads"]:
+                t.status = status
+            # lazy_dlls mapped since are reserved again, their pages are gone with the layout
+            ql.PE.reserved_dlls = dict(self.windows["reserved_dlls"])
+
+
+    def __reopen(self, fd, f):
+        # files come back from their path, sockets and pipes are gone for good
+        flags = self.file_state.get(fd, (0, None))[1]
+        if flags is None:
+            return 0
+        try:
+            return ql_file.open(f.name, flags & ~(os.O_CREAT | os.O_EXCL | os.O_TRUNC), 0)
+        except OSError:
+            return 0
+
+
+class SnapshotManager:
+    """
+    takes snapshots and tracks the pages written since the latest snapshot or restore
+    """
+    def __init__(self, ql, compare=False):
+        self.ql = ql
+        self.compare = compare
+        self.uc = None
+        self.base = None
+        self.dirty = set()
+        self.layout_changed = False
+        # write hooks marking guest stores
+        self.hooks = []
+
+    def __on_write(self, ql, address, size, value):
+        self.__mark(address, size)
+
+    def __hook_writes(self, begin, end):
+        if not self.compare:
+            self.hooks.append(self.ql.hook_mem_write(self.__on_write, begin=begin, end=end - 1))
+
+    def __rehook(self):
+        for h in self.hooks:
+            self.ql.hook_del(h)
+        self.hooks = []
+        for begin, end, perms in self.ql.uc.mem_regions():
+            if perms & UC_PROT_WRITE:
+                self.__hook_writes(begin, end + 1)
+
+    def __mark(self, address, size):
+        if size <= 0:
+            return
+        first = address >> QL_SNAPSHOT_PAGE_SHIFT
+        last = (address + size - 1) >> QL_SNAPSHOT_PAGE_SHIFT
+        if first == last:
+            self.dirty.add(first)
+        else:
+            self.dirty.update(range(first, last + 1))
+
+    def __track(self):
+        # wrap the writers of this Uc instance, guest writes are found on restore
+        uc = self.ql.uc
+        if self.uc is uc:
+            return
+        self.uc = uc
+        # the hooks went with the old instance
+        self.hooks = []
+
+        mem_write, mem_map, mem_unmap, mem_protect = uc.mem_write, uc.mem_map, uc.mem_unmap, uc.mem_protect
+
+        def _mem_write(address, data):
+            mem_write(address, data)
+            self.__mark(address, len(data))
+
+        def _mem_map(address, size, *args, **kw):
+            mem_map(address, size, *args, **kw)
+            self.__mark(address, size)
+            self.layout_changed = True
+
+        def _mem_unmap(address, size):
+            mem_unmap(address, size)
+            self.layout_changed = True
+
+        def _mem_protect(address, size, *args, **kw):
+            mem_protect(address, size, *args, **kw)
+            self.layout_changed = True
+            perms = args[0] if args else kw.get("perms", UC_PROT_ALL)
+            if perms & UC_PROT_WRITE:
+                # writable now, guest stores to it have to be seen too
+                self.__hook_writes(address, address + size)
+
+        uc.mem_write = _mem_write
+        uc.mem_map = _mem_map
+        uc.mem_unmap = _mem_unmap
+        uc.mem_protect = _mem_protect
+
+    def take(self):
+        self.__track()
+        snap = Snapshot(self.ql)
+        self.base = snap
+        self.dirty = set()
+        self.layout_changed = False
+        self.__rehook()
+        return snap
+
+    def __restore_layout(self, snap):
+        uc = self.ql.uc
+        current = sorted((begin, end + 1) for begin, end, _ in uc.mem_regions())
+        wanted = [(r[0], r[1]) for r in snap.regions]
+
+        for begin, end in _subtract(current, wanted):
+            uc.mem_unmap(begin, end - begin)
+        for begin, end in _subtract(wanted, current):
+            # fresh pages, __mark puts them in the dirty set
+            uc.mem_map(begin, end - begin)
+        for begin, end, perms, _ in snap.regions:
+            uc.mem_protect(begin, end - begin, perms)
+
+    def __changed_pages(self, snap, writable_only):
+        """
+        pages that differ from the snapshot, for compare mode. the guest can only
+        store to writable regions, the others are compared only when the
+        protections changed
+        """
+        uc = self.ql.uc
+        pages = []
+        for begin, end, perms, data in snap.regions:
+            if writable_only and not perms & UC_PROT_WRITE:
+                continue
+            current = uc.mem_read(begin, end - begin)
+            if current == data:
+                continue
+            current, data = memoryview(current), memoryview(data)
+            for offset in range(0, end - begin, QL_SNAPSHOT_PAGE_SIZE):
+                if current[offset : offset + QL_SNAPSHOT_PAGE_SIZE] != data[offset : offset + QL_SNAPSHOT_PAGE_SIZE]:
+                    pages.append((begin + offset) >> QL_SNAPSHOT_PAGE_SHIFT)
+        return pages
+
+    def __restore_pages(self, snap, pages):
+        uc = self.ql.uc
+        run_begin = run_end = None
+        run_region = None
+
+        for page in sorted(pages):
+            address = page << QL_SNAPSHOT_PAGE_SHIFT
+            region = snap.region(address)
+            if region is None:
+                continue
+            if region is run_region and address == run_end:
+                run_end += QL_SNAPSHOT_PAGE_SIZE
+                continue
+            if run_region is not None:
+                self.__write_run(uc, run_region, run_begin, run_end)
+            run_region, run_begin, run_end = region, address, address + QL_SNAPSHOT_PAGE_SIZE
+
+        if run_region is not None:
+            self.__write_run(uc, run_region, run_begin, run_end)
+
+    @staticmethod
+    def __write_run(uc, region, begin, end):
+        end = min(end, region[1])
+        offset = begin - region[0]
+        uc.mem_write(begin, region[3][offset : offset + end - begin])
+
+    def restore(self, snap):
+        ql = self.ql
+        if snap.uc is not ql.uc:
+            raise QlErrorSnapshot("[!] Snapshot was taken from another unicorn instance")
+
+        if snap is self.base:
+            layout_changed = self.layout_changed
+            if layout_changed:
+                self.__restore_layout(snap)
+            if self.compare:
+                self.dirty.update(self.__changed_pages(snap, not layout_changed))
+            self.__restore_pages(snap, self.dirty)
+        else:
+            # nothing is known about what changed since, rewrite everything
+            self.__restore_layout(snap)
+            for begin, end, perms, data in snap.regions:
+                ql.uc.mem_write(begin, data)
+
+        ql.uc.context_restore(snap.context)
+        snap.restore_state(ql)
+
+        # the hooks follow the writable regions of the snapshot
+        if self.layout_changed or snap is not self.base:
+            self.__rehook()
+        self.base = snap
+        self.dirty = set()
+        self.layout_changed = False
@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+#
+# Cross Platform and Multi Architecture Advanced Binary Emulation Framework
+# Built on top of Unicorn emulator (www.unicorn-engine.org)
+
+"""
+Binary execution trace, recorded with Qiling.trace and read back with TraceReader
+
+A trace file is a header, a sequence of chunks and an index:
+
+    header  magic, version, byte order, pointer size, index offset, index entries
+    chunk   raw records of one stream, as many as were buffered at flush time
+    index   (stream, record count, file offset) for every chunk, in file order
+
+Every stream is a flat array of unsigned 64 bit integers, a record being a fixed
+number of them:
+
+    block    address
+    insn     address
+    syscall  block sequence number, syscall number
+    mem      block sequence number, access (0 read, 1 write), address, size, value
+
+The block sequence number is the number of blocks recorded before the event, so
+syscalls and memory accesses can be placed inside the block trace.
+"""
+
+import mmap, struct, sys
+from array import array
+
+from qiling.exception import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+QL_TRACE_BLOCK = 0
+QL_TRACE_INSN = 1
+QL_TRACE_SYSCALL = 2
+QL_TRACE_MEM = 3
+
+QL_TRACE_MEM_READ = 0
+QL_TRACE_MEM_WRITE = 1
+
+# stream -> integers per record
+QL_TRACE_FIELDS = {
+    QL_TRACE_BLOCK: 1,
+    QL_TRACE_INSN: 1,
+    QL_TRACE_SYSCALL: 2,
+    QL_TRACE_MEM: 5,
+}
+
+QL_TRACE_MAGIC = b"QLTRACE\x00"
+QL_TRACE_VERSION = 1
+
+# magic, version, byte order (0 little, 1 big), pointer size, index offset, index entries
+_HEADER = struct.Struct("<8sIIIxxxxQQ")
+# stream, record count, offset
+_INDEX_ENTRY = struct.Struct("<IIQ")
+
+# records are written in host order; a file from the other byte order is read
+# through the opposite dtype
+_SWAPPED_U8 = ">u8" if sys.byteorder == "little" else "<u8"
+
+_MASK64 = 0xffffffffffffffff
+
+
+class TraceRecorder:
+    """
+    buffers trace records in arrays and writes them out in bulk through a memory map
+    """
+    # integers buffered per stream before a flush
+    BUFFER_SIZE = 0x10000
+    # file growth step
+    GROW_SIZE = 0x1000000
+
+    def __init__(self, ql, path, insn=False, syscall=False, mem=False, buffer_size=None):
+        self.ql = ql
+        self.path = path
+        self.buffer_size = buffer_size if buffer_size else TraceRecorder.BUFFER_SIZE
+        self.buffers = {stream: array("Q") for stream in QL_TRACE_FIELDS}
+        self.index = []
+        self.block_count = 0
+        self.hooks = []
+        self.syscall_hook = None
+        self.closed = False
+
+        self.fd = open(path, "w+b")
+        self.size = TraceRecorder.GROW_SIZE
+        self.fd.truncate(self.size)
+        self.map = mmap.mmap(self.fd.fileno(), self.size)
+        self.offset = _HEADER.size
+
+        self.hooks.append(ql.hook_block(self.__hook_block))
+
+        if insn:
+            self.hooks.append(ql.hook_code(self.__hook_insn))
+
+        if syscall:
+            if ql.syscall_table is None:
+                self.close()
+                raise QlErrorNotImplemented("[!] Syscall tracing needs a posix syscall table")
+            self.syscall_hook = self.__hook_syscall
+            ql.syscall_table.hook_pre(self.syscall_hook)
+
+        if mem:
+            self.hooks.append(ql.hook_mem_read(self.__hook_mem_read))
+            self.hooks.append(ql.hook_mem_write(self.__hook_mem_write))
+
+    def __hook_block(self, ql, address, size):
+        buf = self.buffers[QL_TRACE_BLOCK]
+        buf.append(address)
+        self.block_count += 1
+        if len(buf) >= self.buffer_size:
+            self.flush_stream(QL_TRACE_BLOCK)
+
+    def __hook_insn(self, ql, address, size):
+        buf = self.buffers[QL_TRACE_INSN]
+        buf.append(address)
+        if len(buf) >= self.buffer_size:
+            self.flush_stream(QL_TRACE_INSN)
+
+    def __hook_syscall(self, ql, syscall_num, params):
+        buf = self.buffers[QL_TRACE_SYSCALL]
+        buf.append(self.block_count)
+        buf.append(syscall_num & _MASK64)
+        if len(buf) >= self.buffer_size:
+            self.flush_stream(QL_TRACE_SYSCALL)
+
+    def __hook_mem_read(self, ql, address, size, value):
+        buf = self.buffers[QL_TRACE_MEM]
+        buf.extend((self.block_count, QL_TRACE_MEM_READ, address, size, value & _MASK64))
+        if len(buf) >= self.buffer_size:
+            self.flush_stream(QL_TRACE_MEM)
+
+    def __hook_mem_write(self, ql, address, size, value):
+        buf = self.buffers[QL_TRACE_MEM]
+        buf.extend((self.block_count, QL_TRACE_MEM_WRITE, address, size, value & _MASK64))
+        if len(buf) >= self.buffer_size:
+            self.flush_stream(QL_TRACE_MEM)
+
+    def __reserve(self, size):
+        if self.offset + size <= self.size:
+            return
+        while self.offset + size > self.size:
+            self.size += TraceRecorder.GROW_SIZE
+        self.map.close()
+        self.fd.truncate(self.size)
+        self.map = mmap.mmap(self.fd.fileno(), self.size)
+
+    def flush_stream(self, stream):
+        buf = self.buffers[stream]
+        if not buf:
+            return
+        data = memoryview(buf).cast("B")
+        self.__reserve(len(data))
+        self.map[self.offset : self.offset + len(data)] = data
+        self.index.append((stream, len(buf) // QL_TRACE_FIELDS[stream], self.offset))
+        self.offset += len(data)
+        self.buffers[stream] = array("Q")
+
+    def flush(self):
+        for stream in QL_TRACE_FIELDS:
+            self.flush_stream(stream)
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        for h in self.hooks:
+            self.ql.hook_del(h)
+        if self.syscall_hook is not None and self.ql.syscall_table is not None:
+            self.ql.syscall_table.unhook(self.syscall_hook)
+
+        self.flush()
+        index_offset = self.offset
+        index = b"".join(_INDEX_ENTRY.pack(*entry) for entry in self.index)
+        self.__reserve(len(index))
+        self.map[index_offset : index_offset + len(index)] = index
+        self.map[0 : _HEADER.size] = _HEADER.pack(
+            QL_TRACE_MAGIC,
+            QL_TRACE_VERSION,
+            0 if sys.byteorder == "little" else 1,
+            self.ql.pointersize,
+            index_offset,
+            len(self.index))
+        self.map.close()
+        self.fd.truncate(index_offset + len(index))
+        self.fd.close()
+
+
+class TraceReader:
+    """
+    streams a trace file back, as NumPy arrays when NumPy is installed, as array('Q') otherwise
+
+    records with more than one field come back as (records, fields) NumPy arrays, or as tuples
+    when iterating
+    """
+    def __init__(self, path):
+        self.path = path
+        self.fd = open(path, "rb")
+        self.map = mmap.mmap(self.fd.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.map) < _HEADER.size:
+            self.close()
+            raise QlErrorFileType("[!] Not a qiling trace file: %s" % path)
+
+        magic, version, byteorder, self.pointersize, index_offset, entries = _HEADER.unpack_from(self.map, 0)
+        if magic != QL_TRACE_MAGIC or version != QL_TRACE_VERSION:
+            self.close()
+            raise QlErrorFileType("[!] Not a qiling trace file: %s" % path)
+
+        self.swap = byteorder != (0 if sys.byteorder == "little" else 1)
+        self.index = [_INDEX_ENTRY.unpack_from(self.map, index_offset + i * _INDEX_ENTRY.size) for i in range(entries)]
+
+    def close(self):
+        self.map.close()
+        self.fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def count(self, stream):
+        return sum(records for s, records, _ in self.index if s == stream)
+
+    def chunks(self, stream):
+        """
+        one array per chunk of the stream, without loading the rest of the file
+        """
+        fields = QL_TRACE_FIELDS[stream]
+        for s, records, offset in self.index:
+            if s != stream:
+                continue
+            raw = self.map[offset : offset + records * fields * 8]
+            if numpy is not None:
+                chunk = numpy.frombuffer(raw, dtype=_SWAPPED_U8 if self.swap else "=u8")
+                if fields > 1:
+                    chunk = chunk.reshape(-1, fields)
+            else:
+                chunk = array("Q", raw)
+                if self.swap:
+                    chunk.byteswap()
+            yield chunk
+
+    def read(self, stream):
+        """
+        the whole stream in one array
+        """
+        chunks = list(self.chunks(stream))
+        if numpy is not None:
+            if not chunks:
+                shape = (0, QL_TRACE_FIELDS[stream]) if QL_TRACE_FIELDS[stream] > 1 else (0,)
+                return numpy.empty(shape, dtype="=u8")
+            return numpy.concatenate(chunks)
+        ret = array("Q")
+        for chunk in chunks:
+            ret.extend(chunk)
+        return ret
+
+    def iter(self, stream):
+        """
+        records one by one: an int for single field streams, a tuple otherwise
+        """
+        fields = QL_TRACE_FIELDS[stream]
+        for chunk in self.chunks(stream):
+            if numpy is not None:
+                chunk = chunk.reshape(-1).tolist()
+            if fields == 1:
+                yield from chunk
+            else:
+                for i in range(0, len(chunk), fields):
+                    yield tuple(chunk[i : i + fields])
+
+    def blocks(self):
+        return self.iter(QL_TRACE_BLOCK)
+
+    def insns(self):
+        return self.iter(QL_TRACE_INSN)
+
+    def syscalls(self):
+        return self.iter(QL_TRACE_SYSCALL)
+
+    def mems(self):
+        return self.iter(QL_TRACE_MEM)
@@ -8,11 +8,26 @@ This module is intended for general purpose functions that can be used
 thoughout the qiling framework
 """
 
-import sys, logging, importlib
+import sys, os, logging, importlib, threading, queue, atexit
 from qiling.exception import *
 from qiling.arch.filetype import *
 
 
+class QlLazyStr:
+    """
+    log argument built by func(*args) only when the message is written, for
+    helpers like the flag name mappings
+    """
+    __slots__ = ("func", "args")
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self):
+        return str(self.func(*self.args))
+
+
 def ql_get_os_module_function(ostype, arch, function_name):
     if not ql_is_valid_ostype(ostype):
         raise QlErrorOsType("[!] Invalid OSType")
@@ -60,6 +75,179 @@ def ql_get_module_function(module_name, function_name):
     return module_function
 
 
+class QlLogSink:
+    """
+    one background writer per output stream, shared by every logger writing to it
+
+    records are formatted by the emulator thread and collected in batches, the writer
+    thread writes each batch out with a single write and flush
+    """
+    BATCH_SIZE = 0x200
+    # batches the writer may fall behind before logging blocks
+    QUEUE_SIZE = 0x40
+    # seconds before a partial batch gets written anyway
+    FLUSH_INTERVAL = 0.1
+
+    def __init__(self, stream, owned=False, key=None):
+        self.stream = stream
+        # owned streams (log files) are closed with the sink
+        self.owned = owned
+        self.key = key
+        # handlers writing to an owned sink, it is closed with the last one
+        self.refs = 0
+        self.start()
+
+    def start(self):
+        self.lock = threading.Lock()
+        self.pending = []
+        self.queue = queue.Queue(QlLogSink.QUEUE_SIZE)
+        self.thread = threading.Thread(target=self.__writer, daemon=True)
+        self.thread.start()
+
+    def __write_batch(self, batch):
+        try:
+            self.stream.write("".join(batch))
+            self.stream.flush()
+        except (OSError, ValueError):
+            pass
+
+    def __writer(self):
+        q = self.queue
+        while True:
+            try:
+                batch = q.get(timeout=QlLogSink.FLUSH_INTERVAL)
+            except queue.Empty:
+                # nothing queued, pick up the partial batch unless the emulator is busy with it
+                if not self.lock.acquire(blocking=False):
+                    continue
+                try:
+                    if not q.empty():
+                        continue
+                    batch, self.pending = self.pending, []
+                finally:
+                    self.lock.release()
+                if batch:
+                    self.__write_batch(batch)
+                continue
+
+            if batch is None:
+                q.task_done()
+                return
+            self.__write_batch(batch)
+            q.task_done()
+
+    def write(self, msg):
+        with self.lock:
+            self.pending.append(msg)
+            if len(self.pending) >= QlLogSink.BATCH_SIZE:
+                batch, self.pending = self.pending, []
+                # blocks once the writer falls QUEUE_SIZE batches behind
+                self.queue.put(batch)
+
+    def flush(self):
+        if not self.thread.is_alive():
+            return
+        with self.lock:
+            if self.pending:
+                batch, self.pending = self.pending, []
+                self.queue.put(batch)
+        self.queue.join()
+
+    def close(self):
+        self.flush()
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        if self.owned:
+            self.stream.close()
+
+
+# ("stream", id) or ("file", path) -> QlLogSink, console sinks stay for good
+_log_sinks = {}
+_log_sinks_lock = threading.Lock()
+
+
+def ql_log_sink(stream=None, path=None):
+    if path is not None:
+        key = ("file", os.path.abspath(path))
+    else:
+        key = ("stream", id(stream))
+
+    with _log_sinks_lock:
+        sink = _log_sinks.get(key, None)
+        if sink is None:
+            if path is not None:
+                sink = QlLogSink(open(path, "a"), owned=True, key=key)
+            else:
+                sink = QlLogSink(stream, key=key)
+            _log_sinks[key] = sink
+        sink.refs += 1
+    return sink
+
+
+def ql_log_release(sink):
+    # file sinks are closed, with their writer thread, once no handler uses them
+    if not sink.owned:
+        return
+
+    with _log_sinks_lock:
+        sink.refs -= 1
+        if sink.refs > 0:
+            return
+        if _log_sinks.get(sink.key, None) is sink:
+            del _log_sinks[sink.key]
+    sink.close()
+
+
+def ql_log_flush():
+    for sink in list(_log_sinks.values()):
+        sink.flush()
+
+
+def _ql_log_after_fork():
+    # the writer threads did not survive fork, whatever they had queued is the parent's
+    for sink in _log_sinks.values():
+        sink.start()
+
+
+atexit.register(ql_log_flush)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(before=ql_log_flush, after_in_child=_ql_log_after_fork)
+
+
+class QlLogHandler(logging.Handler):
+    """
+    handlers of a log file hold its sink only while the emulator runs, a record
+    logged after the sink was released opens it again
+    """
+    def __init__(self, sink, terminator="\n", path=None):
+        super().__init__(logging.DEBUG)
+        self.sink = sink
+        self.terminator = terminator
+        self.path = path
+
+    def emit(self, record):
+        try:
+            if self.sink is None:
+                self.sink = ql_log_sink(path=self.path)
+            self.sink.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        if self.sink is not None:
+            self.sink.flush()
+
+    def release_sink(self):
+        if self.path is not None and self.sink is not None:
+            sink, self.sink = self.sink, None
+            ql_log_release(sink)
+
+    def close(self):
+        self.release_sink()
+        super().close()
+
+
 def ql_setup_logger(logger_name=None):
     if logger_name is None: # increasing logger name counter to prevent conflict 
         loggers = logging.root.manager.loggerDict
@@ -72,9 +260,8 @@ def ql_setup_logger(logger_name=None):
 
 def ql_setup_logging_stream(ql_mode, logger=None):
 
-    # setup StreamHandler for logging to stdout
-    ch = logging.StreamHandler()
-    ch.setLevel(logging.DEBUG)
+    # log to stderr through the shared console writer
+    ch = QlLogHandler(ql_log_sink(stream=sys.stderr))
 
     if ql_mode in (QL_OUT_DISASM, QL_OUT_DUMP):
         # use empty string for newline if disasm or dump mode was enabled
@@ -89,9 +276,9 @@ def ql_setup_logging_stream(ql_mode, logger=None):
 
 def ql_setup_logging_file(ql_mode, log_file_path, logger=None):
 
-    # setup FileHandler for logging to disk file
-    fh = logging.FileHandler('%s.qlog' % (log_file_path))
-    fh.setLevel(logging.DEBUG)
+    # log to disk file, every logger of the same file shares one writer
+    path = '%s.qlog' % (log_file_path)
+    fh = QlLogHandler(ql_log_sink(path=path), path=path)
 
     if ql_mode in (QL_OUT_DISASM, QL_OUT_DUMP):
         # use empty string for newline if disasm or dump mode was enabled
@@ -102,3 +289,12 @@ def ql_setup_logging_file(ql_mode, log_file_path, logger=None):
 
     logger.addHandler(fh)
     return logger
+
+
+def ql_release_logging_file(logger):
+    # close the log files of logger unless another logger still writes to them
+    if logger is None:
+        return
+    for h in logger.handlers:
+        if isinstance(h, QlLogHandler):
+            h.release_sink()
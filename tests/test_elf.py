@@ -3,11 +3,23 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
-import sys,unittest, subprocess, string, random
+import gc, os, re, socket, sys, tempfile, unittest, subprocess, string, random
 sys.path.append("..")
 from qiling import *
+from qiling import utils
 from qiling.exception import *
 from qiling.os.posix import syscall
+from qiling.os.utils import ql_disasm_line
+from qiling.trace import *
+from qiling.fuzz import *
+from qiling.gdbserver.qldbg import Qldbg
+from qiling.gdbserver.gdblistener import GDBSession
+from qiling.os.linux.thread import Thread, ThreadManagement
+from qiling.os.posix.filestruct import ql_buffer, ql_file, ql_socket
+from qiling.loader.elf import ELFParse, PT_LOAD
+from qiling.loader.imagecache import ImageCache, ql_image_cache
+from qiling.os.memory import FileSource
+from unicorn.x86_const import UC_X86_REG_RAX
 
 class ELFTest(unittest.TestCase):
 
@@ -597,12 +609,630 @@ class ELFTest(unittest.TestCase):
         solve()
 
 
+    def test_elf_linux_x86_crackme_multithread(self):
+        class MyPipe():
+            def __init__(self, buf = b''):
+                self.buf = buf
+
+            def write(self, s):
+                self.buf += s
+                return len(s)
+
+            def read(self, l):
+                ret = self.buf[ : l]
+                self.buf = self.buf[l : ]
+                return ret
+
+            def fileno(self):
+                return 0
+
+            def fstat(self):
+                return os.fstat(sys.stdin.fileno())
+
+            def flush(self):
+                pass
+
+            def close(self):
+                pass
+
+        # the data is in the python object, host stdin has none and never will
+        r, w = os.pipe()
+        saved = os.dup(0)
+        os.dup2(r, 0)
+        try:
+            stdin, stdout = MyPipe(b"L1NUX\n"), MyPipe()
+            ql = Qiling(["../examples/rootfs/x86_linux/bin/crackme_linux"], "../examples/rootfs/x86_linux", output="off", stdin=stdin, stdout=stdout)
+            ql.multithread = True
+            ql.run()
+            self.assertIn(b"Correct", stdout.buf)
+            self.assertEqual(stdin.buf, b"")
+            del ql
+        finally:
+            os.dup2(saved, 0)
+            for fd in (saved, r, w):
+                os.close(fd)
+
+
     def test_elf_linux_execve_x8664(self):
         ql = Qiling(["../examples/rootfs/x8664_linux/bin/posix_syscall_execve"],  "../examples/rootfs/x8664_linux", output="debug")
         ql.run()
         del ql
 
 
+    def test_elf_linux_x8664_syscall_table_hooks(self):
+        def syscall_enter(ql, syscall_num, params):
+            entered.append(syscall_num)
+
+        def syscall_leave(ql, syscall_num, params):
+            if syscall_num == 0x01:
+                written.append(params[2])
+
+        entered = []
+        written = []
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello_static"], "../examples/rootfs/x8664_linux", output="off")
+        ql.syscall_table.hook_pre(syscall_enter)
+        ql.syscall_table.hook_post(syscall_leave)
+        ql.run()
+        self.assertIn(0x01, entered)
+        self.assertTrue(written and written[0] > 0)
+        del ql
+
+
+    def test_elf_linux_x8664_hook_del(self):
+        def count(ql, address, size, user_data):
+            user_data[0] += 1
+
+        def ranged_count(ql, address, size, user_data):
+            assert ql.elf_entry <= address < ql.elf_entry + 0x100
+            user_data[0] += 1
+
+        def removed(ql, address, size):
+            raise RuntimeError("removed hook was called")
+
+        def entry_reached(ql, user_data):
+            user_data[0] += 1
+
+        all_count = [0]
+        ranged = [0]
+        disabled = [0]
+        entry = [0]
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello_static"], "../examples/rootfs/x8664_linux", output="off")
+        ql.hook_code(count, all_count)
+        ql.hook_code(ranged_count, ranged, ql.elf_entry, ql.elf_entry + 0xff)
+        ql.hook_del(ql.hook_code(removed))
+        ql.hook_code(count, disabled).disable()
+        ql.hook_address(entry_reached, ql.elf_entry, entry)
+        ql.run()
+        self.assertIsNone(ql.internal_exception)
+        self.assertTrue(all_count[0] > ranged[0] > 0)
+        self.assertEqual(disabled[0], 0)
+        self.assertEqual(entry[0], 1)
+        del ql
+
+
+    def test_elf_linux_arm_disasm(self):
+        ql = Qiling(["../examples/rootfs/arm_linux/bin/arm_hello_static"], "../examples/rootfs/arm_linux", output="disasm")
+        ql.run()
+        address = ql.elf_entry
+        line = ql_disasm_line(ql, address, 4)
+        self.assertTrue(line.startswith("[+] 0x%x\t" % address))
+        self.assertIs(ql_disasm_line(ql, address, 4), line)
+        del ql
+
+
+    def test_elf_linux_x8664_trace(self):
+        blocks = []
+
+        def count_block(ql, address, size):
+            blocks.append(address)
+
+        fd, path = tempfile.mkstemp(suffix=".qltrace")
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello_static"], "../examples/rootfs/x8664_linux", output="off")
+        ql.hook_block(count_block)
+        ql.trace(path, insn=True, syscall=True, mem=True).buffer_size = 0x100
+        ql.run()
+        del ql
+
+        with TraceReader(path) as trace:
+            self.assertEqual(list(trace.blocks()), blocks)
+            self.assertTrue(trace.count(QL_TRACE_INSN) > len(blocks))
+            syscalls = list(trace.syscalls())
+            self.assertEqual(syscalls[-1][1], 231) # exit_group
+            self.assertTrue(all(0 < seq <= len(blocks) for seq, _ in syscalls))
+            self.assertTrue(any(access == QL_TRACE_MEM_WRITE for _, access, _, _, _ in trace.mems()))
+
+
+    def test_elf_linux_x8664_log_file(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello_static"], "../examples/rootfs/x8664_linux", log_dir="qlog")
+        ql.run()
+        path = ql.log_file + ".qlog"
+
+        # the file and its writer are closed with the run, and reopened for later records
+        key = ("file", os.path.abspath(path))
+        self.assertNotIn(key, utils._log_sinks)
+        ql.nprint("after run")
+        self.assertIn(key, utils._log_sinks)
+        del ql
+        gc.collect()
+        self.assertNotIn(key, utils._log_sinks)
+
+        with open(path) as f:
+            log = f.read()
+        os.remove(path)
+        os.rmdir(os.path.dirname(path))
+        self.assertIn("write(1,", log)
+        self.assertTrue(log.rstrip().endswith("after run"))
+
+
+    def test_elf_linux_x8664_snapshot(self):
+        def memory(ql):
+            return [bytes(ql.uc.mem_read(begin, end - begin + 1)) for begin, end, _ in sorted(ql.uc.mem_regions())]
+
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello_static"], "../examples/rootfs/x8664_linux", output="off")
+        snap = ql.snapshot()
+        before = memory(ql)
+        map_info = [list(m) for m in ql.map_info]
+        brk_address = ql.brk_address
+        sp = ql.sp
+
+        ql.run()
+        self.assertNotEqual(memory(ql), before)
+        ql.restore(snap)
+        self.assertEqual(memory(ql), before)
+        self.assertEqual(ql.map_info, map_info)
+        self.assertEqual(ql.brk_address, brk_address)
+        self.assertEqual(ql.sp, sp)
+
+        # run again from the snapshot, then go back with a full restore
+        ql.run()
+        self.assertEqual(ql.exit_code, 0)
+        ql.snapshot()
+        ql.restore(snap)
+        self.assertEqual(memory(ql), before)
+
+        # guest stores are tracked as they happen, only their pages are dirty
+        snap = ql.snapshot()
+        ql.run()
+        dirty = len(ql.snapshot_manager.dirty)
+        self.assertGreater(dirty, 0)
+        self.assertLess(dirty, sum(end - begin + 1 for begin, end, _ in ql.uc.mem_regions()) >> 12)
+        ql.restore(snap)
+        self.assertEqual(memory(ql), before)
+
+        # or found by comparing on restore, without hooks
+        snap = ql.snapshot(compare=True)
+        ql.run()
+        ql.restore(snap)
+        self.assertEqual(memory(ql), before)
+
+        # a file closed after the snapshot is opened again, and rewound
+        path = "test_snapshot_file.txt"
+        with open(path, "wb") as f:
+            f.write(b"0123456789")
+        ql.file_des[5] = ql_file.open(path, os.O_RDONLY, 0)
+        ql.file_des[5].read(4)
+        snap = ql.snapshot()
+        syscall.ql_syscall_close(ql, 5, 0, 0, 0, 0, 0)
+        ql.restore(snap)
+        self.assertFalse(ql.file_des[5].closed)
+        self.assertEqual(ql.file_des[5].read(3), b"456")
+        ql.restore(snap)
+        self.assertEqual(ql.file_des[5].read(3), b"456")
+        ql.file_des[5].close()
+        os.remove(path)
+        del ql
+
+
+    def test_elf_linux_x86_fuzz_loop(self):
+        inputs = [b"AAAAA\n", b"L1NUX\n", b"L1NUY\n"] * 2
+        stdin = ql_buffer()
+        stdout = ql_buffer()
+        outputs = []
+
+        def set_input(ql, iteration):
+            stdin.set(inputs[iteration])
+            stdout.set(b'')
+
+        def report(ql, result):
+            self.assertEqual(result.status, QL_FUZZ_EXIT)
+            self.assertEqual(result.exit_code, 0)
+            outputs.append(bytes(stdout.written))
+
+        ql = Qiling(["../examples/rootfs/x86_linux/bin/crackme_linux"], "../examples/rootfs/x86_linux", output="off", stdin=stdin, stdout=stdout)
+        summary = ql.fuzz_loop(ql.elf_entry, 0, set_input, len(inputs), report=report)
+        self.assertEqual(summary[QL_FUZZ_EXIT], len(inputs))
+        self.assertEqual([b"Correct!" in out for out in outputs], [False, True, False] * 2)
+        del ql
+
+        # the linux thread scheduler cannot run start -> end iterations
+        ql = Qiling(["../examples/rootfs/x86_linux/bin/crackme_linux"], "../examples/rootfs/x86_linux", output="off", stdin=stdin, stdout=stdout)
+        ql.multithread = True
+        with self.assertRaises(QlErrorNotImplemented):
+            ql.fuzz_loop(ql.elf_entry, 0, set_input, 1)
+        del ql
+
+
+    def test_elf_linux_x8664_vma(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        ql.run()
+        self.assertTrue([m for m in ql.map_info if m[3] == "[heap]" and m[1] == ql.brk_address])
+
+        # munmap hands address space back to mmap
+        mmap_start = ql.mmap_start
+        base = ql.vma.mmap(0, 0x3000)
+        ql.insert_map_info(base, base + 0x3000, "rw-", "[mapped]")
+        ql.vma.unmap(base + 0x1000, base + 0x2000)
+        self.assertEqual(ql.vma.find(base + 0x1000), None)
+        self.assertEqual(ql.vma.find(base + 0x2000), [base + 0x2000, base + 0x3000, "rw-", "[mapped]"])
+        self.assertEqual(ql.vma.mmap(0, 0x1000), base + 0x1000)
+        self.assertEqual(ql.mmap_start, mmap_start + 0x3000)
+
+        # mprotect splits, the same permissions merge back
+        ql.insert_map_info(base + 0x1000, base + 0x2000, "rw-", "[mapped]")
+        ql.vma.protect(base + 0x1000, base + 0x2000, "r--")
+        self.assertEqual(ql.vma.find(base)[1 : 3], [base + 0x1000, "rw-"])
+        self.assertEqual(ql.vma.find(base + 0x1000)[ : 3], [base + 0x1000, base + 0x2000, "r--"])
+        ql.vma.protect(base + 0x1000, base + 0x2000, "rw-")
+        self.assertEqual(ql.vma.find(base + 0x1000)[1 : 3], [base + 0x3000, "rw-"])
+
+        # the break takes back what it gave up, mmap does not hand it out again
+        brk = ql.brk_address
+        self.assertTrue(ql.vma.brk(brk + 0x3000))
+        self.assertTrue(ql.vma.brk(brk + 0x1000))
+        self.assertEqual(ql.vma.find(brk + 0x1000), None)
+        self.assertTrue(ql.vma.brk(brk + 0x3000))
+        self.assertEqual(ql.vma.find(brk + 0x2000)[1 : ], [brk + 0x3000, "rw-", "[heap]"])
+        base = ql.vma.mmap(0, 0x2000)
+        self.assertFalse(brk <= base < brk + 0x3000)
+
+        # and stops at the next mapping
+        ql.insert_map_info(base, base + 0x2000, "rw-", "[mapped]")
+        self.assertFalse(ql.vma.brk(base + 0x1000))
+        self.assertEqual(ql.brk_address, brk + 0x3000)
+        del ql
+
+
+    def test_elf_linux_x8664_mem_readers(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        base = ql.vma.mmap(0, 0x2000)
+
+        # terminators straddling the page boundary
+        ql.mem.write(base + 0xffd, b"abc\x00")
+        self.assertEqual(ql.mem.read_cstr(base + 0xffd), "abc")
+        self.assertEqual(ql.mem.read_cstr(base + 0xffd, limit=2), "ab")
+        ql.mem.write(base + 0xff9, "xyz\x00".encode("utf-16le"))
+        self.assertEqual(ql.mem.read_wstr(base + 0xff9), "xyz")
+
+        ql.mem.write(base + 0x1fe8, ql.pack64(base) + ql.pack64(base + 8) + ql.pack64(0))
+        self.assertEqual(ql.mem.read_ptr_array(base + 0x1fe8), [base, base + 8])
+        self.assertEqual(ql.mem.read_ptr_array(base + 0x1fe8, 1), [base])
+        self.assertEqual(ql.mem.read_struct(base + 0x1ff0, "<QQ"), (base + 8, 0))
+
+        # partly mapped, the gdb 'm' packet case
+        self.assertEqual(len(ql.mem.read_available(base + 0x1ff0, 0x20)), 0x10)
+        del ql
+
+
+    def test_elf_linux_x8664_demand_paging(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off", demand_paging=True)
+
+        def mapped(begin, end):
+            return sum(min(e + 1, end) - max(s, begin) for s, e, _ in ql.uc.mem_regions() if s < end and e >= begin)
+
+        # nothing behind a large anonymous mapping until it is touched
+        base = ql.vma.mmap(0, 0x4000000)
+        self.assertEqual(mapped(base, base + 0x4000000), 0)
+        ql.mem.write(base + 0x123456, b"hi")
+        self.assertEqual(mapped(base, base + 0x4000000), 0x10000)
+        self.assertEqual(ql.mem.read(base + 0x123455, 4), b"\x00hi\x00")
+
+        # file-backed pages come from the file when first read
+        with open("../examples/rootfs/x8664_linux/lib/libc.so.6", "rb") as f:
+            libc = f.read()
+            base = ql.vma.mmap(0, (len(libc) + 0xfff) & ~0xfff, FileSource(f.fileno(), 0, len(libc)))
+        self.assertEqual(mapped(base, base + len(libc)), 0)
+        self.assertEqual(ql.mem.read(base + 0x123450, 0x10), libc[0x123450 : 0x123460])
+        self.assertEqual(ql.mem.read(base, 4), b"\x7fELF")
+        self.assertLessEqual(mapped(base, base + len(libc)), 2 * 0x10000)
+
+        # a file truncated since reads as zeros past its new end
+        with open("test_demand_paging.bin", "wb") as f:
+            f.write(b"A" * 0x20000)
+        with open("test_demand_paging.bin", "rb") as f:
+            base = ql.vma.mmap(0, 0x20000, FileSource(f.fileno(), 0, 0x20000))
+        os.truncate("test_demand_paging.bin", 0x10)
+        self.assertEqual(ql.mem.read(base + 0xc, 8), b"AAAA" + b"\x00" * 4)
+        self.assertEqual(ql.mem.read(base + 0x18000, 4), b"\x00" * 4)
+        os.remove("test_demand_paging.bin")
+
+        # file data given as a buffer is copied in right away
+        base = ql.vma.mmap(0, 0x20000, libc[ : 0x20000])
+        self.assertEqual(mapped(base, base + 0x20000), 0x20000)
+
+        # mapping a file over reserved pages maps them too
+        base = ql.vma.mmap(0, 0x40000)
+        ql.vma.mmap(base + 0x10000, 0x10000, libc[ : 0x10000])
+        self.assertEqual(mapped(base, base + 0x40000), 0x10000)
+        self.assertEqual(ql.mem.read(base + 0x10000, 4), b"\x7fELF")
+
+        # the stack is reserved too, the guest faults its pages in
+        ql.run()
+        del ql
+
+    def test_elf_linux_x8664_gdb_breakpoints(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        dbg = Qldbg()
+        dbg.initialize(ql, exit_point=0xffffffffffffffff, mappings=[(hex(ql.entry_point), 0x10)])
+        dbg.bp_insert(ql.elf_entry)
+
+        # the runner stops on the breakpoint
+        ql.run()
+        self.assertEqual(ql.pc, ql.elf_entry)
+        self.assertEqual(dbg.hit_bp, ql.elf_entry)
+
+        # stepping off a breakpoint does not hit it again
+        dbg.step(ql.pc)
+        self.assertNotEqual(ql.pc, ql.elf_entry)
+        self.assertIsNone(dbg.hit_bp)
+
+        dbg.bp_remove(0, ql.elf_entry, 1)
+        self.assertFalse(dbg.breakpoints)
+        dbg.resume_emu(ql.pc)
+        self.assertIsNone(dbg.hit_bp)
+        del ql
+
+    def test_elf_linux_x8664_gdb_watchpoints(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        dbg = Qldbg()
+        dbg.initialize(ql, exit_point=0xffffffffffffffff, mappings=[(hex(ql.entry_point), 0x10)])
+        dbg.bp_insert(ql.elf_entry)
+        ql.run()
+        dbg.bp_remove(0, ql.elf_entry, 1)
+
+        # _start pops argc off the stack
+        sp = ql.sp
+        dbg.watch_insert('3', sp, 8)
+        dbg.resume_emu(ql.pc)
+        self.assertEqual(dbg.hit_watch, ("rwatch", sp))
+        self.assertEqual(ql.sp, sp + 8)
+        dbg.watch_remove('3', sp, 8)
+
+        # and then pushes below it, the push is done exactly once
+        dbg.watch_insert('2', sp - 0x40, 0x40)
+        dbg.resume_emu(ql.pc)
+        kind, address = dbg.hit_watch
+        self.assertEqual(kind, "watch")
+        self.assertEqual(ql.sp, address)
+        dbg.watch_remove('2', sp - 0x40, 0x40)
+        self.assertFalse(dbg.watchpoints)
+
+        dbg.resume_emu(ql.pc)
+        self.assertIsNone(dbg.hit_watch)
+        del ql
+
+    def test_elf_linux_x8664_gdb_protocol(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        server, client = socket.socketpair()
+        session = GDBSession(ql, server, 0xffffffffffffffff, [(hex(ql.entry_point), 0x10)])
+
+        def packet(data):
+            return b"$%s#%.2x" % (data, sum(data) & 0xff)
+
+        addr = ql.stack_address
+        # 0x7d and 0x23 go escaped, 0x03 inside a packet is no interrupt
+        client.sendall(b"+" + packet(b"qSupported:xmlRegisters=i386") + packet(b"QStartNoAckMode") +
+                       packet(b"X%x,4:\x03}]}\x03A" % addr) + packet(b"m%x,4" % addr) +
+                       packet(b"M%x,2:4243" % (addr + 2)) + packet(b"m%x,4" % addr) +
+                       packet(b"qXfer:features:read:target.xml:0,10") + packet(b"qXfer:memory-map:read::0,10000") +
+                       packet(b"k"))
+        session.run()
+
+        replies = b""
+        while True:
+            data = client.recv(0x10000)
+            if not data:
+                break
+            replies += data
+        client.close()
+
+        # acks stop after QStartNoAckMode
+        self.assertTrue(replies.startswith(b"+$PacketSize=20000;"))
+        self.assertIn(b"+$OK#9a$OK#9a$037d2341#", replies)
+        self.assertIn(b"$OK#9a$037d4243#", replies)
+        self.assertIn(b"$m<?xml version", replies)
+        # the whole stack mapping, not only what is above the initial sp
+        regions = [(int(start, 16), int(start, 16) + int(length, 16)) for start, length in
+                   re.findall(rb"<memory type=\"ram\" start=\"0x([0-9a-f]+)\" length=\"0x([0-9a-f]+)\"/>", replies)]
+        below_sp = ql.sp - 0x1000
+        self.assertTrue(any(s <= below_sp < e for s, e in regions))
+        for s, e, _ in ql.uc.mem_regions():
+            self.assertTrue(any(rs <= s and e < rend for rs, rend in regions))
+        del ql
+
+    def test_elf_linux_futex_queues(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        tm = ThreadManagement(ql)
+        ql.thread_management = tm
+        threads = [Thread(ql, tm) for _ in range(4)]
+        for t in threads[:3]:
+            tm.futex_wait(t, 0x1000, 0x1)
+        tm.futex_wait(threads[3], 0x1000, 0x2)
+        state = tm.save()
+
+        # waiters wake in order, the bitset picks among them
+        self.assertEqual(tm.futex_wake(0x1000, 1), 1)
+        self.assertTrue(threads[0].is_running())
+        self.assertEqual(tm.futex_wake(0x1000, 1, 0x2), 1)
+        self.assertTrue(threads[3].is_running())
+
+        # one woken, the other moved to the second futex
+        self.assertEqual(tm.futex_requeue(0x1000, 0x2000, 1, 5), (1, 1))
+        self.assertTrue(threads[1].is_running())
+        self.assertEqual(threads[2].futex_uaddr, 0x2000)
+        self.assertEqual(tm.futex_wake(0x1000, 10), 0)
+
+        tm.futex_cancel(threads[2])
+        self.assertEqual(tm.futex_wake(0x2000, 10), 0)
+        self.assertFalse(tm.futex_queues)
+
+        # snapshots bring the waiters back
+        tm.load(state)
+        self.assertEqual(list(tm.futex_queues[0x1000]), threads)
+        self.assertTrue(all(t.is_blocking() and t.futex_uaddr == 0x1000 for t in threads))
+        ql.thread_management = None
+        del ql
+
+    def test_elf_linux_reactor(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        tm = ThreadManagement(ql)
+        ql.thread_management = tm
+        reader, sleeper = Thread(ql, tm), Thread(ql, tm)
+        reader.save()
+        a, b = socket.socketpair()
+        ql.file_des[5] = ql_socket(a)
+        buf = ql.stack_address
+
+        # read() on an empty socket parks the thread instead of the host, while
+        # another one can run
+        tm.add_running_thread(sleeper)
+        tm.cur_thread = reader
+        syscall.ql_syscall_read(ql, 5, buf, 0x10, 0, 0, 0)
+        self.assertTrue(reader.is_blocking())
+        self.assertFalse(tm.reactor.poll())
+
+        tm.wait_until(sleeper, 500)
+        self.assertEqual(tm.reactor.next_deadline(), 500)
+        tm.reactor.expire(499)
+        self.assertTrue(sleeper.is_blocking())
+        tm.reactor.expire(500)
+        self.assertTrue(sleeper.is_running())
+
+        # the data wakes it, and completes the syscall it sleeps in
+        b.send(b"qiling")
+        self.assertTrue(tm.reactor.poll(1))
+        self.assertTrue(reader.is_running())
+        self.assertEqual(ql.mem.read(buf, 6), b"qiling")
+        ql.uc.context_restore(reader.context)
+        self.assertEqual(ql.uc.reg_read(UC_X86_REG_RAX), 6)
+        self.assertFalse(tm.reactor.waiters)
+
+        # select on exceptfds only, without a timeout, waits on the fd too and is
+        # not done by plain data
+        ql.mem.write(buf, b"\x20" + b"\x00" * 7)
+        syscall.ql_syscall__newselect(ql, 6, 0, 0, buf, 0, 0)
+        self.assertTrue(reader.is_blocking())
+        self.assertIn(a.fileno(), tm.reactor.waiters)
+        b.send(b"qiling")
+        tm.reactor.poll(1)
+        self.assertTrue(reader.is_blocking())
+
+        # closing the fd wakes it with EBADF
+        syscall.ql_syscall_close(ql, 5, 0, 0, 0, 0, 0)
+        self.assertTrue(reader.is_running())
+        self.assertFalse(tm.reactor.waiters)
+        ql.uc.context_restore(reader.context)
+        self.assertEqual(ql.uc.reg_read(UC_X86_REG_RAX), 2 ** 64 - 9)
+
+        tm.cur_thread = None
+        tm.clean_world()
+        # closed by the guest already
+        a.detach()
+        b.close()
+        ql.thread_management = None
+        del ql
+
+    def test_elf_linux_x86_thread_schedule(self):
+        def schedule(timeout=0):
+            ql = Qiling(["../examples/rootfs/x86_linux/bin/x86_multithreading"], "../examples/rootfs/x86_linux", output="off")
+            ql.multithread = True
+            ql.set_timeout(timeout)
+            ql.run()
+            tm = ql.thread_management
+            counts = [t.charged_insns for t in tm.ending_threads]
+            self.assertEqual(tm.charged_insns, sum(counts))
+            self.assertEqual(tm.runing_time, tm.idle_time + tm.charged_insns // 100)
+            # the run released its selector
+            self.assertIsNone(tm.reactor.selector)
+            del ql
+            return counts, tm.runing_time
+
+        # instruction count slices, the same interleaving on every run
+        self.assertEqual(schedule(), schedule())
+
+        # with a timeout the only thread runs in slices too, to check it between them
+        counts, _ = schedule()
+        timed, _ = schedule(100000000)
+        self.assertEqual(timed[ : 2], counts[ : 2])
+        self.assertGreater(timed[2], counts[2])
+        self.assertEqual(timed[2] % 1000, 0)
+
+    def test_elf_parse_headers(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        elf = ELFParse(ql.path, ql)
+
+        phdrs = elf.parse_program_header(ql)
+        self.assertIs(phdrs, elf.parse_program_header(ql))
+        self.assertEqual(elf.elfhead.e_phnum, len(phdrs))
+
+        # segments are views on the file mapping, loaded as is
+        text = [p for p in phdrs if p.p_type == PT_LOAD][0]
+        seg = elf.getelfdata(text.p_offset, text.p_filesz)
+        self.assertIsInstance(seg, memoryview)
+        self.assertEqual(ql.mem.read(ql.loadbase + text.p_vaddr, 0x40), seg[ : 0x40].tobytes())
+
+        seg.release()
+        elf.close()
+        del ql
+
+
+    def test_elf_image_cache(self):
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        ql.run()
+        del ql
+
+        # the second instance maps ld.so and libc from the cache
+        hits = ql_image_cache.hits
+        ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+        ql.run()
+        self.assertGreaterEqual(ql_image_cache.hits - hits, 3)
+        del ql
+
+        cache = ImageCache(max_bytes=0x10)
+        with open("test_image_cache.bin", "wb") as f:
+            f.write(b"A" * 0x10)
+        first = cache.get("test_image_cache.bin")
+        self.assertIs(first, cache.get("test_image_cache.bin"))
+
+        # a changed file is a new image, the old one is dropped
+        with open("test_image_cache.bin", "ab") as f:
+            f.write(b"B" * 0x10)
+        second = cache.get("test_image_cache.bin")
+        self.assertIsNot(first, second)
+        self.assertEqual(bytes(second.getdata(0x18, 0x10)), b"B" * 8)
+        self.assertEqual(len(cache.images), 1)
+
+        # over max_bytes the least recently used goes
+        cache.get("../examples/rootfs/x8664_linux/bin/x8664_hello")
+        self.assertEqual(len(cache.images), 1)
+        self.assertEqual(cache.total, os.path.getsize("../examples/rootfs/x8664_linux/bin/x8664_hello"))
+
+        # an open file is mapped from its fd, unlinked or replaced under its path
+        cache = ImageCache()
+        f = open("test_image_cache.bin", "rb")
+        os.remove("test_image_cache.bin")
+        with open("test_image_cache.bin", "wb") as g:
+            g.write(b"C" * 0x20)
+        old = cache.get_fd(f.fileno())
+        new = cache.get("test_image_cache.bin")
+        self.assertIsNot(old, new)
+        self.assertEqual(bytes(old.getdata(0x18, 8)), b"B" * 8)
+        self.assertEqual(bytes(new.getdata(0x18, 8)), b"C" * 8)
+        f.close()
+        os.remove("test_image_cache.bin")
+
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -3,11 +3,17 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
-import sys
+import os, shutil, struct, sys
 sys.path.insert(0, "..")
 
 from qiling import *
 from qiling.exception import *
+from qiling.loader.dllcache import ql_dll_cache_load, ql_dll_cache_path, ql_dll_cache_store
+from qiling.loader.imagecache import ql_image_cache
+from qiling.os.memory import Heap
+from qiling.os.windows.const import HEAP_ZERO_MEMORY
+from qiling.os.windows.dlls.kernel32.heapapi import _heap_alloc, _heap_create
+from qiling.os.windows.registry import *
 from qiling.os.windows.fncc import *
 from qiling.os.windows.utils import *
 
@@ -31,6 +37,173 @@ def test_pe_win_x86_hello():
     del ql
 
 
+def test_pe_win_x86_hello_lazy_dlls():
+    ql = Qiling(["../examples/rootfs/x86_windows/bin/x86_hello.exe"], "../examples/rootfs/x86_windows",
+                output="default", lazy_dlls=True)
+    # imports are bound on their first call, dlls nobody calls into stay unmapped
+    reserved = len(ql.PE.reserved_dlls)
+    assert reserved
+    ql.run()
+    assert len(ql.PE.reserved_dlls) < reserved
+    del ql
+
+
+def test_windowssc_x86_lazy_dlls():
+    # the shellcode walks the PEB and parses kernel32 exports itself, reading maps it
+    ql = Qiling(shellcoder=X86_WIN, archtype="x86", ostype="windows", rootfs="../examples/rootfs/x86_windows",
+                output="default", lazy_dlls=True)
+    ql.run()
+    assert "kernel32.dll" not in ql.PE.reserved_dlls
+    del ql
+
+
+def test_pe_win_x86_hello_libcache():
+    # the second run maps the images of the dlls from their cache files
+    for _ in range(2):
+        ql = Qiling(["../examples/rootfs/x86_windows/bin/x86_hello.exe"], "../examples/rootfs/x86_windows",
+                    output="default", libcache=True)
+        ql.run()
+        del ql
+
+
+def test_pe_dll_cache():
+    with open("test_dll_cache.dll", "wb") as f:
+        f.write(b"MZ" + b"A" * 0x100)
+    assert ql_dll_cache_load("test_dll_cache.dll", 0x10000000) is None
+
+    exports = [(b"ExitProcess", 1, 0x1234), (None, 2, 0x5678)]
+    fcache = ql_dll_cache_store("test_dll_cache.dll", 0x10000000, b"B" * 0x2000, exports)
+    data, cached = ql_dll_cache_load("test_dll_cache.dll", 0x10000000)
+    assert bytes(data) == b"B" * 0x2000
+    assert cached == exports
+    # another load base is another file
+    assert ql_dll_cache_load("test_dll_cache.dll", 0x20000000) is None
+    # the dll is hashed once per cached image
+    digest = ql_image_cache.get("test_dll_cache.dll").headers["sha1"]
+    assert ql_dll_cache_path("test_dll_cache.dll", 0x20000000).endswith(".20000000.%s.cache" % digest[ : 16])
+    os.remove(fcache)
+    os.remove("test_dll_cache.dll")
+
+
+def build_registry_hive(path):
+    # SOFTWARE hive with a single Microsoft\\Windows key holding Version = 10
+    cells = bytearray()
+
+    def cell(data):
+        offset = 0x20 + len(cells)
+        size = (len(data) + 4 + 7) & ~7
+        cells.extend(struct.pack("<i", -size) + data + b"\x00" * (size - len(data) - 4))
+        return offset
+
+    def nk(name, flags, parent, subkey=None, value=None):
+        data = bytearray(0x4c)
+        data[0 : 4] = b"nk" + struct.pack("<H", flags | 0x20)
+        struct.pack_into("<I", data, 0x10, parent)
+        struct.pack_into("<II", data, 0x14, 1 if subkey else 0, 0)
+        struct.pack_into("<I", data, 0x1c, subkey or 0xffffffff)
+        struct.pack_into("<II", data, 0x24, 1 if value else 0, value or 0xffffffff)
+        struct.pack_into("<H", data, 0x48, len(name))
+        return bytes(data) + name
+
+    def lf(key):
+        return b"lf" + struct.pack("<HII", 1, key, 0)
+
+    vk = cell(b"vk" + struct.pack("<HIIIHH", 7, 0x80000004, 10, Registry.RegDWord, 1, 0) + b"Version")
+    values = cell(struct.pack("<I", vk))
+    # cells are appended in order, so the offsets of the keys are known up front
+    size = lambda name: (0x4c + len(name) + 4 + 7) & ~7
+    root = 0x20 + len(cells)
+    microsoft = root + size(b"ROOT")
+    windows = microsoft + size(b"Microsoft")
+    root_list = windows + size(b"Windows")
+    microsoft_list = root_list + 0x10
+    assert cell(nk(b"ROOT", 0x4, 0, root_list)) == root
+    assert cell(nk(b"Microsoft", 0, root, microsoft_list)) == microsoft
+    assert cell(nk(b"Windows", 0, microsoft, None, values)) == windows
+    assert cell(lf(microsoft)) == root_list
+    assert cell(lf(windows)) == microsoft_list
+
+    cells.extend(struct.pack("<i", 0x1000 - 0x20 - len(cells)))
+    cells.extend(b"\x00" * (0x1000 - 0x20 - len(cells)))
+    header = b"regf" + b"\x00" * 0x20 + struct.pack("<II", root, 0x1000)
+    hbin = b"hbin" + struct.pack("<II", 0, 0x1000) + b"\x00" * 0x14
+    with open(path, "wb") as f:
+        f.write(header + b"\x00" * (0x1000 - len(header)) + hbin + cells)
+
+
+def test_pe_registry():
+    os.makedirs("test_registry", exist_ok=True)
+    build_registry_hive("test_registry/SOFTWARE")
+    ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux",
+                output="off", log_dir="test_registry")
+
+    for indexed in (False, True):
+        if indexed:
+            ql_registry_build_index("test_registry/SOFTWARE")
+        registry = RegistryManager(ql, hive="test_registry")
+        # nothing is opened before the first lookup
+        assert not registry.hives
+        assert registry.exists("HKEY_LOCAL_MACHINE\\SOFTWARE\\microsoft\\Windows")
+        assert not registry.exists("HKEY_LOCAL_MACHINE\\SOFTWARE\\Microsoft\\Linux")
+        assert registry.read("HKEY_LOCAL_MACHINE\\SOFTWARE\\Microsoft\\Windows", "Version", Registry.RegNone) == (Registry.RegDWord, 10)
+        assert registry.read("HKEY_LOCAL_MACHINE\\SOFTWARE\\Microsoft\\Windows", "Version", Registry.RegSZ) == (None, None)
+        assert list(registry.hives) == ["SOFTWARE"]
+        assert (registry.hives["SOFTWARE"].index is not None) == indexed
+
+    shutil.rmtree(ql.log_dir)
+    del ql
+    shutil.rmtree("test_registry")
+
+
+def test_pe_heap():
+    ql = Qiling(["../examples/rootfs/x8664_linux/bin/x8664_hello"], "../examples/rootfs/x8664_linux", output="off")
+    heap = Heap(ql, 0x50000000, 0x50100000)
+
+    a = heap.mem_alloc(0x20)
+    b = heap.mem_alloc(0x30)
+    c = heap.mem_alloc(0x10)
+    assert (b - a, c - b) == (0x20, 0x30)
+    assert heap.mem_size(b) == 0x30
+    assert heap.mem_size(heap.mem_alloc(1)) == 0x10
+    assert heap.mem_size(a + 8) == 0
+
+    # freed neighbours merge, the merged chunk is split again
+    assert heap.mem_free(a)
+    assert heap.mem_free(b)
+    assert not heap.mem_free(b)
+    assert heap.mem_size(b) == 0
+    assert heap.mem_alloc(0x40) == a
+    assert heap.mem_alloc(0x10) == a + 0x40
+
+    # growth past the first 64k maps more
+    big = heap.mem_alloc(0x18000)
+    assert big != 0
+    assert heap.current_alloc >= 0x20000
+    ql.mem.write(big + 0x17ff0, b"A" * 0x10)
+
+    # realloc keeps the contents, cut to the new size
+    ql.mem.write(c, b"0123456789abcdef")
+    d = heap.mem_realloc(c, 0x100)
+    assert bytes(ql.mem.read(d, 0x10)) == b"0123456789abcdef"
+    e = heap.mem_realloc(d, 8)
+    assert bytes(ql.mem.read(e, 8)) == b"01234567"
+    assert heap.mem_alloc(0x100000) == 0
+
+    # HeapCreate arenas, one with a maximum size does not spill into the process heap
+    ql.heap = heap
+    ql.heaps = {}
+    fixed = _heap_create(ql, 0, 0x2000)
+    assert _heap_alloc(ql, fixed, 0, 0x1000) != 0
+    assert _heap_alloc(ql, fixed, 0, 0x1000) != 0
+    assert _heap_alloc(ql, fixed, 0, 0x10) == 0
+    growable = _heap_create(ql, 0, 0)
+    assert _heap_alloc(ql, growable, 0, 0x10000) != 0
+    spilled = _heap_alloc(ql, growable, HEAP_ZERO_MEMORY, 0x10)
+    assert spilled in heap.chunks
+    assert bytes(ql.mem.read(spilled, 0x10)) == b"\x00" * 0x10
+    del ql
+
+
 def test_pe_win_x86_multithread():
     ql = Qiling(["../examples/rootfs/x86_windows/bin/MultiThread.exe"], "../examples/rootfs/x86_windows")
     ql.run()
@@ -225,6 +398,11 @@ def test_pe_win_x86_bruteforcecrackme():
 if __name__ == "__main__":
     test_pe_win_x8664_hello()
     test_pe_win_x86_hello()
+    test_pe_win_x86_hello_lazy_dlls()
+    test_pe_win_x86_hello_libcache()
+    test_pe_dll_cache()
+    test_pe_registry()
+    test_pe_heap()
     test_pe_win_x86_multithread()
     test_pe_win_x86_clipboard()
     test_pe_win_x86_tls()
@@ -3,7 +3,7 @@
 # Cross Platform and Multi Architecture Advanced Binary Emulation Framework
 # Built on top of Unicorn emulator (www.unicorn-engine.org) 
 
-import sys, subprocess
+import json, os, sys, subprocess
 sys.path.append("..")
 from qiling import *
 from qiling.exception import *
@@ -23,6 +23,60 @@ def testshellcode():
     except subprocess.CalledProcessError as e:    
         raise RuntimeError("command '{}' return with error (code {}): {}".format(e.cmd, e.returncode, e.output))    
 
+def testbatch():
+    jobs = [
+        {"id": "hello", "filename": "../examples/rootfs/x8664_linux/bin/x8664_hello", "rootfs": "../examples/rootfs/x8664_linux"},
+        {"id": "args", "filename": "../examples/rootfs/x8664_linux/bin/x8664_args", "rootfs": "../examples/rootfs/x8664_linux", "argv": ["test1"]},
+        {"id": "execve", "shellcode": "../examples/shellcodes/lin64_execve.hex", "format": "hex", "arch": "x8664", "os": "linux", "rootfs": "../examples/rootfs/x8664_linux"},
+        {"id": "missing", "filename": "../examples/rootfs/x8664_linux/bin/no_such_file", "rootfs": "../examples/rootfs/x8664_linux"},
+        {"id": "timeout", "filename": "../examples/rootfs/x8664_linux/bin/x8664_hello_static", "rootfs": "../examples/rootfs/x8664_linux", "timeout": 1},
+    ]
+    with open("batch_jobs.json", "w") as f:
+        f.write("\n".join(json.dumps(job) for job in jobs))
+
+    create = [sys.executable, '../qltool', 'batch', '--manifest', 'batch_jobs.json', '--workers', '2', '--max-jobs', '1']
+    try:
+        output = subprocess.run(create, stdout=subprocess.PIPE).stdout
+    finally:
+        os.remove("batch_jobs.json")
+
+    results = {r["id"]: r for r in map(json.loads, output.decode().splitlines())}
+    assert results["hello"]["status"] == "ok"
+    assert results["hello"]["stdout"] == "Hello, World!\n"
+    assert results["hello"]["syscalls"]["ql_syscall_write"] == 1
+    assert "test1" in results["args"]["stdout"]
+    assert results["execve"]["syscalls"] == {"ql_syscall_execve": 1}
+    assert results["missing"]["status"] == "error"
+    assert results["timeout"]["status"] == "timeout"
+    assert results["timeout"]["stdout"] == ""
+
+def testbatch_crash():
+    import qiling.batch
+    run_job = qiling.batch.ql_batch_run_job
+
+    def crash_job(job, stdout_limit):
+        if job["id"] == "crash":
+            os._exit(11)
+        return run_job(job, stdout_limit)
+
+    hello = {"filename": "../examples/rootfs/x8664_linux/bin/x8664_hello_static", "rootfs": "../examples/rootfs/x8664_linux"}
+    jobs = [dict(hello, id="before"), dict(hello, id="crash"), dict(hello, id="after1"), dict(hello, id="after2")]
+
+    # workers are forked and pick up the patched job runner
+    qiling.batch.ql_batch_run_job = crash_job
+    try:
+        results = {r["id"]: r for r in qiling.batch.BatchRunner(workers=1, max_jobs=4).run(jobs)}
+    finally:
+        qiling.batch.ql_batch_run_job = run_job
+
+    assert results["crash"]["status"] == "crash"
+    assert results["crash"]["exception"] == "worker exited with code 11"
+    for name in ("before", "after1", "after2"):
+        assert results[name]["status"] == "ok"
+        assert results[name]["stdout"] == "Hello, World!\n"
+
 if __name__ == "__main__":
     testexec_args()
     testshellcode()
+    testbatch()
+    testbatch_crash()